@@ -6,6 +6,15 @@ import matplotlib.pyplot as plt
 from pathlib import Path
 from tqdm import tqdm
 import matplotlib
+import bar_store
+import breakout_alerts
+import catalog
+import profiler
+import ranking
+from catalog import parse_ticker_name
+import sharding
+import snapshot_store
+import trading_calendar
 
 # 強制使用 Agg 後端以確保在 GitHub Actions 等無界面環境穩定執行
 matplotlib.use('Agg')
@@ -18,6 +27,75 @@ plt.rcParams['axes.unicode_minus'] = False
 BIN_SIZE = 10.0
 X_MIN, X_MAX = -100, 100
 BINS = np.arange(X_MIN, X_MAX + 1, BIN_SIZE)
+# 繪圖/快照用分箱：最後多一格收納 >100% 的極端值
+PLOT_BINS = np.append(BINS, X_MAX + BIN_SIZE)
+# K 線數不足者不列入分析
+MIN_BARS = 20
+
+# 串流分析：每批彙整的標的數；設定記憶體上限 (MB) 時會依預算縮小批次並只保留報表所需欄位
+STREAM_CHUNK = 500
+MAX_MEMORY_ENV = "STOCK_MONITOR_MAX_MEMORY_MB"
+# 估算用：每檔常駐 (代號/名稱字串) 與每個批次中暫存值的位元組數
+TICKER_BYTES = 160
+BUFFERED_VALUE_BYTES = 64
+
+# ========== 回溯區間設定 ==========
+# (名稱, 中文標籤, 交易日數)；交易日數為 "ytd" 時依最後一根 K 線所在年度計算，
+# 為 "36M" / "104W" 時改以月 K / 週 K 根數計算 (讀 bar_store 衍生庫，多年期不必掃描日 K)
+PERIODS = [
+    ("Week", "週", 5),
+    ("Month", "月", 20),
+    ("Quarter", "季", 60),
+    ("Half", "半年", 120),
+    ("Year", "年", 250),
+    ("YTD", "年初至今", "ytd"),
+]
+# 預設只對週/月/年繪圖並列出公司清單，其餘區間僅寫入 DataFrame 欄位 (幾乎不增加計算量)
+CHART_PERIODS = ["Week", "Month", "Year"]
+REPORT_PERIODS = ["Week", "Month", "Year"]
+
+# 報酬型態：(欄位後綴, 中文標籤, 顏色)
+RETURN_TYPES = [("High", "最高-進攻", "#28a745"), ("Close", "收盤-實質", "#007bff"), ("Low", "最低-防禦", "#dc3545")]
+
+def parse_periods(spec):
+    """
+    解析區間設定字串，例如 "Week,Month,Quarter,YTD,D90:90,Y3:36M"：
+    已知名稱沿用 PERIODS；"名稱:天數" 為自訂回溯交易日數，"名稱:36M" / "名稱:104W" 為月 K / 週 K 根數。
+    長度須為正整數；名稱不得含 "_" (報表與訂閱以 "名稱_High" 拆解欄位)，不合法時拋出 ValueError
+    """
+    known = {p[0]: p for p in PERIODS}
+    periods = []
+    for token in [t.strip() for t in spec.split(",") if t.strip()]:
+        if ":" in token:
+            name, days = token.split(":", 1)
+            name, days = name.strip(), days.strip().upper()
+            if not name or "_" in name:
+                raise ValueError(f"區間名稱不可為空或包含 '_': {token}")
+            bp = bar_period(days)
+            n = bp[1] if bp else (int(days) if days.lstrip("-").isdigit() else None)
+            if n is None or n <= 0:
+                raise ValueError(f"區間長度必須是正整數 (交易日數或 36M / 104W): {token}")
+            if bp:
+                periods.append((name, f"{bp[1]}{'週' if bp[0] == 'week' else '個月'}", days))
+            else:
+                periods.append((name, f"{n}日", n))
+        elif token in known:
+            periods.append(known[token])
+        else:
+            raise ValueError(f"未知的區間名稱: {token}")
+    return periods
+
+def bar_period(days):
+    """區間長度為 "36M" / "104W" 時回傳 (週期, 根數)，否則 None"""
+    suffixes = {suffix: freq for freq, (_, suffix) in bar_store.FREQS.items()}
+    if isinstance(days, str) and days[:-1].isdigit() and days[-1:] in suffixes:
+        return suffixes[days[-1]], int(days[:-1])
+    return None
+
+def period_label(name, periods=None):
+    for p_name, p_zh, _ in (periods or PERIODS):
+        if p_name == name: return p_zh
+    return name
 
 def get_market_url(market_id, ticker):
     """
@@ -93,78 +171,278 @@ def build_company_list(arr_pct, codes, names, bins, market_id):
 
     return "\n".join(lines)
 
-def run_global_analysis(market_id="tw-share"):
+def ytd_days(dates):
+    """最後一根 K 線所在年度的交易日數 (dates 為已排序的 ISO 日期字串)"""
+    if dates is None or len(dates) == 0: return None
+    year = str(dates[-1])[:4]
+    return len(dates) - int(np.searchsorted(dates, f"{year}-"))
+
+def compute_returns(close, high, low, dates=None, periods=None):
     """
-    分析主邏輯：讀取 CSV -> 計算回報率 -> 繪製分布圖 -> 生成文字報表
+    一次掃描計算所有回溯區間的最高、收盤、最低報酬率 (%)：
+    由尾端反向累積最大/最小值，suffix_max[k-1] 即最近 k 根 K 線的最高價，
+    因此不論設定多少個區間，每檔都只需 O(n) 一次，各區間再以 O(1) 查表。
     """
-    market_label = market_id.upper()
-    print(f"📊 正在啟動 {market_label} 深度矩陣分析...")
-    
-    data_path = Path("./data") / market_id / "dayK"
-    image_out_dir = Path("./output/images") / market_id
-    image_out_dir.mkdir(parents=True, exist_ok=True)
-    
-    all_files = list(data_path.glob("*.csv"))
-    if not all_files:
-        print(f"⚠️ 找不到 {market_id} 的 CSV 數據檔案。")
-        return [], pd.DataFrame(), {}
+    row = {}
+    periods = periods or PERIODS
+    n = len(close)
+    if n < 2: return row
+    # fmax/fmin 會略過 NaN (缺值的 K 線)
+    suffix_max = np.fmax.accumulate(np.asarray(high, dtype=float)[::-1])
+    suffix_min = np.fmin.accumulate(np.asarray(low, dtype=float)[::-1])
+    last_c = close[-1]
+    for p_name, _, days in periods:
+        # 週 K / 月 K 區間由 compute_bar_returns 另外計算
+        if bar_period(days): continue
+        if days == "ytd":
+            days = ytd_days(dates)
+            if not days: continue
+        if n <= days: continue
+        prev_c = close[-(days+1)]
+        if not prev_c > 0: continue
+        row[f'{p_name}_High'] = (suffix_max[days-1] - prev_c) / prev_c * 100
+        row[f'{p_name}_Close'] = (last_c - prev_c) / prev_c * 100
+        row[f'{p_name}_Low'] = (suffix_min[days-1] - prev_c) / prev_c * 100
+    return row
+
+def compute_bar_returns(day_path, periods):
+    """以週 K / 月 K 衍生庫計算 "36M" / "104W" 型區間 (每檔只讀數十根 K 線)"""
+    by_freq = {}
+    for p_name, p_zh, days in periods:
+        bp = bar_period(days)
+        if bp: by_freq.setdefault(bp[0], []).append((p_name, p_zh, bp[1]))
+    row = {}
+    for freq, plist in by_freq.items():
+        bars = bar_store.bars_for(day_path, freq)
+        if bars is None or bars.empty: continue
+        row.update(compute_returns(bars['close'].values, bars['high'].values, bars['low'].values, None, plist))
+    return row
+
+class OnlineHistogram:
+    """
+    固定分箱的線上直方圖：逐批 add / remove，不保留原始數值。
+    超出邊界的值併入首/末格 (與分布圖一致)；分位數以格內線性插值估計。
+    """
+    def __init__(self, edges=PLOT_BINS):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.n = 0
+        self.total = 0.0
+        self.up = 0
+
+    def _bin(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        clipped = np.clip(values, self.edges[0], self.edges[-1])
+        idx = np.clip(np.searchsorted(self.edges, clipped, side="right") - 1, 0, len(self.counts) - 1)
+        return values, np.bincount(idx, minlength=len(self.counts))
+
+    def add(self, values):
+        values, counts = self._bin(values)
+        self.counts += counts
+        self.n += len(values)
+        self.total += float(values.sum())
+        self.up += int((values > 0).sum())
+
+    def remove(self, values):
+        values, counts = self._bin(values)
+        self.counts -= counts
+        self.n -= len(values)
+        self.total -= float(values.sum())
+        self.up -= int((values > 0).sum())
+
+    def merge(self, other):
+        """加總另一個相同分箱的直方圖 (分片合併)"""
+        self.counts += other.counts
+        self.n += other.n
+        self.total += other.total
+        self.up += other.up
+
+    def state(self):
+        return {"edges": self.edges.tolist(), "counts": self.counts.tolist(),
+                "n": int(self.n), "total": self.total, "up": int(self.up)}
+
+    @classmethod
+    def from_state(cls, state):
+        hist = cls(state["edges"])
+        hist.counts = np.asarray(state["counts"], dtype=np.int64)
+        hist.n, hist.total, hist.up = int(state["n"]), float(state["total"]), int(state["up"])
+        return hist
+
+    def quantile(self, q):
+        if self.n == 0: return float("nan")
+        cum = np.cumsum(self.counts)
+        target = q * self.n
+        i = int(np.searchsorted(cum, target))
+        i = min(i, len(self.counts) - 1)
+        before = cum[i - 1] if i > 0 else 0
+        frac = (target - before) / self.counts[i] if self.counts[i] else 0.0
+        return float(self.edges[i] + frac * (self.edges[i + 1] - self.edges[i]))
+
+    def summary(self):
+        """與 snapshot_store.metric_summary 相同格式 (分位數為估計值)"""
+        if self.n == 0: return None
+        return {
+            "n": int(self.n), "counts": self.counts.tolist(),
+            "mean": round(self.total / self.n, 3), "median": round(self.quantile(0.5), 3),
+            "p10": round(self.quantile(0.1), 3), "p90": round(self.quantile(0.9), 3),
+            "up_share": round(self.up / self.n * 100, 3), "approx": True,
+        }
+
+class StreamingAnalysis:
+    """
+    分批彙整每檔報酬：各指標以 OnlineHistogram 累加、>100% 飆股逐批收集，
+    只保留 keep_columns 的 float32 欄位 (公司清單等報表所需)，其餘數值彙整後即丟棄。
+    """
+    def __init__(self, columns, keep_columns=None, chunk_size=STREAM_CHUNK, extreme_floor=100.0):
+        self.columns = list(columns)
+        self.keep = [c for c in self.columns if keep_columns is None or c in keep_columns]
+        self.chunk_size = max(1, int(chunk_size))
+        self.extreme_floor = extreme_floor
+        self.hists = {c: OnlineHistogram() for c in self.columns}
+        self.extremes = {}
+        # 52 週新高 / 新低警示 {種類: [[代號, 名稱, 價格, 前極值], ...]} (breakout_alerts)
+        self.alerts = {}
+        self.tickers, self.names = [], []
+        self._kept = {c: [] for c in self.keep}
+        self._buf = []
+
+    def add(self, ticker, name, row):
+        self._buf.append((ticker, name, row))
+        if len(self._buf) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buf: return
+        tickers = [b[0] for b in self._buf]
+        for col in self.columns:
+            values = np.array([b[2].get(col, np.nan) for b in self._buf], dtype=np.float32)
+            self.hists[col].add(values)
+            if col.endswith("_High"):
+                hit = np.nonzero(values >= self.extreme_floor)[0]
+                if len(hit):
+                    self.extremes.setdefault(col[:-len("_High")], []).extend((tickers[i], float(values[i])) for i in hit)
+            if col in self._kept:
+                self._kept[col].append(values)
+        self.tickers.extend(tickers)
+        self.names.extend(b[1] for b in self._buf)
+        self._buf = []
+
+    def absorb(self, frame, hists, extremes, alerts=None):
+        """併入另一批已彙整的結果 (分片的 frame()、直方圖、飆股清單與新高新低警示)"""
+        self.flush()
+        self.tickers.extend(frame['Ticker'].tolist())
+        self.names.extend(frame['Full_Name'].tolist())
+        for col in self.keep:
+            self._kept[col].append(frame[col].values.astype(np.float32))
+        for col, hist in hists.items():
+            if col in self.hists: self.hists[col].merge(hist)
+        for p, rows in extremes.items():
+            self.extremes.setdefault(p, []).extend((t, float(v)) for t, v in rows)
+        for kind, rows in (alerts or {}).items():
+            self.alerts.setdefault(kind, []).extend(rows)
+
+    def frame(self):
+        """報表用的精簡 DataFrame (Ticker, Full_Name 與保留欄位)"""
+        self.flush()
+        data = {'Ticker': self.tickers, 'Full_Name': self.names}
+        for col in self.keep:
+            data[col] = np.concatenate(self._kept[col]) if self._kept[col] else np.array([], dtype=np.float32)
+        return pd.DataFrame(data)
+
+    def sorted_extremes(self):
+        return {p: [[t, round(v, 1)] for t, v in sorted(rows, key=lambda r: -r[1])] for p, rows in self.extremes.items()}
+
+def plan_stream(n_files, n_columns, n_report_columns, max_memory_mb=None):
+    """
+    依記憶體上限決定 (批次大小, 是否保留全部欄位)：
+    未設定上限時保留全部欄位 (快照統計為精確值)；預算不足時只保留報表欄位，其餘指標僅留直方圖。
+    """
+    if max_memory_mb is None:
+        max_memory_mb = float(os.getenv(MAX_MEMORY_ENV, "0") or 0) or None
+    if not max_memory_mb:
+        return STREAM_CHUNK, True
+    budget = max_memory_mb * 1024 * 1024
+    keep_all = n_files * (TICKER_BYTES + 4 * n_columns) <= budget / 2
+    resident = n_files * (TICKER_BYTES + 4 * (n_columns if keep_all else n_report_columns))
+    chunk = int((budget - resident) / 2 / max(1, BUFFERED_VALUE_BYTES * n_columns))
+    return max(50, min(STREAM_CHUNK, chunk)), keep_all
 
-    results = []
-    for f in tqdm(all_files, desc=f"分析 {market_label} 數據"):
+def read_prices(path):
+    """分析用的日 K 欄位 (date/close/high/low)"""
+    return pd.read_csv(path, usecols=lambda c: c.lower() in ("date", "close", "high", "low"))
+
+def stream_market_returns(all_files, market_id, periods=None, max_memory_mb=None, keep_columns=None, tracker=None,
+                          loader=read_prices):
+    """
+    逐檔讀取 CSV 並計算報酬率，以 StreamingAnalysis 分批彙整；tracker 為 breakout_alerts 的新高新低狀態。
+    loader(路徑) 回傳日 K 欄位 (常駐服務以記憶體中的價格面板取代逐檔讀檔)
+    """
+    columns = [f"{p[0]}_{t[0]}" for p in (periods or PERIODS) for t in RETURN_TYPES]
+    report_cols = keep_columns or [f"{p}_High" for p in REPORT_PERIODS]
+    chunk, keep_all = plan_stream(len(all_files), len(columns), len(report_cols), max_memory_mb)
+    agg = StreamingAnalysis(columns, None if keep_all else report_cols, chunk)
+    use_bars = any(bar_period(p[2]) for p in (periods or PERIODS))
+    for f in tqdm(all_files, desc=f"分析 {market_id.upper()} 數據"):
         try:
-            df = pd.read_csv(f)
-            if len(df) < 20: continue
-            df.columns = [c.lower() for c in df.columns]
-            close, high, low = df['close'].values, df['high'].values, df['low'].values
-            
-            # 解析代號與名稱
-            stem = f.name.replace(".csv", "")
-            
-            # 多國檔名解析策略
-            if market_id in ["hk-share", "jp-share", "kr-share"]:
-                # 港日韓多為單一代號格式 (如 7203.T.csv 或 005930.KS.csv)
-                tkr = stem
-                nm = stem
-            elif "_" in stem:
-                # 台、美、中 (如 AAPL_Apple.csv 或 600519_貴州茅台.csv)
-                tkr, nm = stem.split('_', 1)
-            else:
-                tkr, nm = stem, stem
-                
-            row = {'Ticker': tkr, 'Full_Name': nm}
-            
-            periods = [('Week', 5), ('Month', 20), ('Year', 250)]
-            for p_name, days in periods:
-                if len(close) <= days: continue
-                prev_c = close[-(days+1)]
-                if prev_c <= 0: continue
-                row[f'{p_name}_High'] = (max(high[-days:]) - prev_c) / prev_c * 100
-                row[f'{p_name}_Close'] = (close[-1] - prev_c) / prev_c * 100
-                row[f'{p_name}_Low'] = (min(low[-days:]) - prev_c) / prev_c * 100
-            results.append(row)
+            with profiler.stage("load"):
+                df = loader(f)
+            if len(df) < MIN_BARS: continue
+            with profiler.stage("returns"):
+                df.columns = [c.lower() for c in df.columns]
+                close, high, low = df['close'].values, df['high'].values, df['low'].values
+                dates = df['date'].astype(str).values if 'date' in df.columns else None
+
+                row = compute_returns(close, high, low, dates, periods)
+                if use_bars: row.update(compute_bar_returns(f, periods))
+
+                tkr, nm = parse_ticker_name(f.name.replace(".csv", ""), market_id)
+                agg.add(tkr, nm, row)
+            if tracker is not None and dates is not None:
+                with profiler.stage("alerts"):
+                    tracker.update(tkr, nm, dates, high, low, close)
         except: continue
+    agg.flush()
+    if tracker is not None:
+        tracker.save()
+        agg.alerts = tracker.alerts
+    return agg
 
-    df_res = pd.DataFrame(results)
-    if df_res.empty: return [], df_res, {}
+def load_market_returns(all_files, market_id, periods=None):
+    """逐檔讀取 CSV 並計算報酬率，回傳每檔一列的 DataFrame"""
+    return stream_market_returns(all_files, market_id, periods).frame()
 
-    # --- 繪圖邏輯 ---
+def render_histograms(df_res, market_id, image_out_dir, chart_periods=None, periods=None):
+    """依區間設定繪製報酬分布圖 (每區間 最高/收盤/最低 三張)，回傳圖檔資訊清單"""
+    hists = {}
+    for col in df_res.columns:
+        if col in ('Ticker', 'Full_Name'): continue
+        hists[col] = OnlineHistogram()
+        hists[col].add(df_res[col].values)
+    return render_histogram_counts(hists, market_id, image_out_dir, chart_periods, periods)
+
+def render_histogram_counts(hists, market_id, image_out_dir, chart_periods=None, periods=None):
+    """由各指標的 OnlineHistogram 繪圖 (不需保留逐檔數值)"""
+    market_label = market_id.upper()
     images = []
-    color_map = {'High': '#28a745', 'Close': '#007bff', 'Low': '#dc3545'}
     EXTREME_COLOR = '#FF4500' 
-    plot_bins = np.append(BINS, X_MAX + BIN_SIZE)
+    plot_bins = PLOT_BINS
+    x_labels = [f"{int(x)}%" for x in BINS] + [f">{int(X_MAX)}%"]
 
-    for p_n, p_z in [('Week', '週'), ('Month', '月'), ('Year', '年')]:
-        for t_n, t_z in [('High', '最高-進攻'), ('Close', '收盤-實質'), ('Low', '最低-防禦')]:
+    # 共用同一張畫布，每張圖只清空座標軸，省去反覆建立/銷毀 Figure 的成本
+    fig, ax = plt.subplots(figsize=(12, 7))
+    for p_n in (chart_periods or CHART_PERIODS):
+        p_z = period_label(p_n, periods)
+        for t_n, t_z, color in RETURN_TYPES:
             col = f"{p_n}_{t_n}"
-            if col not in df_res.columns: continue
-            data = df_res[col].dropna()
+            hist = hists.get(col)
+            if hist is None or hist.n == 0: continue
             
-            fig, ax = plt.subplots(figsize=(12, 7))
-            clipped_data = np.clip(data.values, X_MIN, X_MAX + BIN_SIZE)
-            counts, edges = np.histogram(clipped_data, bins=plot_bins)
+            ax.cla()
+            counts, edges, n_total = hist.counts, plot_bins, hist.n
             
             ax.bar(edges[:-2], counts[:-1], width=9, align='edge', 
-                   color=color_map[t_n], alpha=0.7, edgecolor='white')
+                   color=color, alpha=0.7, edgecolor='white')
             ax.bar(edges[-2], counts[-1], width=9, align='edge', 
                    color=EXTREME_COLOR, alpha=0.9, edgecolor='black', linewidth=1.5)
             
@@ -173,27 +451,145 @@ def run_global_analysis(market_id="tw-share"):
                 if h > 0:
                     x_pos = edges[i] + 4.5
                     is_extreme = (i == len(counts) - 1)
-                    ax.text(x_pos, h + (max_h * 0.02), f'{int(h)}\n({h/len(data)*100:.1f}%)', 
+                    ax.text(x_pos, h + (max_h * 0.02), f'{int(h)}\n({h/n_total*100:.1f}%)', 
                             ha='center', va='bottom', fontsize=9, fontweight='bold', 
                             color='red' if is_extreme else 'black')
 
             ax.set_ylim(0, max_h * 1.4) 
-            ax.set_title(f"【{market_label}】{p_z}K {t_z} 報酬分布 (樣本:{len(data)})", fontsize=18, fontweight='bold')
+            ax.set_title(f"【{market_label}】{p_z}K {t_z} 報酬分布 (樣本:{n_total})", fontsize=18, fontweight='bold')
             ax.set_xticks(plot_bins)
-            x_labels = [f"{int(x)}%" for x in BINS] + [f">{int(X_MAX)}%"]
             ax.set_xticklabels(x_labels, rotation=45)
             ax.grid(axis='y', linestyle='--', alpha=0.3)
-            plt.tight_layout()
+            fig.tight_layout()
             
             img_path = image_out_dir / f"{col.lower()}.png"
-            plt.savefig(img_path, dpi=120)
-            plt.close()
+            fig.savefig(img_path, dpi=120)
             images.append({'id': col.lower(), 'path': str(img_path), 'label': f"【{market_label}】{p_z}K {t_z}"})
+    plt.close(fig)
+    return images
+
+def render_trend_chart(market_id, data_root, image_out_dir, days=snapshot_store.TREND_DAYS):
+    """由每日快照繪製近 N 日強勢區佔比走勢；快照不足兩日時回傳 None"""
+    snaps = snapshot_store.load_snapshots(market_id, data_root, days)
+    if len(snaps) < 2: return None
+    fig, ax = plt.subplots(figsize=(12, 5))
+    for name in snapshot_store.TREND_METRICS:
+        series = snapshot_store.trend_series(snaps, name)
+        if not series: continue
+        p_n, t_n = name.split("_", 1)
+        ax.plot([r[0] for r in series], [r[1] for r in series], marker='o', label=f"{period_label(p_n)}K {t_n}")
+    ax.set_title(f"【{market_id.upper()}】強勢區 (>= {snapshot_store.TOP_BIN_FLOOR:.0f}%) 家數佔比走勢", fontsize=16, fontweight='bold')
+    ax.set_ylabel("%")
+    ax.grid(axis='y', linestyle='--', alpha=0.3)
+    ax.legend()
+    plt.setp(ax.get_xticklabels(), rotation=45)
+    fig.tight_layout()
+    img_path = Path(image_out_dir) / "trend_top_share.png"
+    fig.savefig(img_path, dpi=120)
+    plt.close(fig)
+    return {'id': 'trend_top_share', 'path': str(img_path), 'label': f"【{market_id.upper()}】強勢區佔比走勢 (近 {len(snaps)} 日)"}
 
+def build_text_reports(df_res, market_id, report_periods=None):
+    """依區間設定產出最高報酬的分箱公司清單"""
     text_reports = {}
-    for p_n in ['Week', 'Month', 'Year']:
+    for p_n in (report_periods or REPORT_PERIODS):
         col = f'{p_n}_High'
         if col in df_res.columns:
             text_reports[p_n] = build_company_list(df_res[col].values, df_res['Ticker'].tolist(), df_res['Full_Name'].tolist(), BINS, market_id)
+    return text_reports
+
+def market_files(market_id, data_root="./data", shard=None):
+    """
+    市場的日 K CSV 清單；指定 shard=(i, N) 時只取該分片的代號 (與下載器的分片一致)。
+    有資料目錄 (catalog.db) 時，已知 K 線數不足 MIN_BARS 的檔案直接排除，不必開檔。
+    """
+    all_files = list((Path(data_root) / market_id / "dayK").glob("*.csv"))
+    cat = catalog.existing(Path(data_root) / market_id)
+    if cat is not None:
+        short = {p for p, r in cat.by_path.items() if r.get("rows") is not None and r["rows"] < MIN_BARS}
+        all_files = [f for f in all_files if os.path.abspath(f) not in short]
+    return [f for f in all_files
+            if sharding.in_shard(parse_ticker_name(f.name.replace(".csv", ""), market_id)[0], shard)]
+
+def merge_partials(parts):
+    """
+    合併 sharding.load_partials 讀回的各分片：直方圖逐格相加、飆股清單與報表欄位串接。
+    回傳 (StreamingAnalysis, 區間設定)，可直接交給 publish_analysis。
+    """
+    first = parts[0]
+    periods = [tuple(p) for p in first["periods"]] if first["periods"] else None
+    # 各分片可能因記憶體預算不同而保留不同欄位，只保留共同的部分
+    keep = [c for c in first["keep"] if all(c in p["keep"] for p in parts)]
+    agg = StreamingAnalysis(first["columns"], keep)
+    for part in parts:
+        hists = {c: OnlineHistogram.from_state(s) for c, s in part["hists"].items()}
+        agg.absorb(part["frame"], hists, part["extremes"], part.get("alerts"))
+    return agg, periods
+
+def run_partial_analysis(market_id, shard, data_root="./data", periods=None, max_memory_mb=None):
+    """分片模式：只彙整本分片的標的，回傳 StreamingAnalysis (由 sharding.save_partial 落地)"""
+    all_files = market_files(market_id, data_root, shard)
+    print(f"📊 {market_id.upper()} 分片 {shard[0]}/{shard[1]}：{len(all_files)} 個 CSV")
+    shown = [p[0] for p in periods] if periods else None
+    report_cols = [f"{p}_High" for p in (shown or REPORT_PERIODS)]
+    return stream_market_returns(all_files, market_id, periods, max_memory_mb, report_cols,
+                                 breakout_alerts.for_market(market_id, data_root))
+
+def publish_analysis(agg, market_id="tw-share", data_root="./data", image_root="./output/images", periods=None,
+                     persist=True):
+    """
+    由彙整結果 (單機串流或分片合併) 繪製分布圖、生成文字報表並寫入每日快照。
+    persist=False 時只繪圖與生成報表，不寫入快照、排名索引與新高新低結果 (常駐服務以下載前的資料暖機)
+    """
+    image_out_dir = Path(image_root) / market_id
+    image_out_dir.mkdir(parents=True, exist_ok=True)
+    shown = [p[0] for p in periods] if periods else None
+    df_res = agg.frame()
+    if df_res.empty: return [], df_res, {}
+
+    # --- 繪圖邏輯 ---
+    with profiler.stage("render"):
+        images = render_histogram_counts(agg.hists, market_id, image_out_dir, shown, periods)
+
+    with profiler.stage("report"):
+        text_reports = build_text_reports(df_res, market_id, shown)
+
+    # --- 每日分布快照 (供趨勢報表使用) ---
+    with profiler.stage("snapshot"):
+        if not persist:
+            trend_img = render_trend_chart(market_id, data_root, image_out_dir)
+            if trend_img: images.append(trend_img)
+            return images, df_res, text_reports
+        session = trading_calendar.latest_completed_session(market_id)
+        snapshot = snapshot_store.build_snapshot(df_res, market_id, session, PLOT_BINS,
+                                                 histograms=agg.hists, extremes=agg.sorted_extremes())
+        snapshot_store.append_snapshot(snapshot, data_root)
+        # 排名索引 (ranking.py 的前 N 名 / 區間 / 單檔查詢)
+        ranking.save_index(df_res, market_id, session, data_root)
+        # 52 週新高 / 新低警示 (main 放進郵件與 Telegram)
+        breakout_alerts.save_results(agg.alerts, market_id, session, data_root)
+        trend_img = render_trend_chart(market_id, data_root, image_out_dir)
+        if trend_img: images.append(trend_img)
     
     return images, df_res, text_reports
+
+def run_global_analysis(market_id="tw-share", data_root="./data", image_root="./output/images", periods=None,
+                        max_memory_mb=None):
+    """
+    分析主邏輯：讀取 CSV -> 計算回報率 -> 繪製分布圖 -> 生成文字報表
+    periods: 自訂區間 (parse_periods 的結果)；指定時所有區間皆繪圖並產出清單
+    max_memory_mb: 記憶體上限 (預設讀取 STOCK_MONITOR_MAX_MEMORY_MB)；以串流分批彙整控制峰值
+    """
+    market_label = market_id.upper()
+    print(f"📊 正在啟動 {market_label} 深度矩陣分析...")
+    
+    all_files = market_files(market_id, data_root)
+    if not all_files:
+        print(f"⚠️ 找不到 {market_id} 的 CSV 數據檔案。")
+        return [], pd.DataFrame(), {}
+
+    shown = [p[0] for p in periods] if periods else None
+    report_cols = [f"{p}_High" for p in (shown or REPORT_PERIODS)]
+    agg = stream_market_returns(all_files, market_id, periods, max_memory_mb, report_cols,
+                                breakout_alerts.for_market(market_id, data_root))
+    return publish_analysis(agg, market_id, data_root, image_root, periods)
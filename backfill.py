@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+歷史分布回補：每個市場的 CSV 只讀一次，組成「日期 x 標的」對齊陣列，
+以滾動視窗向量化計算每個歷史交易日的各區間報酬分布，寫入每日快照 (snapshot_store)。
+
+    python backfill.py --market tw-share --start 2025-01-01
+    python backfill.py --market us-share --periods Week,Month,Year --chunk 128 --overwrite
+
+與 analyzer 的差異：區間以市場交易日 (所有標的日期的聯集) 對齊，停牌日以前一收盤價作為基準價，
+當日沒有 K 線的標的不列入該日分布。
+"""
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+from tqdm import tqdm
+
+import analyzer
+import snapshot_store
+
+# 每批計算的日期數：記憶體約為 (批次 + 最長區間) x 標的數 x 數個 float32 陣列
+CHUNK_DATES = 256
+
+def log(msg: str):
+    print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
+
+# ========== 1. 載入對齊面板 ==========
+
+def load_panel(data_root, market_id):
+    """
+    讀取 data/<market>/dayK/*.csv 一次，回傳 (dates, tickers, close, high, low)，
+    價格陣列形狀為 (日期數, 標的數)，缺值為 NaN。
+    """
+    files = sorted((Path(data_root) / market_id / "dayK").glob("*.csv"))
+    tickers, series = [], []
+    for f in tqdm(files, desc=f"載入 {market_id.upper()}"):
+        try:
+            df = pd.read_csv(f, usecols=lambda c: c.lower() in ("date", "close", "high", "low"))
+        except Exception:
+            continue
+        df.columns = [c.lower() for c in df.columns]
+        if df.empty or "date" not in df.columns: continue
+        day = df["date"].astype(str).str[:10].values
+        tkr, _ = analyzer.parse_ticker_name(f.name.replace(".csv", ""), market_id)
+        tickers.append(tkr)
+        series.append((day, df["close"].values, df["high"].values, df["low"].values))
+
+    dates = np.unique(np.concatenate([s[0] for s in series])) if series else np.array([], dtype=str)
+    shape = (len(dates), len(tickers))
+    close, high, low = (np.full(shape, np.nan, dtype=np.float32) for _ in range(3))
+    for j, (day, c, h, l) in enumerate(series):
+        rows = np.searchsorted(dates, day)
+        close[rows, j], high[rows, j], low[rows, j] = c, h, l
+    return dates, np.array(tickers), close, high, low
+
+# ========== 2. 滾動視窗 ==========
+
+def rolling_extreme(x, window, fn):
+    """
+    沿時間軸 (axis 0) 的滾動最大/最小值 (van Herk/Gil-Werman)：
+    切成長度為 window 的區塊，區塊內前綴/後綴累積極值各算一次，
+    視窗 [i-window+1, i] 的極值 = fn(後綴[i-window+1], 前綴[i])，與視窗長度無關皆為 O(n)。
+    fn 為 np.fmax / np.fmin (略過 NaN)；前 window-1 列回傳 NaN。
+    """
+    T = x.shape[0]
+    out = np.full_like(x, np.nan)
+    if T < window:
+        return out
+    nb = -(-T // window)
+    pad = np.full((nb * window - T,) + x.shape[1:], np.nan, dtype=x.dtype)
+    blocks = np.concatenate([x, pad]).reshape((nb, window) + x.shape[1:])
+    prefix = fn.accumulate(blocks, axis=1).reshape((nb * window,) + x.shape[1:])[:T]
+    suffix = fn.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape((nb * window,) + x.shape[1:])[:T]
+    out[window - 1:] = fn(suffix[:T - window + 1], prefix[window - 1:])
+    return out
+
+def forward_fill(x):
+    """沿時間軸以前一筆有效值補值 (停牌日沿用前一收盤價)"""
+    idx = np.where(np.isnan(x), 0, np.arange(x.shape[0])[:, None])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return x[idx, np.arange(x.shape[1])]
+
+def period_returns(close, close_ff, high, low, days):
+    """固定交易日數區間：回傳 (最高, 收盤, 最低) 報酬率陣列 (%)，形狀同輸入"""
+    prev = np.full_like(close, np.nan)
+    prev[days:] = close_ff[:-days]
+    prev[~(prev > 0)] = np.nan
+    h = rolling_extreme(high, days, np.fmax)
+    l = rolling_extreme(low, days, np.fmin)
+    return (h - prev) / prev * 100, (close - prev) / prev * 100, (l - prev) / prev * 100
+
+def ytd_returns(dates, close, close_ff, high, low):
+    """年初至今：每個年度各自累積極值，基準價為前一年度最後一個交易日的收盤價"""
+    h_out, c_out, l_out = (np.full_like(close, np.nan) for _ in range(3))
+    years = np.array([d[:4] for d in dates])
+    for year in np.unique(years):
+        rows = np.nonzero(years == year)[0]
+        start, end = rows[0], rows[-1] + 1
+        if start == 0: continue
+        prev = close_ff[start - 1].copy()
+        prev[~(prev > 0)] = np.nan
+        h_out[start:end] = (np.fmax.accumulate(high[start:end], axis=0) - prev) / prev * 100
+        c_out[start:end] = (close[start:end] - prev) / prev * 100
+        l_out[start:end] = (np.fmin.accumulate(low[start:end], axis=0) - prev) / prev * 100
+    return h_out, c_out, l_out
+
+# ========== 3. 分布統計 (整批日期一次計算) ==========
+
+def batch_summary(values, edges):
+    """
+    values: (日期數, 標的數)。回傳逐日的 snapshot_store.metric_summary 同格式字典清單，
+    分箱以 bincount 一次算完整批日期。
+    """
+    n_rows, n_bins = values.shape[0], len(edges) - 1
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=1)
+    clipped = np.clip(values, edges[0], edges[-1])
+    bin_idx = np.clip(np.searchsorted(edges, clipped, side="right") - 1, 0, n_bins - 1)
+    flat = (np.arange(n_rows)[:, None] * n_bins + bin_idx)[valid]
+    counts = np.bincount(flat, minlength=n_rows * n_bins).reshape(n_rows, n_bins)
+
+    out = [None] * n_rows
+    has = n > 0
+    if not has.any():
+        return out
+    with np.errstate(invalid="ignore"):
+        p10, median, p90 = np.nanpercentile(values[has], [10, 50, 90], axis=1)
+        mean = np.nanmean(values[has], axis=1)
+        up = (values[has] > 0).sum(axis=1) / n[has] * 100
+    for k, r in enumerate(np.nonzero(has)[0]):
+        out[r] = {
+            "n": int(n[r]), "counts": counts[r].tolist(),
+            "mean": round(float(mean[k]), 3), "median": round(float(median[k]), 3),
+            "p10": round(float(p10[k]), 3), "p90": round(float(p90[k]), 3),
+            "up_share": round(float(up[k]), 3),
+        }
+    return out
+
+# ========== 4. 主流程 ==========
+
+def backfill_market(market_id, data_root="./data", start=None, end=None, periods=None,
+                    chunk=CHUNK_DATES, overwrite=False, extreme_floor=100.0):
+    periods = periods or analyzer.PERIODS
+    edges = analyzer.PLOT_BINS
+    t0 = time.perf_counter()
+    dates, tickers, close, high, low = load_panel(data_root, market_id)
+    if len(dates) == 0:
+        log(f"⚠️ 找不到 {market_id} 的 CSV 數據檔案。")
+        return 0
+    log(f"📦 面板載入完成：{len(dates)} 個交易日 x {len(tickers)} 檔，耗時 {time.perf_counter() - t0:.1f}s")
+
+    existing = set() if overwrite else {s["date"] for s in snapshot_store.load_snapshots(market_id, data_root)}
+    targets = [i for i, d in enumerate(dates)
+               if (start is None or d >= start) and (end is None or d <= end) and d not in existing]
+    if not targets:
+        log("✅ 指定區間內的快照皆已存在。")
+        return 0
+
+    # 週 K / 月 K 根數型區間 (36M 等) 不回補：衍生庫只有最新狀態，沒有逐日的歷史面板
+    fixed = [(p_name, days) for p_name, _, days in periods if days != "ytd" and not analyzer.bar_period(days)]
+    max_days = max([d for _, d in fixed], default=0)
+    has_ytd = any(days == "ytd" for _, _, days in periods)
+    close_ff = forward_fill(close)
+    bar_count = np.cumsum(~np.isnan(close), axis=0, dtype=np.int32)
+    written = 0
+
+    for lo in tqdm(range(targets[0], targets[-1] + 1, chunk), desc="回補進度"):
+        hi = min(lo + chunk, targets[-1] + 1)
+        # 往前多取最長區間的資料，讓批次內第一天也有完整視窗
+        base = max(0, lo - max_days)
+        sl = slice(base, hi)
+        cols = {}
+        for p_name, days in fixed:
+            h, c, l = period_returns(close[sl], close_ff[sl], high[sl], low[sl], days)
+            cols.update({f"{p_name}_High": h[lo - base:], f"{p_name}_Close": c[lo - base:], f"{p_name}_Low": l[lo - base:]})
+        if has_ytd:
+            # 年初至今：從本批首日所在年度的前一個交易日 (基準價) 開始計算
+            ys = max(0, int(np.searchsorted(dates, dates[lo][:4])) - 1)
+            ysl = slice(ys, hi)
+            h, c, l = ytd_returns(dates[ysl], close[ysl], close_ff[ysl], high[ysl], low[ysl])
+            cols.update({"YTD_High": h[lo - ys:], "YTD_Close": c[lo - ys:], "YTD_Low": l[lo - ys:]})
+        # 當日沒有 K 線、或截至當日 K 線數不足 MIN_BARS 的標的不列入分布 (與 analyzer 一致)
+        traded = ~np.isnan(close[lo:hi]) & (bar_count[lo:hi] >= analyzer.MIN_BARS)
+        for v in cols.values():
+            v[~traded] = np.nan
+        summaries = {name: batch_summary(v, edges) for name, v in cols.items()}
+
+        snaps = []
+        for k, i in enumerate(range(lo, hi)):
+            if dates[i] in existing or not (start is None or dates[i] >= start) or not (end is None or dates[i] <= end):
+                continue
+            metrics = {name: s[k] for name, s in summaries.items() if s[k] is not None}
+            if not metrics: continue
+            extremes = {}
+            for name, v in cols.items():
+                if not name.endswith("_High"): continue
+                hit = np.nonzero(v[k] >= extreme_floor)[0]
+                if len(hit):
+                    hit = hit[np.argsort(-v[k][hit])]
+                    extremes[name[:-len("_High")]] = [[str(tickers[j]), round(float(v[k][j]), 1)] for j in hit]
+            snaps.append({
+                "date": str(dates[i]), "market": market_id,
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "n_tickers": int(traded[k].sum()), "bin_edges": [float(e) for e in edges],
+                "metrics": metrics, "extremes": extremes, "source": "backfill",
+            })
+        snapshot_store.append_snapshots(market_id, snaps, data_root)
+        written += len(snaps)
+
+    log(f"✅ {market_id} 回補完成：寫入 {written} 個交易日快照，總耗時 {time.perf_counter() - t0:.1f}s")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized historical backfill of breadth snapshots")
+    parser.add_argument("--market", default="tw-share")
+    parser.add_argument("--data-root", default="./data")
+    parser.add_argument("--start", default=None, help="起始日期 YYYY-MM-DD (含)")
+    parser.add_argument("--end", default=None, help="結束日期 YYYY-MM-DD (含)")
+    parser.add_argument("--periods", default=None, help="同 main.py --periods，預設為 analyzer.PERIODS")
+    parser.add_argument("--chunk", type=int, default=CHUNK_DATES, help="每批計算的日期數")
+    parser.add_argument("--overwrite", action="store_true", help="已存在的日期也重新寫入 (讀取時以後寫者為準)")
+    args = parser.parse_args()
+
+    periods = analyzer.parse_periods(args.periods) if args.periods else None
+    backfill_market(args.market, args.data_root, args.start, args.end, periods, args.chunk, args.overwrite)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+週 K / 月 K 衍生 K 線庫：data/<market>/weekK/ 與 monthK/ 與 dayK 同檔名，每個週期一列
+(period 週期起日、date 週期內最後交易日、OHLCV、bars 日 K 根數)。
+
+- 每次日 K 寫入 (datafeed.save_history) 時同步更新：只重算「目前尚未結束的週期」(最後一列) 與之後的新週期，
+  已結束的週期不再讀取日 K
+- 日 K 被整段改寫 (除權息還原、分割) 時，以最後一根已結束週期的收盤價比對發現，改由日 K 全部重建；
+  早於日 K 保留範圍 (2y) 的舊週期依重疊週期的收盤價比例一併還原，長期月 K 因此可累積超過兩年
+- 多年期指標直接讀月 K (每年 12 根) 而不必掃描數千根日 K：analyzer 的 "名稱:36M" / "名稱:104W" 區間即由此計算
+
+    python bar_store.py rebuild --market tw-share     # 由既有日 K 重建全部衍生 K 線
+    python bar_store.py show --market tw-share --ticker 2330 --freq month
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+DATA_ROOT = "./data"
+# 週期名稱 -> (目錄名稱, 分析區間代碼後綴)
+FREQS = {"week": ("weekK", "W"), "month": ("monthK", "M")}
+BAR_COLUMNS = ["period", "date", "open", "high", "low", "close", "volume", "bars"]
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+# 判斷已結束週期是否仍與日 K 一致的收盤價容許誤差 (相對值)
+ANCHOR_TOLERANCE = 1e-6
+
+def bar_path(day_path, freq):
+    """data/<market>/dayK/<檔名>.csv -> data/<market>/<weekK|monthK>/<檔名>.csv"""
+    day_path = str(day_path)
+    return os.path.join(os.path.dirname(os.path.dirname(day_path)), FREQS[freq][0], os.path.basename(day_path))
+
+def period_keys(dates, freq):
+    """ISO 日期字串 -> 週期起日 (週 = 該週週一，月 = 該月 1 日)"""
+    d = pd.to_datetime(pd.Series(dates, dtype=str).str[:10])
+    if freq == "week":
+        d = d - pd.to_timedelta(d.dt.weekday, unit="D")
+        return d.dt.strftime("%Y-%m-%d").values
+    return d.dt.strftime("%Y-%m-01").values
+
+def aggregate(daily, freq):
+    """日 K (date/open/high/low/close/volume) -> 週期 K 線表 (BAR_COLUMNS)"""
+    if daily is None or daily.empty:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    df = daily.rename(columns=str.lower)
+    dates = df["date"].astype(str).str[:10].values
+    frame = pd.DataFrame({"period": period_keys(dates, freq), "date": dates})
+    for c in PRICE_COLUMNS + ["volume"]:
+        frame[c] = pd.to_numeric(df[c], errors="coerce").values if c in df.columns else np.nan
+    g = frame.groupby("period", sort=True)
+    out = pd.DataFrame({
+        "date": g["date"].last(), "open": g["open"].first(), "high": g["high"].max(), "low": g["low"].min(),
+        "close": g["close"].last(), "volume": g["volume"].sum(), "bars": g["date"].count(),
+    }).reset_index()
+    return out[BAR_COLUMNS]
+
+def load(path):
+    """讀取衍生 K 線 CSV (不存在時回傳 None)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_csv(path, dtype={"period": str, "date": str})
+    except (OSError, ValueError):
+        return None
+
+def _write(frame, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    frame.to_csv(tmp, index=False, encoding="utf-8-sig")
+    os.replace(tmp, path)
+
+def _anchored(stored, dates, close, start):
+    """
+    已存週期與日 K 是否一致：開放週期前的最後一根日 K 必須正是上一個週期的最後交易日，且收盤價相同。
+    start 為開放週期第一根日 K 的位置。
+    """
+    if len(stored) < 2:
+        return start == 0
+    prev = stored.iloc[-2]
+    if start == 0 or dates[start - 1] != str(prev["date"])[:10]:
+        return False
+    ref = float(prev["close"])
+    return abs(float(close[start - 1]) - ref) <= ANCHOR_TOLERANCE * max(1.0, abs(ref))
+
+def rebuild(daily, stored, freq):
+    """
+    由日 K 全部重算；stored 中早於日 K 範圍的舊週期保留，並以第一個完整重疊週期的收盤價比例還原價格。
+    (日 K 第一個週期可能因 2y 裁切而不完整：stored 有更完整的同一週期時沿用 stored 版本)
+    """
+    fresh = aggregate(daily, freq)
+    if stored is None or stored.empty or fresh.empty:
+        return fresh
+    first = fresh["period"].iloc[0]
+    common = stored.set_index("period")["close"].reindex(fresh["period"].iloc[1:]).dropna()
+    if common.empty:
+        return fresh
+    p = common.index[0]
+    old_close = float(common.iloc[0])
+    if not old_close > 0:
+        return fresh
+    ratio = float(fresh.loc[fresh["period"] == p, "close"].iloc[0]) / old_close
+    older = stored[stored["period"] <= first].copy()
+    older[PRICE_COLUMNS] = older[PRICE_COLUMNS].astype(float) * ratio
+    head = older[older["period"] == first]
+    if len(head) and int(head["bars"].iloc[0]) > int(fresh["bars"].iloc[0]):
+        fresh = fresh.iloc[1:]
+    else:
+        older = older[older["period"] < first]
+    return pd.concat([older, fresh], ignore_index=True)[BAR_COLUMNS]
+
+def update_frame(daily, stored, freq):
+    """回傳 (新的週期 K 線表, 是否整段重建)：一般情況只重算最後一個 (開放) 週期與之後的新週期"""
+    if stored is None or stored.empty:
+        return aggregate(daily, freq), True
+    df = daily.rename(columns=str.lower)
+    dates = df["date"].astype(str).str[:10].values
+    start = int(np.searchsorted(dates, stored["period"].iloc[-1]))
+    if not _anchored(stored, dates, df["close"].values, start):
+        return rebuild(daily, stored, freq), True
+    tail = aggregate(df.iloc[start:], freq)
+    return pd.concat([stored.iloc[:-1], tail], ignore_index=True)[BAR_COLUMNS], False
+
+def update(daily, day_path):
+    """datafeed.save_history 寫完日 K 後呼叫：更新該檔的週 K 與月 K，回傳各週期是否整段重建"""
+    if daily is None or daily.empty or "date" not in [c.lower() for c in daily.columns]:
+        return {}
+    rebuilt = {}
+    for freq in FREQS:
+        path = bar_path(day_path, freq)
+        frame, rebuilt[freq] = update_frame(daily, load(path), freq)
+        _write(frame, path)
+    return rebuilt
+
+def bars_for(day_path, freq):
+    """分析用：讀取 (必要時由日 K 建立) 該檔的週期 K 線"""
+    path = bar_path(day_path, freq)
+    frame = load(path)
+    if frame is None and os.path.exists(day_path):
+        frame = aggregate(pd.read_csv(day_path), freq)
+        _write(frame, path)
+    return frame
+
+def rebuild_market(market_id, data_root=DATA_ROOT):
+    """由既有日 K 重建整個市場的衍生 K 線 (保留早於日 K 範圍的舊週期)，回傳檔數"""
+    files = sorted((Path(data_root) / market_id / "dayK").glob("*.csv"))
+    for f in files:
+        daily = pd.read_csv(f)
+        for freq in FREQS:
+            path = bar_path(f, freq)
+            _write(rebuild(daily, load(path), freq), path)
+    return len(files)
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialized weekly / monthly bars derived from daily CSVs")
+    parser.add_argument("command", choices=["rebuild", "show"])
+    parser.add_argument("--market", default="tw-share")
+    parser.add_argument("--data-root", default=DATA_ROOT)
+    parser.add_argument("--ticker", default=None, help="show：代號 (檔名開頭)")
+    parser.add_argument("--freq", default="month", choices=list(FREQS))
+    parser.add_argument("-n", type=int, default=24, help="show：列出最近 N 根")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        n = rebuild_market(args.market, args.data_root)
+        print(f"✅ {args.market} 週 K / 月 K 重建完成：{n} 檔")
+        return
+    day_dir = Path(args.data_root) / args.market / "dayK"
+    matches = sorted(p for p in day_dir.glob("*.csv") if p.stem == args.ticker or p.stem.startswith(f"{args.ticker}_"))
+    if not matches:
+        print(f"⚠️ 找不到 {args.ticker} 的日 K 檔")
+        return
+    frame = bars_for(matches[0], args.freq)
+    print(frame.tail(args.n).to_string(index=False))
+    print(f"📚 {matches[0].stem} | {args.freq} K 線 {len(frame)} 根 | {frame['period'].iloc[0]} ~ {frame['date'].iloc[-1]}")
+
+if __name__ == "__main__":
+    main()
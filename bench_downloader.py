@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+下載器吞吐壓測：啟動本機替身伺服器 (standin_server.py)，把 downloader_*.main() / run_sync()
+導向替身並改寫資料目錄到暫存區，量測 tickers/sec、p50/p99 延遲與重試次數。
+
+    python bench_downloader.py --markets tw-share,us-share --workers 3,6,12 --latency-ms 80 --rps 40
+    python bench_downloader.py --markets tw-share --rps 5 --egress 1,4      # 出口數與吞吐量的關係
+"""
+import os
+import json
+import time
+import argparse
+import importlib
+from datetime import datetime
+from pathlib import Path
+
+import catalog
+import datafeed
+import egress
+import http_cache
+import run_manifest
+import standin_server
+from benchmark import BENCH_ROOT, git_revision, environment_info
+
+RUN_ROOT = Path("./output/standin/runs")
+
+# 市場 -> (模組, 進入點, 併發參數名稱)
+DOWNLOADERS = {
+    "tw-share": ("downloader_tw", "main", "MAX_WORKERS"),
+    "us-share": ("downloader_us", "main", "MAX_WORKERS"),
+    "cn-share": ("downloader_cn", "main", "THREADS_CN"),
+    "kr-share": ("downloader_kr", "main", "THREADS"),
+    "hk-share": ("downloader_hk", "run_sync", "MAX_WORKERS"),
+    "jp-share": ("downloader_jp", "run_sync", "MAX_WORKERS"),
+}
+
+# 下載器中所有會落地的路徑常數，壓測時一律改寫到暫存目錄
+PATH_ATTRS = ["DATA_DIR", "LIST_DIR", "CACHE_LIST_PATH", "DB_PATH"]
+
+def log(msg: str):
+    print(f"{datetime.now():%H:%M:%S}: {msg}")
+
+def _redirect_paths(mod, run_dir):
+    for attr in PATH_ATTRS:
+        if not hasattr(mod, attr): continue
+        orig = getattr(mod, attr)
+        target = run_dir / Path(orig).name
+        if attr.endswith("_DIR"):
+            target.mkdir(parents=True, exist_ok=True)
+        setattr(mod, attr, target if isinstance(orig, Path) else str(target))
+
+def run_one(market_id, workers, run_dir, egress_profiles=None):
+    """對單一市場跑一次冷啟動下載，回傳量測結果 (egress_profiles 指定時經由出口池下載)"""
+    pool = egress.configure(egress_profiles or [])
+    mod_name, entry, worker_attr = DOWNLOADERS[market_id]
+    mod = importlib.import_module(mod_name)
+    _redirect_paths(mod, run_dir)
+    run_manifest.DATA_ROOT = str(run_dir / "data")
+    catalog.DATA_ROOT = str(run_dir / "data")
+    # 清單快取同樣改寫：合成清單不得寫進正式的 data/http_cache
+    http_cache.CACHE_DIR = str(run_dir / "http_cache")
+    if workers:
+        setattr(mod, worker_attr, workers)
+
+    datafeed.STATS.reset()
+    t0 = time.perf_counter()
+    result = getattr(mod, entry)()
+    wall = time.perf_counter() - t0
+
+    chart = datafeed.STATS.summary("chart")
+    lists = datafeed.STATS.summary("list")
+    return {
+        "market": market_id,
+        "workers": getattr(mod, worker_attr),
+        "effective_workers": datafeed.worker_count(getattr(mod, worker_attr)),
+        "wall_sec": round(wall, 2),
+        "tickers": chart["unique"],
+        "tickers_per_sec": round(chart["unique"] / wall, 2) if wall > 0 else None,
+        "p50_ms": chart["p50_ms"],
+        "p99_ms": chart["p99_ms"],
+        "requests": chart["requests"],
+        "retries": chart["retries"],
+        "status": chart["status"],
+        "list_requests": lists["requests"],
+        "downloader_result": {k: v for k, v in (result or {}).items() if not isinstance(v, list)},
+        "egress": pool.summary() if pool is not None else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Downloader throughput harness (offline)")
+    parser.add_argument("--markets", default="tw-share")
+    parser.add_argument("--workers", default="", help="逗號分隔的併發數，留空則使用模組預設值")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=30.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--empty-rate", type=float, default=0.01)
+    parser.add_argument("--rps", type=float, default=0.0)
+    parser.add_argument("--action-rate", type=float, default=0.0, help="當日除權息 (觸發完整重抓) 的代號比例")
+    parser.add_argument("--egress", default="", help="逗號分隔的出口數 (各自經由一個轉發代理替身)，留空則不用出口池")
+    parser.add_argument("--egress-rps", type=float, default=None, help="每個出口的用戶端限速，預設同 --rps")
+    parser.add_argument("--universe", type=int, default=500)
+    parser.add_argument("--sleep-scale", type=float, default=0.01, help="下載器內隨機延遲的倍率")
+    parser.add_argument("--recordings", default=str(standin_server.RECORDINGS_DIR))
+    args = parser.parse_args()
+
+    config = standin_server.StandInConfig(args.latency_ms, args.latency_jitter_ms, args.error_rate,
+                                          args.throttle_rate, args.empty_rate, args.rps, args.universe,
+                                          args.recordings, action_rate=args.action_rate)
+    server, state, url = standin_server.start_server(config)
+    os.environ[datafeed.STANDIN_ENV] = url
+    os.environ[datafeed.SLEEP_SCALE_ENV] = str(args.sleep_scale)
+    log(f"🧪 替身伺服器: {url} | 延遲 {args.latency_ms}ms | 錯誤率 {args.error_rate} | 429 率 {args.throttle_rate} | rps {args.rps or '∞'}")
+
+    markets = [m.strip() for m in args.markets.split(",") if m.strip()]
+    worker_list = [int(w) for w in args.workers.split(",") if w.strip()] or [0]
+    egress_list = [int(n) for n in args.egress.split(",") if n.strip()] or [0]
+    proxies = [standin_server.start_proxy(f"10.0.0.{i + 1}") for i in range(max(egress_list))]
+    egress_rps = args.rps if args.egress_rps is None else args.egress_rps
+    results = []
+    try:
+        for market_id in markets:
+            if market_id not in DOWNLOADERS:
+                log(f"⚠️ 不支援的市場: {market_id}")
+                continue
+            for workers in worker_list:
+                for n_egress in egress_list:
+                    run_dir = RUN_ROOT / f"{market_id}_{workers or 'default'}_e{n_egress}_{datetime.now():%Y%m%d_%H%M%S}"
+                    run_dir.mkdir(parents=True, exist_ok=True)
+                    profiles = [{"name": f"proxy-{i + 1}", "proxy": proxies[i][1], "rps": egress_rps, "burst": max(1, egress_rps)}
+                                for i in range(n_egress)]
+                    res = run_one(market_id, workers, run_dir, profiles)
+                    results.append(res)
+                    log(f"⏱️ {market_id} | workers={res['effective_workers']} | 出口 {n_egress or '-'} | {res['tickers_per_sec']} 檔/秒 | "
+                        f"p50 {res['p50_ms']}ms | p99 {res['p99_ms']}ms | 重試 {res['retries']} | 狀態 {res['status']}")
+    finally:
+        server.shutdown()
+        for proxy, _ in proxies:
+            proxy.shutdown()
+
+    BENCH_ROOT.mkdir(parents=True, exist_ok=True)
+    rev = git_revision()
+    out = BENCH_ROOT / f"downloader_{datetime.now():%Y%m%d_%H%M%S}_{rev}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"revision": rev, "created_at": datetime.now().isoformat(timespec="seconds"),
+                   "environment": environment_info(), "standin": vars(args), "results": results},
+                  f, ensure_ascii=False, indent=2)
+    log(f"✅ 壓測結果已寫入 {out}")
+
+if __name__ == "__main__":
+    main()
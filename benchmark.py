@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+離線效能基準測試：以合成的 OHLCV 隨機漫步資料建立 data/<market>/dayK，
+分別量測 讀檔 -> 報酬計算 -> 分布圖繪製 -> 公司清單 -> HTML 組裝 各階段耗時，
+結果寫入 output/benchmarks/*.json 以便跨 commit 比較。
+
+範例：
+    python benchmark.py --markets tw-share,kr-share --tickers 1000,5000 --days 500
+    python benchmark.py --compare output/benchmarks/a.json output/benchmarks/b.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+
+import analyzer
+import notifier
+
+BENCH_ROOT = Path("./output/benchmarks")
+END_DATE = "2026-10-16"
+GEN_CHUNK = 1000
+
+# 各市場的檔名格式與時區 (對應 analyzer.parse_ticker_name 的解析策略)
+MARKET_NAMING = {
+    "tw-share": {"tz": "+08:00", "fmt": lambda i: f"{1101 + i}.TW_合成{i}"},
+    "us-share": {"tz": "-04:00", "fmt": lambda i: f"SYN{i:05d}_Synthetic Corp {i}"},
+    "cn-share": {"tz": "+08:00", "fmt": lambda i: f"{(600000 if i % 2 else 1) + i // 2:06d}_合成{i}"},
+    "hk-share": {"tz": "+08:00", "fmt": lambda i: f"{i + 1:04d}.HK"},
+    "jp-share": {"tz": "+09:00", "fmt": lambda i: f"{1301 + i}.T"},
+    "kr-share": {"tz": "+09:00", "fmt": lambda i: f"{i * 10:06d}.{'KS' if i % 3 else 'KQ'}"},
+}
+
+def log(msg: str):
+    print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
+
+# ========== 1. 合成資料 ==========
+
+def random_walk_ohlcv(rng, n_tickers, n_days):
+    """以幾何隨機漫步產生 (n_tickers, n_days) 的 OHLCV 陣列"""
+    vol = rng.uniform(0.01, 0.05, size=(n_tickers, 1))
+    drift = rng.normal(0.0002, 0.001, size=(n_tickers, 1))
+    rets = rng.normal(drift, vol, size=(n_tickers, n_days))
+    # 少量跳空 (模擬除權、復牌) 讓 >100% 與 -100% 區間也有樣本
+    jumps = rng.random((n_tickers, n_days)) < 0.0005
+    rets[jumps] += rng.choice([-0.5, 0.7], size=int(jumps.sum()))
+
+    start = rng.uniform(5, 500, size=(n_tickers, 1))
+    close = start * np.exp(np.cumsum(rets, axis=1))
+    prev = np.concatenate([start, close[:, :-1]], axis=1)
+    open_ = prev * np.exp(rng.normal(0, vol / 3, size=(n_tickers, n_days)))
+    wick = np.abs(rng.normal(0, vol / 2, size=(n_tickers, n_days)))
+    high = np.maximum(open_, close) * (1 + wick)
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, vol / 2, size=(n_tickers, n_days))))
+    volume = rng.lognormal(12, 1.5, size=(n_tickers, n_days)).astype(np.int64)
+    return open_, high, low, close, volume
+
+def generate_market(root, market_id, n_tickers, n_days, seed=42):
+    """在 root/<market>/dayK 建立合成 CSV；約 2% 標的刻意只給短歷史以測試過濾邏輯"""
+    out_dir = Path(root) / market_id / "dayK"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    naming = MARKET_NAMING[market_id]
+    dates = pd.bdate_range(end=END_DATE, periods=n_days)
+    date_str = np.array([f"{d} 00:00:00{naming['tz']}" for d in dates.strftime("%Y-%m-%d")])
+    rng = np.random.default_rng(seed)
+
+    for lo in range(0, n_tickers, GEN_CHUNK):
+        hi = min(lo + GEN_CHUNK, n_tickers)
+        o, h, l, c, v = random_walk_ohlcv(rng, hi - lo, n_days)
+        lengths = np.where(rng.random(hi - lo) < 0.02, rng.integers(5, 60, size=hi - lo), n_days)
+        for k in range(hi - lo):
+            n = lengths[k]
+            df = pd.DataFrame({
+                "date": date_str[-n:],
+                "open": o[k, -n:].round(2), "high": h[k, -n:].round(2),
+                "low": l[k, -n:].round(2), "close": c[k, -n:].round(2),
+                "volume": v[k, -n:], "dividends": 0.0, "stock splits": 0.0,
+            })
+            df.to_csv(out_dir / f"{naming['fmt'](lo + k)}.csv", index=False, encoding="utf-8-sig")
+    return out_dir
+
+def ensure_dataset(market_id, n_tickers, n_days, seed=42, regenerate=False):
+    """合成資料依 (市場, 檔數, 天數, seed) 快取，重複執行不必重建"""
+    root = BENCH_ROOT / "data" / f"{market_id}_{n_tickers}_{n_days}_{seed}"
+    done_flag = root / ".complete"
+    if regenerate and root.exists():
+        shutil.rmtree(root)
+    if not done_flag.exists():
+        log(f"🧪 產生合成資料 {market_id} | {n_tickers} 檔 x {n_days} 天 ...")
+        generate_market(root, market_id, n_tickers, n_days, seed)
+        done_flag.touch()
+    return root
+
+# ========== 2. 分階段計時 ==========
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+def bench_scenario(market_id, data_root, image_root):
+    """依序量測各階段，回傳 {階段: 秒數}"""
+    files = sorted((Path(data_root) / market_id / "dayK").glob("*.csv"))
+
+    def load_all():
+        return [(f, pd.read_csv(f)) for f in files]
+
+    def returns_all(frames):
+        rows = []
+        for f, df in frames:
+            if len(df) < 20: continue
+            df.columns = [c.lower() for c in df.columns]
+            tkr, nm = analyzer.parse_ticker_name(f.name.replace(".csv", ""), market_id)
+            row = {'Ticker': tkr, 'Full_Name': nm}
+            row.update(analyzer.compute_returns(df['close'].values, df['high'].values, df['low'].values, df['date'].astype(str).values))
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    timings = {}
+    frames, timings["load"] = _timed(load_all)
+    df_res, timings["returns"] = _timed(returns_all, frames)
+    del frames
+
+    image_dir = Path(image_root) / market_id
+    image_dir.mkdir(parents=True, exist_ok=True)
+    images, timings["render"] = _timed(analyzer.render_histograms, df_res, market_id, image_dir)
+    text_reports, timings["build_company_list"] = _timed(analyzer.build_text_reports, df_res, market_id)
+
+    agent = notifier.StockNotifier()
+    stats = {"total": len(files), "success": len(df_res), "fail": len(files) - len(df_res)}
+    _, timings["html"] = _timed(agent.build_report_html, market_id, images, df_res, text_reports, stats)
+
+    # 端到端 (含 tqdm 與例外處理開銷) 作為對照
+    _, timings["end_to_end"] = _timed(analyzer.run_global_analysis, market_id, data_root, image_root)
+    return timings, len(df_res)
+
+# ========== 3. 結果輸出與比較 ==========
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+
+def run_benchmarks(markets, ticker_counts, day_counts, repeat=1, seed=42, regenerate=False):
+    results = []
+    for market_id in markets:
+        for n_tickers in ticker_counts:
+            for n_days in day_counts:
+                data_root = ensure_dataset(market_id, n_tickers, n_days, seed, regenerate)
+                image_root = BENCH_ROOT / "images" / data_root.name
+                best = {}
+                for _ in range(repeat):
+                    timings, n_valid = bench_scenario(market_id, data_root, image_root)
+                    for k, v in timings.items():
+                        best[k] = min(best.get(k, v), v)
+                log(f"⏱️ {market_id} | {n_tickers} 檔 x {n_days} 天 | " + " | ".join(f"{k}: {v:.2f}s" for k, v in best.items()))
+                results.append({
+                    "market": market_id, "tickers": n_tickers, "days": n_days,
+                    "valid": n_valid, "repeat": repeat, "seconds": best,
+                })
+    return results
+
+def save_results(results):
+    BENCH_ROOT.mkdir(parents=True, exist_ok=True)
+    rev = git_revision()
+    out = BENCH_ROOT / f"{datetime.now():%Y%m%d_%H%M%S}_{rev}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"revision": rev, "created_at": datetime.now().isoformat(timespec="seconds"),
+                   "environment": environment_info(), "results": results}, f, ensure_ascii=False, indent=2)
+    return out
+
+def compare(base_path, new_path):
+    """逐情境列出兩次基準的各階段耗時與倍率"""
+    with open(base_path, encoding="utf-8") as f: base = json.load(f)
+    with open(new_path, encoding="utf-8") as f: new = json.load(f)
+    key = lambda r: (r["market"], r["tickers"], r["days"])
+    base_map = {key(r): r for r in base["results"]}
+    print(f"📈 {base['revision']} -> {new['revision']}")
+    for r in new["results"]:
+        b = base_map.get(key(r))
+        if b is None: continue
+        print(f"\n{r['market']} | {r['tickers']} 檔 x {r['days']} 天")
+        for stage, sec in r["seconds"].items():
+            old = b["seconds"].get(stage)
+            if old is None: continue
+            ratio = old / sec if sec > 0 else float("inf")
+            print(f"  {stage:<20} {old:>8.2f}s -> {sec:>8.2f}s  ({ratio:.2f}x)")
+
+def _int_list(s):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline analyzer/report benchmark")
+    parser.add_argument("--markets", default="tw-share", help="逗號分隔，如 tw-share,kr-share")
+    parser.add_argument("--tickers", default="1000", help="逗號分隔的檔數，如 1000,5000,20000")
+    parser.add_argument("--days", default="500", help="逗號分隔的歷史長度 (交易日)")
+    parser.add_argument("--repeat", type=int, default=1, help="每個情境重複次數 (取最佳值)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--regenerate", action="store_true", help="強制重建合成資料")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="比較兩份結果 JSON")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    markets = [m.strip() for m in args.markets.split(",") if m.strip()]
+    unknown = [m for m in markets if m not in MARKET_NAMING]
+    if unknown:
+        print(f"❌ 不支援的市場: {unknown}")
+        sys.exit(1)
+
+    results = run_benchmarks(markets, _int_list(args.tickers), _int_list(args.days), args.repeat, args.seed, args.regenerate)
+    out = save_results(results)
+    log(f"✅ 基準結果已寫入 {out}")
+
+if __name__ == "__main__":
+    main()
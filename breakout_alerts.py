@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+52 週新高 / 新低警示：每檔保留「前 LOOKBACK 根 K 線」最高價與最低價的單調佇列 (monotonic deque)，
+存於 data/<market>/lists/breakouts.db，每次分析只把新增的 K 線推入佇列：
+
+- 最高價佇列由前到後遞減 (最低價佇列遞增)，佇列頭即視窗內極值；新 K 線從尾端擠掉不可能再成為極值的舊值，
+  過期的 K 線從頭端移出，每根 K 線攤銷 O(1)，與回溯長度無關 (佇列通常只有十來個元素)
+- 判斷順序：先移出過期值，以佇列頭 (前 LOOKBACK 根的極值) 與今日比較，再推入今日
+- 日 K 被整段改寫 (除權息還原、分割) 時，以最後一根 K 線的收盤價比對發現，改由最近 LOOKBACK 根重建
+
+警示種類 (只針對本次新推入的最後一根 K 線，且其日期為最近已收盤交易日、已累積滿 LOOKBACK 根歷史；
+停牌標的沒有新 K 線，不會每天重複列入)：
+
+    new_high   今日最高價 > 前 LOOKBACK 根的最高價 (盤中創 52 週新高)
+    breakout   今日收盤價 > 前 LOOKBACK 根的最高價 (收盤突破)
+    new_low    今日最低價 < 前 LOOKBACK 根的最低價
+    breakdown  今日收盤價 < 前 LOOKBACK 根的最低價 (收盤跌破)
+
+分析結束後寫入 data/<market>/results/breakouts_<交易日>.json，由 main 放進郵件報告與 Telegram。
+
+    python breakout_alerts.py --market tw-share             # 列出最近一個交易日的警示
+"""
+import os
+import json
+import sqlite3
+import argparse
+import threading
+import numpy as np
+from collections import deque
+from pathlib import Path
+
+import catalog
+import trading_calendar
+
+STATE_FILE = "breakouts.db"
+# 回溯 K 線根數 (約 52 週)，與 analyzer 的 Year 區間一致
+LOOKBACK = 250
+KINDS = [("new_high", "📈 52 週新高"), ("breakout", "🚀 收盤突破 52 週高"),
+         ("new_low", "📉 52 週新低"), ("breakdown", "🧨 收盤跌破 52 週低")]
+# 報告 / Telegram 中每種警示列出的檔數
+REPORT_LIMIT = 30
+TELEGRAM_LIMIT = 10
+# 判斷日 K 是否被改寫的收盤價容許誤差 (相對值)
+REWRITE_TOLERANCE = 1e-6
+
+COLUMNS = ["ticker", "last_date", "last_close", "n", "hi", "lo", "flags"]
+
+class TickerState:
+    """
+    單一標的的滾動極值狀態：n 為已推入的 K 線數 (也是下一根的序號)，
+    hi / lo 為 [[序號, 價格], ...] 的單調佇列，flags 為最後一根 K 線觸發的警示
+    """
+    def __init__(self, n=0, hi=None, lo=None, last_date=None, last_close=None, flags=None):
+        self.n = n
+        self.hi = deque(hi or [])
+        self.lo = deque(lo or [])
+        self.last_date = last_date
+        self.last_close = last_close
+        self.flags = flags or {}
+
+    def push(self, date, high, low, close, lookback=LOOKBACK):
+        """推入一根 K 線，回傳這根 K 線觸發的警示 {種類: 前 lookback 根的極值}"""
+        i = self.n
+        start = i - lookback
+        while self.hi and self.hi[0][0] < start: self.hi.popleft()
+        while self.lo and self.lo[0][0] < start: self.lo.popleft()
+        flags = {}
+        if i >= lookback and self.hi and self.lo:
+            ref_hi, ref_lo = self.hi[0][1], self.lo[0][1]
+            if high > ref_hi: flags["new_high"] = ref_hi
+            if close > ref_hi: flags["breakout"] = ref_hi
+            if low < ref_lo: flags["new_low"] = ref_lo
+            if close < ref_lo: flags["breakdown"] = ref_lo
+        # 缺值的 K 線只占序號，不進佇列
+        if high == high:
+            while self.hi and self.hi[-1][1] <= high: self.hi.pop()
+            self.hi.append([i, float(high)])
+        if low == low:
+            while self.lo and self.lo[-1][1] >= low: self.lo.pop()
+            self.lo.append([i, float(low)])
+        self.n = i + 1
+        self.last_date, self.last_close, self.flags = date, float(close), flags
+        return flags
+
+    def to_row(self, ticker):
+        return (ticker, self.last_date, self.last_close, self.n, json.dumps(list(self.hi)), json.dumps(list(self.lo)),
+                json.dumps(self.flags))
+
+    @classmethod
+    def from_row(cls, row):
+        r = dict(zip(COLUMNS, row))
+        return cls(r["n"], json.loads(r["hi"]), json.loads(r["lo"]), r["last_date"], r["last_close"],
+                   json.loads(r["flags"] or "{}"))
+
+class BreakoutTracker:
+    """
+    單一市場的警示狀態：啟動時整表載入，update() 逐檔推入新 K 線，save() 一次批次寫回。
+    alerts 為本次處理的標的中，最後一根 K 線觸發的警示 {種類: [[代號, 名稱, 價格, 前極值], ...]}；
+    session 指定時只有最後一根 K 線落在該交易日才列入警示 (None 時不檢查日期)
+    """
+    def __init__(self, market_dir, lookback=LOOKBACK, session=None):
+        self.path = os.path.join(market_dir, "lists", STATE_FILE)
+        self.lookback = lookback
+        self.session = str(session) if session else None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (ticker TEXT PRIMARY KEY, last_date TEXT, last_close REAL, "
+                          "n INTEGER, hi TEXT, lo TEXT, flags TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        stored = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        self.states = {}
+        # 回溯長度改變時舊佇列不適用，全部重建
+        if stored.get("lookback") == str(lookback):
+            self.states = {r[0]: TickerState.from_row(r) for r in
+                           self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM state")}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self.alerts = {k: [] for k, _ in KINDS}
+        self.rebuilt = 0
+
+    def _rebuild(self, dates, high, low, close):
+        """由最近 lookback+1 根 K 線重建 (足以判斷最後一根的警示)；歷史不足時從頭推入"""
+        st = TickerState()
+        begin = max(0, len(dates) - self.lookback - 1)
+        # 序號從 begin 起算，讓「已累積滿 lookback 根」的判斷與完整歷史一致
+        st.n = begin
+        self._push(st, dates, high, low, close, begin)
+        return st
+
+    def _push(self, st, dates, high, low, close, start):
+        for k in range(start, len(dates)):
+            st.push(str(dates[k])[:10], float(high[k]), float(low[k]), float(close[k]), self.lookback)
+
+    def update(self, ticker, name, dates, high, low, close):
+        """
+        dates 為已排序的日期字串陣列 (CSV 原樣，如 2026-10-16 00:00:00+08:00)；
+        以二分搜尋找到上次處理的 K 線，只推入其後的新 K 線；
+        回傳最後一根的警示 (最後一根不是 session 當天，或未指定 session 且本次沒有新 K 線時為空)
+        """
+        n = len(dates)
+        if n == 0:
+            return {}
+        st = self.states.get(ticker)
+        prev_date = st.last_date if st is not None else None
+        start = None
+        if st is not None and st.last_date:
+            pos = int(np.searchsorted(dates, st.last_date))
+            # 最後處理的 K 線仍在、收盤價未被改寫，才能從它之後接續推入
+            if pos < n and str(dates[pos])[:10] == st.last_date and \
+                    abs(float(close[pos]) - st.last_close) <= REWRITE_TOLERANCE * max(1.0, abs(st.last_close)):
+                start = pos + 1
+        if start is None:
+            st = self._rebuild(dates, high, low, close)
+            with self._lock: self.rebuilt += 1
+        else:
+            self._push(st, dates, high, low, close, start)
+        last = str(dates[-1])[:10]
+        # 最後一根必須是 session 當天 (停牌標的停在舊日期，不再列入)；同一交易日重跑時照常發出，
+        # 該日的結果檔才不會被清空。未指定 session 時只有本次推入了新的最後一根 K 線才發出
+        fresh = st.last_date == last and (last == self.session if self.session else last != prev_date)
+        flags = st.flags if fresh else {}
+        with self._lock:
+            self.states[ticker] = st
+            self._dirty[ticker] = st
+            for kind, ref in flags.items():
+                price = {"new_high": high[-1], "new_low": low[-1]}.get(kind, close[-1])
+                self.alerts[kind].append([ticker, name, round(float(price), 4), round(float(ref), 4)])
+        return flags
+
+    def begin(self, session=None):
+        """開始新的一輪處理：清空上一輪的警示並改用新的交易日 (常駐服務重複使用同一個 tracker)"""
+        with self._lock:
+            if session: self.session = str(session)
+            self.alerts = {k: [] for k, _ in KINDS}
+            self.rebuilt = 0
+
+    def save(self):
+        with self._lock:
+            rows = [st.to_row(t) for t, st in self._dirty.items()]
+            self._dirty = {}
+        self.conn.executemany(f"INSERT OR REPLACE INTO state ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                              rows)
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('lookback', ?)", (str(self.lookback),))
+        self.conn.commit()
+        return len(rows)
+
+    def close(self):
+        self.conn.close()
+
+def for_market(market_id, data_root=None):
+    return BreakoutTracker(os.path.join(data_root or catalog.DATA_ROOT, market_id),
+                           session=trading_calendar.latest_completed_session(market_id))
+
+# ========== 結果 (報告 / Telegram) ==========
+
+def sort_alerts(alerts):
+    """依突破幅度排序：新高 / 突破由價格超出前高最多者在前，新低 / 跌破由跌破幅度最大者在前"""
+    out = {}
+    for kind, _ in KINDS:
+        rows = alerts.get(kind, [])
+        sign = 1 if kind in ("new_high", "breakout") else -1
+        out[kind] = sorted(rows, key=lambda r: -sign * (r[2] - r[3]) / r[3] if r[3] else 0)
+    return out
+
+def results_path(market_id, session, data_root="./data"):
+    return Path(data_root) / market_id / "results" / f"breakouts_{session}.json"
+
+def save_results(alerts, market_id, session, data_root="./data", keep_days=30):
+    path = results_path(market_id, session, data_root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"market": market_id, "session": str(session), "lookback": LOOKBACK, "alerts": sort_alerts(alerts)},
+                  f, ensure_ascii=False)
+    tmp.replace(path)
+    for old in sorted(path.parent.glob("breakouts_*.json"))[:-keep_days] if keep_days else []:
+        old.unlink(missing_ok=True)
+    return path
+
+def load_results(market_id, session=None, data_root="./data"):
+    """讀取指定交易日 (預設最近一個) 的警示結果；沒有時回傳 None"""
+    if session is None:
+        files = sorted((Path(data_root) / market_id / "results").glob("breakouts_*.json"))
+        if not files: return None
+        path = files[-1]
+    else:
+        path = results_path(market_id, session, data_root)
+        if not path.exists(): return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def report_html(results):
+    """郵件報告區塊 (沒有任何警示時回傳空字串)"""
+    alerts = (results or {}).get("alerts") or {}
+    if not any(alerts.values()):
+        return ""
+    html = """
+            <div style="margin-bottom: 30px;">
+                <h4 style="color: #d35400;">🔔 52 週新高 / 新低警示</h4>"""
+    for kind, label in KINDS:
+        rows = alerts.get(kind) or []
+        if not rows: continue
+        more = f" ... 等 {len(rows)} 檔" if len(rows) > REPORT_LIMIT else ""
+        items = ", ".join(f"{t} {n} ({p:g} / 前極值 {r:g})" if n != t else f"{t} ({p:g} / 前極值 {r:g})"
+                          for t, n, p, r in rows[:REPORT_LIMIT])
+        html += f"""
+                <p><b>{label} ({len(rows)} 檔)</b>：{items}{more}</p>"""
+    return html + "\n            </div>"
+
+def telegram_text(market_name, results):
+    alerts = (results or {}).get("alerts") or {}
+    if not any(alerts.values()):
+        return ""
+    lines = [f"🔔 <b>{market_name} 52 週新高 / 新低</b> ({results.get('session')})"]
+    for kind, label in KINDS:
+        rows = alerts.get(kind) or []
+        if not rows: continue
+        more = " ..." if len(rows) > TELEGRAM_LIMIT else ""
+        lines.append(f"{label} {len(rows)} 檔: {', '.join(r[0] for r in rows[:TELEGRAM_LIMIT])}{more}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Show 52-week high/low breakout alerts")
+    parser.add_argument("--market", default="tw-share", choices=catalog.MARKET_IDS)
+    parser.add_argument("--session", default=None, help="交易日 YYYY-MM-DD，預設為最近一次分析")
+    parser.add_argument("--data-root", default="./data")
+    args = parser.parse_args()
+
+    results = load_results(args.market, args.session, args.data_root)
+    if results is None:
+        print(f"⚠️ 找不到 {args.market} 的警示結果 (需先執行一次分析)")
+        return
+    for kind, label in KINDS:
+        rows = results["alerts"].get(kind) or []
+        print(f"{label} ({len(rows)} 檔)")
+        for t, n, p, r in rows[:REPORT_LIMIT]:
+            print(f"   {t} {n} | {p:g} | 前極值 {r:g} | {(p - r) / r * 100:+.2f}%")
+    print(f"🔔 {args.market} {results['session']} 回溯 {results['lookback']} 根 K 線")
+
+if __name__ == "__main__":
+    main()
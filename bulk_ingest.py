@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+全市場日行情批次匯入：交易所每天以單一回應公布整個市場當日的 OHLCV
+(證交所 STOCK_DAY_ALL 上市全部個股、櫃買中心上櫃個股日收盤行情)，
+一次下載、向量化解析成每檔一根 K 線，直接附加到既有的日 K CSV，取代數千次逐檔 Yahoo 請求。
+陸股沿用抓清單時已下載的東方財富即時行情 (ak.stock_zh_a_spot_em，收盤後即當日 K 線)，
+韓股以 pykrx 依日期一次取得 KOSPI / KOSDAQ 全市場 OHLCV。
+
+以下情況仍交回逐檔 Yahoo (refresh_csv) 處理：
+- 尚無歷史資料 (新上市、首次下載) 或最後一根 K 線不是前一個交易日 (中間有缺口)
+- 交易所的「收盤價 - 漲跌價差」與已存的前一日收盤價不符 (除權息：Yahoo 的還原價需整段改寫)，
+  或行情表沒有可用的漲跌價差 / 昨收 (無法驗證參考價)
+- 當日無成交或行情表中沒有該代號
+
+    STOCK_MONITOR_BULK=0 python main.py --market tw-share          # 停用批次匯入
+    python bulk_ingest.py --twse twse.json --tpex tpex.json          # 以錄製的回應檔解析並列出
+    python bulk_ingest.py --market cn-share --spot spot.csv          # 陸股即時行情錄製檔 (CSV)
+"""
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import date, datetime, timezone
+
+import datafeed
+import trading_calendar
+
+BULK_ENV = "STOCK_MONITOR_BULK"
+TWSE_DAY_ALL_URL = "https://www.twse.com.tw/rwd/zh/afterTrading/STOCK_DAY_ALL"
+TPEX_DAILY_URL = "https://www.tpex.org.tw/openapi/v1/tpex_mainboard_daily_close_quotes"
+BAR_COLUMNS = ["ticker", "date", "open", "high", "low", "close", "volume", "change"]
+# 參考價比對容許誤差：max(絕對值, 相對值 x 前一日收盤)
+REF_ABS_TOLERANCE = 0.011
+REF_REL_TOLERANCE = 1e-3
+# 附加後裁切為與完整下載相同的回溯長度
+KEEP_DAYS = datafeed.PERIOD_DAYS["2y"]
+
+def log(msg: str):
+    print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
+
+def enabled():
+    return os.getenv(BULK_ENV, "1").strip() != "0"
+
+def _num(col):
+    """交易所字串欄位 -> 浮點數 (去除千分位、正號與 HTML 標記；"--"、"X0.00" 之類無法解析者為 NaN)"""
+    s = pd.Series(col, dtype=str).str.replace(r"<[^>]*>|[,+\s]", "", regex=True)
+    return pd.to_numeric(s, errors="coerce")
+
+def _bars(codes, day, suffix, open_, high, low, close, volume, change):
+    bars = pd.DataFrame({
+        "ticker": pd.Series(codes, dtype=str).str.strip() + suffix, "date": day,
+        "open": _num(open_), "high": _num(high), "low": _num(low), "close": _num(close),
+        "volume": _num(volume), "change": _num(change),
+    })
+    # 當日無成交 (收盤價為 --、停牌的開盤價為 0 或空白) 的代號不列入
+    return bars[(bars["close"] > 0) & (bars["open"] > 0)].reset_index(drop=True)
+
+# ========== 台股 ==========
+
+def parse_twse_day_all(payload, suffix=".TW"):
+    """證交所 STOCK_DAY_ALL (JSON) -> K 線表；fields 為中文欄名，date 為 YYYYMMDD"""
+    if payload.get("stat") != "OK" or not payload.get("data"):
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    df = pd.DataFrame(payload["data"], columns=payload["fields"])
+    day = pd.Timestamp(payload["date"]).strftime("%Y-%m-%d")
+    return _bars(df["證券代號"], day, suffix, df["開盤價"], df["最高價"], df["最低價"], df["收盤價"],
+                 df["成交股數"], df["漲跌價差"])
+
+def _roc_date(value):
+    """民國日期 1151016 -> 2026-10-16"""
+    value = str(value).strip()
+    return f"{int(value[:-4]) + 1911}-{value[-4:-2]}-{value[-2:]}"
+
+def parse_tpex_daily(payload, suffix=".TWO"):
+    """櫃買中心上櫃個股日收盤行情 (openapi JSON 陣列) -> K 線表"""
+    if not payload:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    df = pd.DataFrame(payload)
+    day = _roc_date(df["Date"].iloc[0])
+    return _bars(df["SecuritiesCompanyCode"], day, suffix, df["Open"], df["High"], df["Low"], df["Close"],
+                 df["TradingShares"], df["Change"])
+
+def _load_json(source, url, params=None):
+    """source 為錄製的回應檔路徑時直接讀檔，否則向交易所 (或替身伺服器) 請求"""
+    if source:
+        with open(source, encoding="utf-8") as f:
+            return json.load(f)
+    resp = datafeed.http_get(url, params=params, timeout=30, headers={"User-Agent": "Mozilla/5.0"})
+    resp.raise_for_status()
+    return resp.json()
+
+def fetch_tw_bars(session, twse_fixture=None, tpex_fixture=None):
+    """下載 (或讀取錄製檔) 並解析上市、上櫃全市場日行情；只保留日期等於 session 的表"""
+    frames = []
+    for name, fn, source, url, params in [
+        ("證交所", parse_twse_day_all, twse_fixture, TWSE_DAY_ALL_URL,
+         {"date": session.strftime("%Y%m%d"), "response": "json"}),
+        ("櫃買中心", parse_tpex_daily, tpex_fixture, TPEX_DAILY_URL, None),
+    ]:
+        try:
+            bars = fn(_load_json(source, url, params))
+        except Exception as e:
+            log(f"⚠️ {name}全市場日行情取得失敗: {e}")
+            continue
+        if bars.empty or bars["date"].iloc[0] != session.isoformat():
+            log(f"⚠️ {name}日行情日期 {bars['date'].iloc[0] if len(bars) else '-'} 不是 {session}，改走逐檔下載")
+            continue
+        frames.append(bars)
+    if not frames:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    return pd.concat(frames, ignore_index=True).drop_duplicates("ticker", keep="first")
+
+# ========== 陸股 / 韓股 ==========
+
+def spot_session(market_id, now=None):
+    """即時行情表所代表的交易日：今天已開盤則為今天，否則為前一個交易日"""
+    now = now or datetime.now(timezone.utc)
+    today = trading_calendar.local_today(market_id, now)
+    opened = datetime.combine(today, trading_calendar.MARKETS[market_id]["open"],
+                              tzinfo=trading_calendar.market_tz(market_id))
+    if trading_calendar.is_trading_day(market_id, today) and now >= opened:
+        return today
+    return trading_calendar.previous_trading_day(market_id, today)
+
+def parse_cn_spot(df, day):
+    """東方財富 A 股即時行情 -> K 線表；代號即清單鍵 (六位數)，成交量單位為手 (100 股)"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    close = _num(df["最新价"])
+    return _bars(pd.Series(df["代码"], dtype=str).str.zfill(6), day, "", df["今开"], df["最高"], df["最低"], close,
+                 (_num(df["成交量"]) * 100).round(), close - _num(df["昨收"]))
+
+def fetch_cn_bars(spot, session, now=None):
+    """即時行情表必須是 session 收盤後的快照 (盤中或跨日前的表不能當成 session 的 K 線)"""
+    current = spot_session("cn-share", now)
+    if current != session:
+        log(f"⚠️ A 股即時行情屬於 {current} (尚未收盤)，不是 {session}，改走逐檔下載")
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    return parse_cn_spot(spot, session.isoformat()).drop_duplicates("ticker", keep="first")
+
+def parse_kr_ohlcv(df, day, suffix=".KS"):
+    """pykrx get_market_ohlcv (已 reset_index，含 티커 欄) -> K 線表；前一日收盤由 등락률 (%) 反推"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    close = _num(df["종가"])
+    prev = close / (1 + _num(df["등락률"]) / 100)
+    return _bars(pd.Series(df["티커"], dtype=str).str.zfill(6), day, suffix, df["시가"], df["고가"], df["저가"],
+                 close, df["거래량"], close - prev)
+
+def fetch_kr_bars(session, fetch_fn):
+    """fetch_fn(YYYYMMDD, 市場) 回傳該日 pykrx 全市場 OHLCV (休市日為空表)"""
+    ymd = session.strftime("%Y%m%d")
+    frames = []
+    for mk, suffix in [("KOSPI", ".KS"), ("KOSDAQ", ".KQ")]:
+        try:
+            df = datafeed.source_frame(f"pykrx/market_ohlcv_{mk}_{ymd}", fetch_fn, ymd, mk)
+        except Exception as e:
+            log(f"⚠️ {mk} 全市場 OHLCV 取得失敗: {e}")
+            continue
+        frames.append(parse_kr_ohlcv(df, session.isoformat(), suffix))
+    if not frames:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    return pd.concat(frames, ignore_index=True).drop_duplicates("ticker", keep="first")
+
+# ========== 附加到既有歷史 ==========
+
+def _append_row(stored, bar):
+    """以既有最後一列為樣板組出新 K 線 (日期字串保留原本的時間與時區尾碼，事件欄位補 0)"""
+    last = stored.iloc[-1]
+    row = {c: (0.0 if c in datafeed.ACTION_COLUMNS else np.nan) for c in stored.columns}
+    row["date"] = bar["date"] + str(last["date"])[10:]
+    for c in ("open", "high", "low", "close", "volume"):
+        if c in row: row[c] = bar[c]
+    # 成交量維持整數欄位 (陸股由手換算成股時為浮點數)
+    if "volume" in row and pd.notna(row["volume"]): row["volume"] = int(round(row["volume"]))
+    merged = pd.concat([stored, pd.DataFrame([row], columns=stored.columns)], ignore_index=True)
+    cutoff = (pd.Timestamp(bar["date"]) - pd.Timedelta(days=KEEP_DAYS)).strftime("%Y-%m-%d")
+    return merged[merged["date"].astype(str).str[:10] >= cutoff]
+
+def check_append(stored, bar, prev_session):
+    """回傳無法直接附加的原因 (可附加時回傳 None)"""
+    if stored is None or stored.empty or "date" not in stored.columns or "close" not in stored.columns:
+        return "no history"
+    last = str(stored["date"].iloc[-1])[:10]
+    if last != prev_session.isoformat():
+        return "gap"
+    # 漲跌價差非數值 (櫃買 Change 欄的特殊符號、陸股缺昨收) 時無法確認沒有除權息，交回逐檔下載
+    if pd.isna(bar["change"]) or pd.isna(bar["close"]):
+        return "no reference"
+    prev_close = float(stored["close"].iloc[-1])
+    if abs(bar["close"] - bar["change"] - prev_close) > max(REF_ABS_TOLERANCE, REF_REL_TOLERANCE * abs(prev_close)):
+        return "reference mismatch"
+    return None
+
+def append_bars(market_id, bars, items, path_fn, key_fn, session):
+    """
+    把全市場 K 線附加到各檔 CSV，回傳 (已附加的項目, 需逐檔下載的項目, 各原因檔數)。
+    key_fn(項目) 須與 bars["ticker"] 相同 (如 2330.TW、600519、005930.KS)。
+    """
+    prev_session = trading_calendar.previous_trading_day(market_id, session)
+    lookup = {t: i for i, t in enumerate(bars["ticker"])}
+    records = bars.to_dict("records")
+    done, rest, reasons = [], [], {}
+    for it in items:
+        i = lookup.get(key_fn(it))
+        path = path_fn(it)
+        if i is None or not path:
+            reason = "not in table"
+        else:
+            stored = datafeed.load_history(path)
+            reason = check_append(stored, records[i], prev_session)
+            if reason is None:
+                datafeed.save_history(_append_row(stored, records[i]), path)
+                done.append(it)
+                continue
+        reasons[reason] = reasons.get(reason, 0) + 1
+        rest.append(it)
+    return done, rest, reasons
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse whole-market daily quote tables (live or recorded fixtures)")
+    parser.add_argument("--market", default="tw-share", choices=["tw-share", "cn-share"])
+    parser.add_argument("--session", default=None, help="交易日 YYYY-MM-DD，預設為最近已收盤交易日")
+    parser.add_argument("--twse", default=None, help="證交所 STOCK_DAY_ALL 錄製檔 (JSON)")
+    parser.add_argument("--tpex", default=None, help="櫃買中心日收盤行情錄製檔 (JSON)")
+    parser.add_argument("--spot", default=None, help="A 股即時行情錄製檔 (CSV，欄位同 ak.stock_zh_a_spot_em)")
+    parser.add_argument("-n", type=int, default=10, help="列出前 N 筆")
+    args = parser.parse_args()
+
+    session = date.fromisoformat(args.session) if args.session else trading_calendar.latest_completed_session(args.market)
+    if args.market == "cn-share":
+        if args.spot:
+            spot = pd.read_csv(args.spot, dtype={"代码": str})
+        else:
+            import akshare as ak
+            spot = datafeed.source_frame("akshare/stock_zh_a_spot_em", ak.stock_zh_a_spot_em)
+        # 錄製檔或指定日期時不檢查快照時間
+        bars = parse_cn_spot(spot, session.isoformat()) if args.spot or args.session else fetch_cn_bars(spot, session)
+    else:
+        bars = fetch_tw_bars(session, args.twse, args.tpex)
+    print(bars.head(args.n).to_string(index=False))
+    print(f"📦 {session} 全市場日行情：{len(bars)} 檔")
+
+if __name__ == "__main__":
+    main()
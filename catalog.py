@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+每市場資料目錄 (data/<market>/lists/catalog.db)：每檔日 K 的代號、名稱、路徑、首末 K 線日期、
+列數、校驗碼、寫入時間、近期平均成交值、最後一次下載狀態與連續失敗日數 (負快取，見 negative_cache.py)。每次寫入 CSV (datafeed.save_history) 與每筆續跑清單狀態
+(RunManifest.record) 都會同步更新，新鮮度判斷、分析資格篩選與失敗報告直接查詢目錄，
+不必逐檔 stat / 開檔解析。
+
+    python catalog.py rebuild --market tw-share     # 由既有 dayK 目錄重建 (all = 全部市場)
+    python catalog.py stats --market tw-share
+"""
+import os
+import zlib
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_ROOT = os.path.join(BASE_DIR, "data")
+CATALOG_FILE = "catalog.db"
+MARKET_IDS = ["tw-share", "us-share", "hk-share", "cn-share", "jp-share", "kr-share"]
+FAILED_STATUS = {"error", "empty"}
+# 平均成交值 (收盤價 x 成交量) 取最後幾根 K 線，供下載排程判斷流動性
+TURNOVER_BARS = 20
+
+COLUMNS = ["ticker", "name", "path", "first_date", "last_date", "rows", "checksum", "size",
+           "written_at", "status", "last_error", "fetched_at", "turnover", "misses"]
+COLUMN_TYPES = {"rows": "INTEGER", "size": "INTEGER", "turnover": "REAL", "misses": "INTEGER"}
+
+_OPEN = {}
+_OPEN_LOCK = threading.Lock()
+
+def parse_ticker_name(stem, market_id):
+    """多國檔名解析策略：由 CSV 檔名 (不含副檔名) 解析出代號與名稱"""
+    if market_id in ["hk-share", "jp-share", "kr-share"]:
+        # 港日韓多為單一代號格式 (如 7203.T.csv 或 005930.KS.csv)
+        return stem, stem
+    elif "_" in stem:
+        # 台、美、中 (如 AAPL_Apple.csv 或 600519_貴州茅台.csv)
+        tkr, nm = stem.split('_', 1)
+        return tkr, nm
+    return stem, stem
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+def catalog_path(market_dir):
+    return os.path.join(market_dir, "lists", CATALOG_FILE)
+
+def file_checksum(path):
+    with open(path, "rb") as f:
+        return f"{zlib.crc32(f.read()):08x}"
+
+def mean_turnover(frame, bars=TURNOVER_BARS):
+    """最後 bars 根 K 線的平均成交值；缺少 close / volume 欄位時回傳 None"""
+    cols = {c.lower(): c for c in frame.columns}
+    if "close" not in cols or "volume" not in cols or not len(frame):
+        return None
+    tail = frame.tail(bars)
+    value = (tail[cols["close"]].astype(float) * tail[cols["volume"]].astype(float)).mean()
+    return None if value != value else float(value)
+
+class Catalog:
+    """
+    單一市場的目錄：啟動時整表載入記憶體 (數千列，毫秒級)，查詢只走 dict，
+    寫入同時更新記憶體與 SQLite (多執行緒下載時以鎖序列化)。
+    """
+    def __init__(self, market_dir):
+        self.market_dir = os.path.abspath(market_dir)
+        self.market_id = os.path.basename(self.market_dir)
+        self.path = catalog_path(self.market_dir)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS files ({COLUMNS[0]} TEXT PRIMARY KEY, "
+                          + ", ".join(f"{c} {COLUMN_TYPES.get(c, 'TEXT')}" for c in COLUMNS[1:]) + ")")
+        # 舊版目錄缺少的欄位直接補上 (值為 NULL，下次寫入或 rebuild 時填入)
+        have = {r[1] for r in self.conn.execute("PRAGMA table_info(files)")}
+        for c in COLUMNS:
+            if c not in have:
+                self.conn.execute(f"ALTER TABLE files ADD COLUMN {c} {COLUMN_TYPES.get(c, 'TEXT')}")
+        self.conn.commit()
+        self.rows = {r[0]: dict(zip(COLUMNS, r)) for r in self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM files")}
+        self.by_path = {r["path"]: r for r in self.rows.values() if r["path"]}
+        # 本輪由負快取恢復 (連續失敗後又抓到資料) 的代號
+        self.reinstated = set()
+
+    def _upsert(self, row):
+        self.conn.execute(f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                          [row.get(c) for c in COLUMNS])
+
+    def record_file(self, path, first_date, last_date, rows, checksum, size, written_at=None, commit=True,
+                    turnover=None):
+        path = os.path.abspath(path)
+        ticker, name = parse_ticker_name(Path(path).stem, self.market_id)
+        with self._lock:
+            row = dict(self.rows.get(ticker) or {"ticker": ticker})
+            row.update({"name": name, "path": path, "first_date": first_date, "last_date": last_date,
+                        "rows": int(rows), "checksum": checksum, "size": int(size),
+                        "written_at": (written_at or datetime.now(timezone.utc)).isoformat(timespec="seconds"),
+                        "turnover": turnover})
+            self.rows[ticker] = row
+            self.by_path[path] = row
+            self._upsert(row)
+            if commit: self.conn.commit()
+        return row
+
+    def record_status(self, ticker, status, error=None):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            row = dict(self.rows.get(ticker) or {"ticker": ticker})
+            misses = row.get("misses") or 0
+            if status in FAILED_STATUS:
+                # 連續失敗以「日」計：同一天重跑 (續跑、--retry-failed) 不重複累加
+                same_day = (row.get("status") in FAILED_STATUS and row.get("fetched_at")
+                            and datetime.fromisoformat(row["fetched_at"]).date() == now.date())
+                misses = misses if same_day and misses else misses + 1
+            else:
+                if misses: self.reinstated.add(ticker)
+                misses = 0
+            row.update({"status": status, "last_error": error if status in FAILED_STATUS else None,
+                        "fetched_at": now.isoformat(timespec="seconds"), "misses": misses})
+            self.rows[ticker] = row
+            if row.get("path"): self.by_path[row["path"]] = row
+            self._upsert(row)
+            self.conn.commit()
+
+    def lookup(self, path):
+        return self.by_path.get(os.path.abspath(path))
+
+    def entry_for(self, path):
+        """以路徑查詢，檔案尚未寫入時退回以代號查詢 (保留下載失敗的狀態)"""
+        return self.lookup(path) or self.rows.get(parse_ticker_name(Path(path).stem, self.market_id)[0])
+
+    def failures(self):
+        """最後一次下載失敗的標的 [(代號, 狀態, 錯誤, 時間), ...]"""
+        return sorted((r["ticker"], r["status"], r["last_error"], r["fetched_at"])
+                      for r in self.rows.values() if r.get("status") in FAILED_STATUS)
+
+    def rebuild(self):
+        """掃描 dayK 目錄重建檔案欄位 (保留下載狀態)，並移除已不存在的檔案"""
+        import pandas as pd
+        day_dir = os.path.join(self.market_dir, "dayK")
+        files = sorted(Path(day_dir).glob("*.csv")) if os.path.isdir(day_dir) else []
+        seen = set()
+        for f in files:
+            try:
+                df = pd.read_csv(f, usecols=lambda c: c.lower() in ("date", "close", "volume"))
+                dates = df.iloc[:, 0].astype(str).str[:10]
+            except Exception:
+                continue
+            st = f.stat()
+            row = self.record_file(f, dates.min() if len(dates) else None, dates.max() if len(dates) else None,
+                                   len(dates), file_checksum(f), st.st_size,
+                                   datetime.fromtimestamp(st.st_mtime, tz=timezone.utc), commit=False,
+                                   turnover=mean_turnover(df))
+            seen.add(row["ticker"])
+        with self._lock:
+            for ticker, row in list(self.rows.items()):
+                if row.get("path") and ticker not in seen:
+                    self.by_path.pop(row["path"], None)
+                    row.update({k: None for k in COLUMNS[2:9] + ["turnover"]})
+                    self._upsert(row)
+            self.conn.commit()
+        return len(seen)
+
+def open_catalog(market_dir):
+    """同一市場目錄在行程內共用一個 Catalog"""
+    key = os.path.abspath(market_dir)
+    with _OPEN_LOCK:
+        if key not in _OPEN:
+            _OPEN[key] = Catalog(key)
+        return _OPEN[key]
+
+def for_market(market_id, root=None):
+    return open_catalog(os.path.join(root or DATA_ROOT, market_id))
+
+def for_csv(path):
+    """data/<market>/dayK/<檔名>.csv -> 該市場的目錄"""
+    return open_catalog(Path(os.path.abspath(path)).parent.parent)
+
+def existing(market_dir):
+    """目錄已建立時回傳 Catalog，否則回傳 None (呼叫端退回逐檔判斷)"""
+    if not os.path.exists(catalog_path(os.path.abspath(market_dir))):
+        return None
+    return open_catalog(market_dir)
+
+def record_write(frame, path):
+    """datafeed.save_history 寫入後呼叫：以剛寫好的 DataFrame 更新目錄 (不重讀 CSV 解析)"""
+    dates = frame["date"].astype(str).str[:10] if "date" in frame.columns and len(frame) else None
+    return for_csv(path).record_file(path, dates.min() if dates is not None else None,
+                                     dates.max() if dates is not None else None,
+                                     len(frame), file_checksum(path), os.path.getsize(path),
+                                     turnover=mean_turnover(frame))
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-market data catalog")
+    parser.add_argument("command", choices=["rebuild", "stats"])
+    parser.add_argument("--market", default="all", choices=MARKET_IDS + ["all"])
+    parser.add_argument("--data-root", default=DATA_ROOT)
+    args = parser.parse_args()
+
+    for market_id in (MARKET_IDS if args.market == "all" else [args.market]):
+        if not os.path.isdir(os.path.join(args.data_root, market_id)): continue
+        cat = for_market(market_id, args.data_root)
+        if args.command == "rebuild":
+            n = cat.rebuild()
+            print(f"✅ {market_id} 目錄重建完成：{n} 個檔案 -> {cat.path}")
+        else:
+            files = [r for r in cat.rows.values() if r.get("path")]
+            last = sorted(r["last_date"] for r in files if r.get("last_date"))
+            print(f"📚 {market_id} | 檔案 {len(files)} | 最新 K 線 {last[-1] if last else '-'} | "
+                  f"最舊 K 線 {last[0] if last else '-'} | 失敗 {len(cat.failures())}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+資料庫封存檔：把市場的 data/<market>/ (日 K / 週 K / 月 K、資料目錄、續跑清單、排名索引、快照、新高新低狀態)
+與港 / 日股的 SQLite 倉儲打包成單一壓縮檔，新的 runner 還原時只需一次循序讀取，取代 actions/cache 還原數千個小 CSV。
+
+格式：MAGIC 之後是一連串紀錄，每筆為 4 bytes 標頭長度 + JSON 標頭 + 壓縮內容：
+
+- meta   第一筆：版本、建立時間、來源資料根目錄 (還原到不同路徑時據此改寫 catalog.db 內的絕對路徑)
+- bars   同一目錄、同一表頭的 K 線 CSV 轉成欄式儲存 (每欄的值跨檔串接)，同一欄的日期、價格相鄰，壓縮率遠高於逐檔壓縮；
+         每筆最多 BARS_RECORD_BYTES / BARS_RECORD_FILES，匯出與匯入的記憶體用量不隨市場大小成長；
+         還原時逐位元組重建原檔 (catalog 的校驗碼仍然有效)，含引號或換行格式不一致的檔案改以 file 原樣收錄
+- file   其餘檔案原樣收錄；SQLite 以 backup API 取得一致的單一檔 (不含 -wal / -shm)
+- end    最後一筆：紀錄數，用來偵測截斷
+
+每筆內容皆附未壓縮資料的 sha256；壓縮優先使用 zstd (需安裝 zstandard)，未安裝時退回標準庫 lzma (xz)。
+匯入為串流處理，--market 只還原指定市場 (其餘紀錄直接跳過，不解壓)。內容先解到暫存目錄，讀到 end 紀錄、
+整個封存檔驗證無誤後才整目錄替換 data/<market>/ 與倉儲；中途校驗失敗或截斷時既有資料保持原樣。
+
+    python main.py snapshot export --market tw-share              # -> snapshots/tw-share.snap
+    python main.py snapshot import --market tw-share
+    python main.py snapshot import --file snapshots/all.snap --market cn-share,kr-share
+    python main.py snapshot inspect --file snapshots/tw-share.snap
+"""
+import io
+import os
+import sys
+import json
+import lzma
+import time
+import shutil
+import struct
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import catalog
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"STKSNAP1"
+FORMAT_VERSION = 1
+SNAPSHOT_DIR = "./snapshots"
+DATA_ROOT = "./data"
+# 以欄式儲存的 K 線目錄
+BAR_DIRS = ["dayK", "weekK", "monthK"]
+# 單筆 bars 紀錄收錄的原始 CSV 上限 (位元組 / 檔數)，達到任一上限即寫出
+BARS_RECORD_BYTES = 32 << 20
+BARS_RECORD_FILES = 2000
+# 匯入時的暫存目錄 (建立在資料根目錄與倉儲目錄下，替換時只需同一檔案系統內改名)
+STAGING_DIR = ".snapshot-staging"
+# 不收錄的暫存檔
+SKIP_SUFFIXES = (".tmp", "-wal", "-shm", "-journal")
+# 存放在專案根目錄、非 data/<market>/ 下的市場倉儲
+WAREHOUSES = {"hk-share": "hk_stock_warehouse.db", "jp-share": "jp_stock_warehouse.db"}
+ZSTD_LEVEL = 10
+LZMA_PRESET = 6
+# 跳過不需要的紀錄時每次讀取的位元組數 (無法 seek 的輸入，例如標準輸入)
+SKIP_CHUNK = 1 << 20
+
+def log(msg: str):
+    print(f"{time.strftime('%H:%M:%S')}: {msg}")
+
+def default_codec():
+    return "zstd" if zstandard is not None else "xz"
+
+def compress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return lzma.compress(data, preset=LZMA_PRESET)
+
+def decompress(data, codec):
+    """解壓縮；內容損毀時統一拋出 ValueError"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("封存檔以 zstd 壓縮，請先 pip install zstandard")
+        try:
+            return zstandard.ZstdDecompressor().decompress(data)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"解壓縮失敗 (封存檔損毀): {e}")
+    if codec == "xz":
+        try:
+            return lzma.decompress(data)
+        except lzma.LZMAError as e:
+            raise ValueError(f"解壓縮失敗 (封存檔損毀): {e}")
+    raise ValueError(f"未知的壓縮格式: {codec}")
+
+def archive_path(spec):
+    """--market 參數 -> 預設封存檔路徑 (snapshots/tw-share.snap、snapshots/all.snap)"""
+    return os.path.join(SNAPSHOT_DIR, f"{spec.replace(',', '+')}.snap")
+
+# ========== 欄式 K 線 ==========
+
+def _columnar_lines(data):
+    """可逐位元組還原的 CSV 回傳 (表頭, 資料列)；含引號、CR 或欄數不一致時回傳 None"""
+    if not data.endswith(b"\n") or b"\r" in data or b'"' in data:
+        return None
+    lines = data[:-1].split(b"\n")
+    commas = lines[0].count(b",")
+    if any(line.count(b",") != commas for line in lines[1:]):
+        return None
+    return lines[0], lines[1:]
+
+def pack_bars(files):
+    """
+    同一表頭的多個 CSV -> 單一欄式內容：第一行為 JSON (表頭、各檔名稱 / 列數 / 修改時間、各欄長度)，之後為各欄串接值。
+    files 為 [(名稱, 內容, mtime_ns)]，表頭必須相同
+    """
+    header = files[0][1][:files[0][1].index(b"\n")]
+    rows, entries = [], []
+    for name, data, mtime in files:
+        body = _columnar_lines(data)[1]
+        entries.append([name, len(body), mtime])
+        rows.extend(body)
+    columns = [b"\n".join(col) for col in zip(*(r.split(b",") for r in rows))] if rows else []
+    meta = {"header": header.decode("utf-8"), "files": entries, "columns": [len(c) for c in columns]}
+    return json.dumps(meta, ensure_ascii=False).encode("utf-8") + b"\n" + b"".join(columns)
+
+def unpack_bars(payload):
+    """pack_bars 的反向：產生 (名稱, 原始內容, mtime_ns)"""
+    cut = payload.index(b"\n")
+    meta = json.loads(payload[:cut].decode("utf-8"))
+    header = meta["header"].encode("utf-8")
+    pos, columns = cut + 1, []
+    for size in meta["columns"]:
+        columns.append(payload[pos:pos + size].split(b"\n"))
+        pos += size
+    rows = [b",".join(r) for r in zip(*columns)] if columns else []
+    start = 0
+    for name, n, mtime in meta["files"]:
+        yield name, b"\n".join([header] + rows[start:start + n]) + b"\n", mtime
+        start += n
+
+def _sqlite_bytes(path):
+    """以 backup API 取得 SQLite 的一致複本 (WAL 模式下未合併的頁面也包含在內)"""
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        src, dst = sqlite3.connect(path), sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        with open(tmp, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(tmp)
+
+def _read_file(path):
+    if path.suffix == ".db":
+        return _sqlite_bytes(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+# ========== 匯出 ==========
+
+class ArchiveWriter:
+    def __init__(self, f, codec):
+        self.f = f
+        self.codec = codec
+        self.records = 0
+        self.raw_bytes = 0
+        self.packed_bytes = 0
+        f.write(MAGIC)
+
+    def write(self, header, payload=b""):
+        body = compress(payload, self.codec) if payload else b""
+        header = dict(header, codec=self.codec, raw=len(payload), size=len(body),
+                      sha256=hashlib.sha256(payload).hexdigest())
+        head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        self.f.write(struct.pack(">I", len(head)) + head)
+        self.f.write(body)
+        self.records += 1
+        self.raw_bytes += len(payload)
+        self.packed_bytes += len(body)
+
+def _export_market(writer, market_id, data_root, base_dir):
+    market_dir = Path(data_root) / market_id
+    files = 0
+    for sub in BAR_DIRS:
+        # 表頭 -> [累積的檔案, 原始位元組數]；達到上限即寫出一筆，記憶體中最多保留每種表頭一批
+        groups = {}
+        header = {"kind": "bars", "market": market_id, "path": f"{market_id}/{sub}"}
+        for p in sorted((market_dir / sub).glob("*.csv")):
+            with open(p, "rb") as f:
+                data = f.read()
+            parsed = _columnar_lines(data)
+            if parsed is None:
+                writer.write({"kind": "file", "market": market_id, "path": f"{market_id}/{sub}/{p.name}",
+                              "mtime": p.stat().st_mtime_ns}, data)
+                files += 1
+                continue
+            group = groups.setdefault(parsed[0], [[], 0])
+            group[0].append((p.name, data, p.stat().st_mtime_ns))
+            group[1] += len(data)
+            if group[1] >= BARS_RECORD_BYTES or len(group[0]) >= BARS_RECORD_FILES:
+                writer.write(header, pack_bars(group[0]))
+                files += len(group[0])
+                del groups[parsed[0]]
+        for entries, _ in groups.values():
+            writer.write(header, pack_bars(entries))
+            files += len(entries)
+    # 其餘檔案 (資料目錄、續跑清單、排名索引、快照、新高新低狀態...) 原樣收錄
+    for p in sorted(market_dir.rglob("*")):
+        rel = p.relative_to(market_dir)
+        if not p.is_file() or rel.parts[0] in BAR_DIRS or p.name.endswith(SKIP_SUFFIXES):
+            continue
+        writer.write({"kind": "file", "market": market_id, "path": f"{market_id}/{rel.as_posix()}",
+                      "mtime": p.stat().st_mtime_ns}, _read_file(p))
+        files += 1
+    warehouse = WAREHOUSES.get(market_id)
+    if warehouse and os.path.exists(os.path.join(base_dir, warehouse)):
+        p = Path(base_dir) / warehouse
+        writer.write({"kind": "warehouse", "market": market_id, "path": warehouse, "mtime": p.stat().st_mtime_ns},
+                     _read_file(p))
+        files += 1
+    return files
+
+def export_snapshot(markets, out_path=None, data_root=DATA_ROOT, base_dir=catalog.BASE_DIR, codec=None):
+    """把指定市場打包成單一封存檔 (先寫暫存檔再改名)，回傳統計"""
+    t0 = time.time()
+    out_path = out_path or archive_path(",".join(markets))
+    codec = codec or default_codec()
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp = f"{out_path}.tmp"
+    counts = {}
+    with open(tmp, "wb") as f:
+        writer = ArchiveWriter(f, codec)
+        writer.write({"kind": "meta", "version": FORMAT_VERSION, "markets": markets,
+                      "created_at": datetime.now().isoformat(timespec="seconds"),
+                      "data_root": os.path.abspath(data_root)})
+        for m in markets:
+            counts[m] = _export_market(writer, m, data_root, base_dir)
+        writer.write({"kind": "end", "records": writer.records})
+    os.replace(tmp, out_path)
+    return {"path": out_path, "codec": codec, "files": counts, "records": writer.records,
+            "raw_bytes": writer.raw_bytes, "bytes": os.path.getsize(out_path), "seconds": time.time() - t0}
+
+# ========== 匯入 ==========
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("封存檔不完整 (提前結束)")
+    return data
+
+def _skip(f, n):
+    try:
+        f.seek(n, io.SEEK_CUR)
+    except (OSError, io.UnsupportedOperation):
+        while n > 0:
+            chunk = f.read(min(n, SKIP_CHUNK))
+            if not chunk:
+                raise ValueError("封存檔不完整 (提前結束)")
+            n -= len(chunk)
+
+def iter_records(f, wanted=None):
+    """
+    依序產生 (標頭, 未壓縮內容)；wanted(標頭) 為 False 的紀錄不讀取內容 (回傳 None)。
+    內容的 sha256 不符或檔案被截斷時拋出 ValueError
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("不是資料庫封存檔 (檔頭不符)")
+    count = 0
+    while True:
+        raw = f.read(4)
+        if len(raw) != 4:
+            raise ValueError("封存檔不完整 (缺少結尾紀錄)")
+        header = json.loads(_read_exact(f, struct.unpack(">I", raw)[0]))
+        if header["kind"] == "end":
+            if header["records"] != count:
+                raise ValueError(f"紀錄數不符：結尾標示 {header['records']}，實際 {count}")
+            yield header, None
+            return
+        count += 1
+        if wanted is not None and not wanted(header):
+            _skip(f, header["size"])
+            yield header, None
+            continue
+        payload = decompress(_read_exact(f, header["size"]), header["codec"]) if header["size"] else b""
+        if hashlib.sha256(payload).hexdigest() != header["sha256"]:
+            raise ValueError(f"校驗碼不符: {header.get('path') or header['kind']}")
+        yield header, payload
+
+def _safe_join(root, rel):
+    """拒絕絕對路徑與 .. (封存檔內容不得寫出目標目錄之外)"""
+    parts = Path(rel).parts
+    if Path(rel).is_absolute() or ".." in parts:
+        raise ValueError(f"不合法的路徑: {rel}")
+    return os.path.join(root, *parts)
+
+def _write(path, data, mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    if mtime:
+        os.utime(path, ns=(mtime, mtime))
+
+def _relocate_catalog(path, old_root, new_root):
+    """catalog.db 以絕對路徑登錄 CSV：還原到不同的資料根目錄時一併改寫"""
+    old_root, new_root = old_root.rstrip(os.sep) + os.sep, new_root.rstrip(os.sep) + os.sep
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("UPDATE files SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?",
+                     (new_root, len(old_root) + 1, len(old_root), old_root))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _swap_in(staged, final, trash):
+    """以暫存目錄 / 檔案整個替換目標 (同一檔案系統內的 rename)；既有目錄先改名到 trash"""
+    if os.path.isdir(final) and not os.path.islink(final):
+        os.replace(final, trash)
+    os.replace(staged, final)
+
+def import_snapshot(in_path=None, markets=None, data_root=DATA_ROOT, base_dir=catalog.BASE_DIR):
+    """
+    串流還原封存檔；markets 指定時只還原這些市場 (其餘紀錄跳過)。
+    先解到暫存目錄，整個封存檔驗證通過後才替換 data/<market>/ 與倉儲；失敗時拋出 ValueError，既有資料不變。
+    in_path 為 "-" 時讀取標準輸入。回傳各市場還原的檔案數
+    """
+    t0 = time.time()
+    wanted = (lambda h: h["kind"] == "meta" or h.get("market") in markets) if markets else None
+    dest_root = os.path.abspath(data_root)
+    stage_data = os.path.join(dest_root, STAGING_DIR)
+    stage_base = os.path.join(os.path.abspath(base_dir), STAGING_DIR)
+    counts, source_root = {}, dest_root
+    f = sys.stdin.buffer if in_path == "-" else open(in_path, "rb")
+    try:
+        # 清掉上次中斷留下的暫存
+        for d in (stage_data, stage_base):
+            shutil.rmtree(d, ignore_errors=True)
+        for header, payload in iter_records(f, wanted):
+            kind, market = header["kind"], header.get("market")
+            if kind == "meta":
+                source_root = header.get("data_root") or dest_root
+                continue
+            if payload is None:
+                continue
+            if kind == "bars":
+                folder = _safe_join(stage_data, header["path"])
+                for name, data, mtime in unpack_bars(payload):
+                    _write(_safe_join(folder, name), data, mtime)
+                    counts[market] = counts.get(market, 0) + 1
+                continue
+            path = _safe_join(stage_base if kind == "warehouse" else stage_data, header["path"])
+            _write(path, payload, header.get("mtime"))
+            # catalog 登錄的是最終位置 (dest_root) 而非暫存目錄
+            if os.path.basename(path) == catalog.CATALOG_FILE and source_root != dest_root:
+                _relocate_catalog(path, source_root, dest_root)
+            counts[market] = counts.get(market, 0) + 1
+
+        # 走到這裡代表 end 紀錄與所有校驗碼都已通過，整目錄替換
+        trash = os.path.join(stage_data, ".old")
+        os.makedirs(trash, exist_ok=True)
+        for name in sorted(os.listdir(stage_data)):
+            if name != ".old":
+                _swap_in(os.path.join(stage_data, name), os.path.join(dest_root, name), os.path.join(trash, name))
+        if os.path.isdir(stage_base):
+            for name in sorted(os.listdir(stage_base)):
+                final = os.path.join(base_dir, name)
+                # 舊倉儲未合併的 WAL 不屬於新的資料庫檔
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(final + suffix):
+                        os.remove(final + suffix)
+                _swap_in(os.path.join(stage_base, name), final, None)
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+        for d in (stage_data, stage_base):
+            shutil.rmtree(d, ignore_errors=True)
+    return {"files": counts, "seconds": time.time() - t0}
+
+def inspect_snapshot(in_path):
+    """列出封存檔內容並驗證所有校驗碼 (不寫入任何檔案)"""
+    summary = {"meta": None, "markets": {}}
+    with open(in_path, "rb") as f:
+        for header, payload in iter_records(f):
+            if header["kind"] == "meta":
+                summary["meta"] = header
+                continue
+            if header["kind"] == "end":
+                continue
+            m = summary["markets"].setdefault(header["market"], {"records": 0, "files": 0, "raw": 0, "size": 0})
+            m["records"] += 1
+            m["files"] += len(json.loads(payload[:payload.index(b"\n")])["files"]) if header["kind"] == "bars" else 1
+            m["raw"] += header["raw"]
+            m["size"] += header["size"]
+    return summary
+
+# ========== CLI ==========
+
+def _markets(spec, data_root):
+    if spec == "all":
+        return sorted(m for m in catalog.MARKET_IDS if (Path(data_root) / m).is_dir())
+    return [m.strip() for m in spec.split(",") if m.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py snapshot", description="Pack / restore the per-market data store")
+    parser.add_argument("command", choices=["export", "import", "inspect"])
+    parser.add_argument("--market", default="all", help="逗號分隔的市場 ID 或 all")
+    parser.add_argument("--file", default=None, help="封存檔路徑 (預設 snapshots/<market>.snap；import 可用 - 讀取標準輸入)")
+    parser.add_argument("--data-root", default=DATA_ROOT)
+    parser.add_argument("--codec", default=None, choices=["zstd", "xz"], help="export：壓縮格式 (預設有 zstandard 時用 zstd)")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        markets = _markets(args.market, args.data_root)
+        if not markets:
+            print(f"⚠️ {args.data_root} 下沒有可打包的市場資料")
+            return
+        if args.codec == "zstd" and zstandard is None:
+            parser.error("未安裝 zstandard，請 pip install zstandard 或改用 --codec xz")
+        res = export_snapshot(markets, args.file or archive_path(args.market), args.data_root, codec=args.codec)
+        files = ", ".join(f"{m} {n} 檔" for m, n in res["files"].items())
+        log(f"📦 封存完成：{res['path']} | {files} | {res['raw_bytes'] / 1e6:.1f} MB -> {res['bytes'] / 1e6:.1f} MB "
+            f"({res['codec']}) | {res['seconds']:.1f}s")
+        return
+
+    markets = None if args.market == "all" else _markets(args.market, args.data_root)
+    path = args.file or archive_path(args.market)
+    if path != "-" and not os.path.exists(path):
+        print(f"⚠️ 找不到封存檔: {path}")
+        return
+    try:
+        if args.command == "import":
+            res = import_snapshot(path, markets, args.data_root)
+            files = ", ".join(f"{m} {n} 檔" for m, n in res["files"].items()) or "無符合的市場"
+            log(f"📂 還原完成：{path} -> {args.data_root} | {files} | {res['seconds']:.1f}s")
+            return
+        summary = inspect_snapshot(path)
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ 封存檔 {path} 無法{'還原' if args.command == 'import' else '驗證'}: {e}")
+        sys.exit(1)
+    meta = summary["meta"] or {}
+    print(f"📦 {path} | 建立於 {meta.get('created_at')} | 來源 {meta.get('data_root')} | 校驗碼全部相符")
+    for m, s in summary["markets"].items():
+        print(f"   {m}: {s['files']} 檔 ({s['records']} 筆紀錄) | {s['raw'] / 1e6:.1f} MB -> {s['size'] / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import random
+import sqlite3
+import threading
+import requests
+import pandas as pd
+from io import BytesIO
+from urllib.parse import urlsplit
+
+import bar_store
+import catalog
+import egress
+import http_cache
+
+# ========== 資料源切換 ==========
+# 設定 STOCK_MONITOR_STANDIN=http://127.0.0.1:8765 即可把所有下載器導向本機替身伺服器
+# (standin_server.py)，用於離線量測併發與節流策略。
+STANDIN_ENV = "STOCK_MONITOR_STANDIN"
+# 隨機延遲倍率：壓測時設為 0.01 之類的小值，避免 sleep 主導量測結果
+SLEEP_SCALE_ENV = "STOCK_MONITOR_SLEEP_SCALE"
+
+# yfinance 被限流時的錯誤訊息 (下載器以 "Rate limited" 字樣判斷是否長休)
+RATE_LIMIT_MSG = "Too Many Requests. Rate limited. Try after a while."
+# 出口池模式直接呼叫 Yahoo v8 chart (每個出口各自的 session)
+YAHOO_CHART_URL = "https://query2.finance.yahoo.com/v8/finance/chart"
+
+def standin_url():
+    return os.getenv(STANDIN_ENV, "").rstrip("/")
+
+def jitter(lo, hi):
+    """隨機延遲 (防封鎖)；倍率由 STOCK_MONITOR_SLEEP_SCALE 控制"""
+    scale = float(os.getenv(SLEEP_SCALE_ENV, "1") or 1)
+    if scale > 0:
+        time.sleep(random.uniform(lo, hi) * scale)
+
+# ========== 請求統計 ==========
+
+class RequestStats:
+    """執行緒安全的請求紀錄，供壓測工具計算吞吐、延遲分位數與重試次數"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def record(self, kind, key, latency, status):
+        with self._lock:
+            self.records.append((kind, key, latency, status))
+
+    def summary(self, kind=None):
+        with self._lock:
+            rows = [r for r in self.records if kind is None or r[0] == kind]
+        if not rows:
+            return {"requests": 0, "unique": 0, "retries": 0, "p50_ms": None, "p99_ms": None, "status": {}}
+        lat = sorted(r[2] for r in rows)
+        pick = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+        status = {}
+        for r in rows:
+            status[str(r[3])] = status.get(str(r[3]), 0) + 1
+        unique = len({r[1] for r in rows})
+        return {"requests": len(rows), "unique": unique, "retries": len(rows) - unique,
+                "p50_ms": round(pick(0.50), 1), "p99_ms": round(pick(0.99), 1), "status": status}
+
+STATS = RequestStats()
+
+# ========== HTTP 清單端點 ==========
+
+def endpoint(url):
+    """替身模式下把 https://host/path?q 改寫為 <standin>/host/path?q"""
+    base = standin_url()
+    if not base:
+        return url
+    parts = urlsplit(url)
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{base}/{parts.netloc}{parts.path}{query}"
+
+def http_get(url, **kwargs):
+    """清單類端點的統一入口 (證交所 ISIN、nasdaqtrader、港交所 Excel ...)"""
+    t0 = time.perf_counter()
+    status = "exc"
+    try:
+        resp = requests.get(endpoint(url), **kwargs)
+        status = resp.status_code
+        return resp
+    finally:
+        STATS.record("list", url, time.perf_counter() - t0, status)
+
+def cached_get(url, **kwargs):
+    """
+    清單端點的條件式 GET (http_cache)：未變動 (304) 時沿用本地本體，網路失敗時退回上一次的內容。
+    替身模式以替身網址另立快取鍵 (standin:...)，合成清單不會覆蓋正式清單的快取
+    """
+    key = f"{http_cache.STANDIN_PREFIX}{endpoint(url)}" if standin_url() else None
+    return http_cache.fetch(url, http_get, key=key, **kwargs)
+
+def source_frame(name, fetch_fn, *args, **kwargs):
+    """
+    akshare / pykrx 等套件型資料源：正常模式直接呼叫 fetch_fn (套件不提供條件式請求)，
+    替身模式改向 <standin>/frames/<name>.csv 取得同欄位的 DataFrame (經 http_cache 重新驗證)。
+    """
+    base = standin_url()
+    if not base:
+        return fetch_fn(*args, **kwargs)
+    t0 = time.perf_counter()
+    status = "exc"
+    def get(url, **kw):
+        nonlocal status
+        r = requests.get(url, **kw)
+        status = r.status_code
+        return r
+    try:
+        resp = http_cache.fetch(f"{base}/frames/{name}.csv", get, key=f"{http_cache.STANDIN_PREFIX}{base}/frames/{name}",
+                                 timeout=30)
+        resp.raise_for_status()
+        # 依 UTF-8 位元組解析 (text/csv 未標 charset 時 requests 會以 ISO-8859-1 解碼，中韓文欄名全毀)
+        return pd.read_csv(BytesIO(resp.content), dtype=str)
+    finally:
+        STATS.record("frame", name, time.perf_counter() - t0, status)
+
+# ========== 個股 K 線 ==========
+
+def _chart_params(period=None, start=None, end=None, interval="1d"):
+    params = {"interval": interval, "includePrePost": "false", "events": "div,splits"}
+    if start is not None:
+        params["period1"] = int(pd.Timestamp(start).timestamp())
+        params["period2"] = int(pd.Timestamp(end).timestamp()) if end is not None else int(time.time())
+    else:
+        params["range"] = period or "1mo"
+    return params
+
+def parse_chart_json(payload, auto_adjust=True):
+    """
+    將 Yahoo v8 chart JSON 轉為與 yfinance Ticker.history() 相同格式的 DataFrame。
+    v8 的 quote 為未還原價：auto_adjust=True (yfinance 預設) 時依 adjclose / close 比例還原開高低收，
+    False 時保留原價並附上 Adj Close 欄 (同 yfinance)
+    """
+    result = (payload.get("chart") or {}).get("result") or []
+    if not result:
+        return pd.DataFrame()
+    res = result[0]
+    ts = res.get("timestamp") or []
+    if not ts:
+        return pd.DataFrame()
+    quote = res["indicators"]["quote"][0]
+    tz = (res.get("meta") or {}).get("exchangeTimezoneName") or "UTC"
+    idx = pd.to_datetime(ts, unit="s", utc=True).tz_convert(tz).normalize()
+    df = pd.DataFrame({
+        "Open": quote.get("open"), "High": quote.get("high"), "Low": quote.get("low"),
+        "Close": quote.get("close"), "Volume": quote.get("volume"),
+    }, index=pd.DatetimeIndex(idx, name="Date"))
+    adj = ((res["indicators"].get("adjclose") or [{}])[0]).get("adjclose")
+    if adj is not None:
+        adj = pd.Series(adj, index=df.index, dtype=float)
+        if auto_adjust:
+            ratio = adj / df["Close"].astype(float)
+            for col in ("Open", "High", "Low"):
+                df[col] = df[col].astype(float) * ratio
+            df["Close"] = adj
+        else:
+            df.insert(4, "Adj Close", adj)
+    events = res.get("events") or {}
+    df["Dividends"] = 0.0
+    df["Stock Splits"] = 0.0
+    for ev in (events.get("dividends") or {}).values():
+        day = pd.Timestamp(ev["date"], unit="s", tz="UTC").tz_convert(tz).normalize()
+        if day in df.index: df.loc[day, "Dividends"] = ev.get("amount", 0.0)
+    for ev in (events.get("splits") or {}).values():
+        day = pd.Timestamp(ev["date"], unit="s", tz="UTC").tz_convert(tz).normalize()
+        if day in df.index: df.loc[day, "Stock Splits"] = ev["numerator"] / ev["denominator"]
+    return df.dropna(subset=["Close"])
+
+def chart_url(symbol):
+    base = f"{standin_url()}/v8/finance/chart" if standin_url() else YAHOO_CHART_URL
+    return f"{base}/{symbol}"
+
+def _chart_history(symbol, session=requests, period=None, start=None, end=None, interval="1d", timeout=20,
+                   auto_adjust=True):
+    """
+    以 v8 chart 端點取得日 K，回傳 (DataFrame, HTTP 狀態碼)；429 以 RATE_LIMIT_MSG 例外回報。
+    只接受上列 yfinance 參數，其餘參數直接 TypeError (不默默忽略而存成不同口徑的價格)
+    """
+    resp = session.get(chart_url(symbol), params=_chart_params(period, start, end, interval), timeout=timeout)
+    if resp.status_code == 429:
+        raise RuntimeError(RATE_LIMIT_MSG)
+    if resp.status_code == 404:
+        return pd.DataFrame(), 404
+    resp.raise_for_status()
+    return parse_chart_json(resp.json(), auto_adjust), resp.status_code
+
+def _standin_history(symbol, **kwargs):
+    t0 = time.perf_counter()
+    status = "exc"
+    try:
+        frame, status = _chart_history(symbol, **kwargs)
+        return frame
+    except RuntimeError:
+        status = 429
+        raise
+    except requests.HTTPError as e:
+        status = e.response.status_code
+        raise
+    finally:
+        STATS.record("chart", symbol, time.perf_counter() - t0, status)
+
+def _pooled_history(pool, symbol, **kwargs):
+    """
+    出口池模式：每次嘗試向池子取得一個出口；被限流 (429) 或連線失敗時換下一個出口重試，
+    所有嘗試都被限流才回報 RATE_LIMIT_MSG (讓下載器沿用原本的長休邏輯)。
+    """
+    last_exc = None
+    for _ in range(len(pool)):
+        out = pool.acquire()
+        t0 = time.perf_counter()
+        status = "exc"
+        try:
+            frame, status = _chart_history(symbol, out.session, **kwargs)
+            return frame
+        except RuntimeError as e:
+            status, last_exc = 429, e
+        except requests.HTTPError as e:
+            status, last_exc = e.response.status_code, e
+        except requests.RequestException as e:
+            last_exc = e
+        finally:
+            pool.report(out, status)
+            STATS.record("chart", symbol, time.perf_counter() - t0, status)
+    raise last_exc
+
+def worker_count(base):
+    """下載併發數：設定出口池時按出口數等比放大 (每個出口各自限速)"""
+    pool = egress.pool()
+    return base * len(pool) if pool is not None else base
+
+def history(symbol, **kwargs):
+    """
+    取得單一標的日 K (參數同 yfinance Ticker.history)。
+    替身模式下改打本機伺服器，回傳格式一致，下載器不需感知差異；
+    設定出口池 (egress.json / STOCK_MONITOR_EGRESS) 時請求分散到各出口。
+    """
+    pool = egress.pool()
+    if pool is not None:
+        return _pooled_history(pool, symbol, **kwargs)
+    if standin_url():
+        return _standin_history(symbol, **kwargs)
+    import yfinance as yf
+    t0 = time.perf_counter()
+    status = "exc"
+    try:
+        hist = yf.Ticker(symbol).history(**kwargs)
+        status = 200 if hist is not None and not hist.empty else 404
+        return hist
+    finally:
+        STATS.record("chart", symbol, time.perf_counter() - t0, status)
+
+# ========== 盤中報價 (批次) ==========
+QUOTE_COLUMNS = ["price", "high", "low"]
+
+def parse_quote_json(payload):
+    """Yahoo v7 quote JSON -> DataFrame (index 為代號，欄位 price / high / low)"""
+    rows = ((payload.get("quoteResponse") or {}).get("result")) or []
+    frame = pd.DataFrame([{"symbol": r.get("symbol"), "price": r.get("regularMarketPrice"),
+                           "high": r.get("regularMarketDayHigh"), "low": r.get("regularMarketDayLow")}
+                          for r in rows if r.get("symbol")], columns=["symbol"] + QUOTE_COLUMNS)
+    return frame.set_index("symbol").astype(float).dropna(subset=["price"])
+
+def _yf_quotes(symbols, timeout=30):
+    """正式模式：以 yfinance 批次下載當日 K 線 (盤中即為即時的最高/最低/最新價)"""
+    import yfinance as yf
+    raw = yf.download(list(symbols), period="1d", interval="1d", group_by="ticker",
+                      progress=False, threads=True, timeout=timeout)
+    rows = []
+    for sym in symbols:
+        try:
+            bar = raw[sym] if isinstance(raw.columns, pd.MultiIndex) else raw
+            bar = bar.dropna(subset=["Close"])
+            if bar.empty: continue
+            rows.append({"symbol": sym, "price": bar["Close"].iloc[-1], "high": bar["High"].iloc[-1], "low": bar["Low"].iloc[-1]})
+        except KeyError:
+            continue
+    return pd.DataFrame(rows, columns=["symbol"] + QUOTE_COLUMNS).set_index("symbol").astype(float)
+
+def quotes(symbols, timeout=30):
+    """
+    一次取得多檔的最新價與當日最高/最低 (盤中模式用)。
+    替身模式改打 <standin>/v7/finance/quote?symbols=...；缺報價的代號不會出現在結果中。
+    """
+    symbols = list(symbols)
+    key = f"{symbols[0]}..x{len(symbols)}" if symbols else ""
+    t0 = time.perf_counter()
+    status = "exc"
+    try:
+        if standin_url():
+            resp = requests.get(f"{standin_url()}/v7/finance/quote", params={"symbols": ",".join(symbols)}, timeout=timeout)
+            status = resp.status_code
+            if resp.status_code == 429:
+                raise RuntimeError(RATE_LIMIT_MSG)
+            resp.raise_for_status()
+            return parse_quote_json(resp.json())
+        frame = _yf_quotes(symbols, timeout)
+        status = 200 if not frame.empty else 404
+        return frame
+    finally:
+        STATS.record("quote", key, time.perf_counter() - t0, status)
+
+# ========== 增量更新 (除權息感知) ==========
+# 每次只抓最近一小段 K 線，與已存資料的重疊區間比對：
+# - 新 K 線帶有配息/分割事件，或重疊區間收盤價不一致 (還原價已被改寫) -> 該檔重抓完整歷史
+# - 其餘 -> 只把新 K 線附加到既有資料
+# 已存的最後一根 K 線不列入比對，一律以新資料取代 (可能是盤中寫入的半根 K 線)
+OVERLAP_CALENDAR_DAYS = 10
+OVERLAP_TOLERANCE = 1e-4
+ACTION_COLUMNS = ("dividends", "stock splits")
+PERIOD_DAYS = {"1y": 366, "2y": 731, "5y": 1827, "10y": 3653}
+# 沒有抓到任何新資料的模式：下載器記為 empty，交給負快取退避 (stale = 已有歷史但近期區間沒有 K 線)
+NO_DATA_MODES = ("empty", "stale")
+STALE_ERROR = "近期區間沒有任何 K 線 (停牌或下市?)"
+
+def default_prepare(hist):
+    """yfinance 格式 -> 存檔格式 (date 欄 + 小寫欄名)，與過去完整下載的 CSV 相同"""
+    hist = hist.reset_index()
+    hist.columns = [c.lower() for c in hist.columns]
+    return hist
+
+def _date_key(col):
+    return col.astype(str).str[:10]
+
+def needs_full_refresh(stored, fresh):
+    """
+    stored / fresh：存檔格式的 DataFrame。回傳 (是否需重抓完整歷史, 原因)。
+    """
+    if stored is None or stored.empty or "date" not in stored.columns:
+        return True, "no history"
+    s_key, f_key = _date_key(stored["date"]), _date_key(fresh["date"])
+    last = s_key.max()
+    new_rows = fresh[f_key > last]
+    stored, s_key = stored[s_key < last], s_key[s_key < last]
+    for col in ACTION_COLUMNS:
+        if col in new_rows.columns and (pd.to_numeric(new_rows[col], errors="coerce").fillna(0) != 0).any():
+            return True, "corporate action"
+    s_close = pd.Series(stored["close"].astype(float).values, index=s_key.values)
+    f_close = pd.Series(fresh["close"].astype(float).values, index=f_key.values)
+    overlap = s_close.index.intersection(f_close.index)
+    if len(overlap) == 0:
+        return True, "no overlap"
+    a, b = s_close.loc[overlap], f_close.loc[overlap]
+    if ((a - b).abs() > OVERLAP_TOLERANCE * b.abs()).any():
+        return True, "overlap mismatch"
+    return False, ""
+
+def merge_delta(stored, fresh, keep_days=None):
+    """
+    以 fresh 取代 stored 的最後一根並附加更新的 K 線，回傳 (合併結果, 新增 K 線數)；
+    keep_days 指定時裁切為與完整下載相同的回溯長度
+    """
+    s_key = _date_key(stored["date"])
+    last = s_key.max()
+    f_key = _date_key(fresh["date"])
+    new_rows = fresh[f_key >= last]
+    added = int((f_key > last).sum())
+    merged = pd.concat([stored[s_key < last], new_rows[[c for c in new_rows.columns if c in stored.columns]]], ignore_index=True)
+    if keep_days:
+        cutoff = (pd.Timestamp(_date_key(merged["date"]).max()) - pd.Timedelta(days=keep_days)).strftime("%Y-%m-%d")
+        merged = merged[_date_key(merged["date"]) >= cutoff]
+    return merged, added
+
+def refresh_frame(symbol, stored, full_kwargs, prepare=default_prepare):
+    """
+    核心決策：回傳 (存檔格式 DataFrame 或 None, 模式)，模式為 full / delta / unchanged / stale / empty。
+    full_kwargs 為完整下載時傳給 history() 的參數 (如 period="2y" 或 start="2020-01-01")。
+    已有歷史但近期區間沒有任何 K 線 (停牌、下市) 時回傳 (既有資料, stale)：不重抓完整歷史，
+    下載器視同 empty，讓負快取退避。
+    """
+    if stored is not None and not stored.empty and "date" in stored.columns:
+        start = (pd.Timestamp(_date_key(stored["date"]).max()) - pd.Timedelta(days=OVERLAP_CALENDAR_DAYS)).strftime("%Y-%m-%d")
+        delta_kwargs = {k: v for k, v in full_kwargs.items() if k not in ("period", "start", "end")}
+        hist = history(symbol, start=start, **delta_kwargs)
+        fresh = prepare(hist) if hist is not None and not hist.empty else None
+        if fresh is None or fresh.empty:
+            return stored, "stale"
+        full, _ = needs_full_refresh(stored, fresh)
+        if not full:
+            merged, added = merge_delta(stored, fresh, PERIOD_DAYS.get(full_kwargs.get("period")))
+            return merged, ("delta" if added else "unchanged")
+    hist = history(symbol, **full_kwargs)
+    if hist is None or hist.empty:
+        return None, "empty"
+    frame = prepare(hist)
+    return (frame, "full") if not frame.empty else (None, "empty")
+
+def load_history(path):
+    try:
+        return pd.read_csv(path) if os.path.exists(path) else None
+    except Exception:
+        return None
+
+def save_history(frame, path):
+    """所有日 K CSV 的統一寫入點 (先寫暫存檔再取代，中斷時不會留下半個檔案)"""
+    tmp = f"{path}.tmp"
+    frame.to_csv(tmp, index=False, encoding="utf-8-sig")
+    os.replace(tmp, path)
+    try:
+        # 同步更新資料目錄 (首末日期、列數、校驗碼)；目錄寫入失敗不影響 CSV 本身
+        catalog.record_write(frame, path)
+    except sqlite3.Error:
+        pass
+    try:
+        # 週 K / 月 K 衍生庫只重算目前尚未結束的週期；衍生庫失敗同樣不影響日 K
+        bar_store.update(frame, path)
+    except (OSError, ValueError, KeyError):
+        pass
+
+def refresh_csv(symbol, path, full_kwargs, prepare=default_prepare):
+    """CSV 型下載器的增量更新入口，回傳模式 (full / delta / unchanged / stale / empty)"""
+    stored = load_history(path)
+    frame, mode = refresh_frame(symbol, stored, full_kwargs, prepare)
+    if frame is not None and frame is not stored:
+        # unchanged 也要寫回：最後一根 K 線可能由盤中值更新為收盤值，修改時間亦供交易日曆判斷
+        # (近期沒有任何 K 線時原樣沿用既有資料，不必重寫)
+        save_history(frame, path)
+    return mode
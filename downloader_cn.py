@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
-import os, time, random, json, subprocess
+import os, json
 import pandas as pd
-import yfinance as yf
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
+import profiler
+import bulk_ingest
+import datafeed
+import negative_cache
+import run_manifest
+import scheduler
+import sharding
+import trading_calendar
 from pathlib import Path
 
 # ========== 核心參數與路徑 ==========
@@ -17,6 +23,8 @@ CACHE_LIST_PATH = os.path.join(BASE_DIR, "cn_stock_list_cache.json")
 # 中國 A 股標的極多，建議控制執行緒在 3-4 之間，避免被封 IP
 THREADS_CN = 4
 os.makedirs(DATA_DIR, exist_ok=True)
+# 本次執行已下載的即時行情表 (清單與全市場日行情共用，避免重複下載)
+_SPOT = {}
 
 def log(msg: str):
     print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
@@ -34,7 +42,8 @@ def get_cn_list():
     try:
         import akshare as ak
         # 改用更穩定的 spot_em 接口
-        df = ak.stock_zh_a_spot_em()
+        df = datafeed.source_frame("akshare/stock_zh_a_spot_em", ak.stock_zh_a_spot_em)
+        _SPOT["frame"] = df
         
         # 過濾常見板塊 (00, 30, 60, 68)
         df['代码'] = df['代码'].astype(str)
@@ -55,14 +64,27 @@ def get_cn_list():
         log(f"⚠️ A 股清單獲取失敗: {e}，嘗試備援方案...")
         try:
             # 備援：原本的 info 接口
-            df_bak = ak.stock_info_a_code_name()
+            df_bak = datafeed.source_frame("akshare/stock_info_a_code_name", ak.stock_info_a_code_name)
             res_bak = [f"{row['code']}&{row['name']}" for _, row in df_bak.iterrows()]
             return res_bak
         except:
             return ["600519&貴州茅台", "000001&平安銀行"]
 
+def spot_frame():
+    """A 股即時行情表：get_cn_list 已下載過則直接沿用 (清單走今日快取時才另外下載一次)"""
+    if _SPOT.get("frame") is None:
+        import akshare as ak
+        _SPOT["frame"] = datafeed.source_frame("akshare/stock_zh_a_spot_em", ak.stock_zh_a_spot_em)
+    return _SPOT["frame"]
+
+def out_path_for(item):
+    """清單項目 (代號&名稱) 對應的 CSV 路徑；格式錯誤時回傳 None"""
+    parts = item.split('&', 1)
+    if len(parts) < 2: return None
+    return os.path.join(DATA_DIR, f"{parts[0]}_{parts[1]}.csv")
+
 def download_one(item):
-    """下載 A 股數據，判斷交易所後綴 (.SS 或 .SZ)"""
+    """下載 A 股數據，判斷交易所後綴 (.SS 或 .SZ)；新鮮度已由 main 依交易日曆預先過濾"""
     try:
         code, name = item.split('&', 1)
         # Yahoo Finance 格式：6開頭 (含688) 為上海 .SS, 其餘為深圳 .SZ
@@ -71,57 +93,91 @@ def download_one(item):
         else:
             symbol = f"{code}.SZ"
             
-        out_path = os.path.join(DATA_DIR, f"{code}_{name}.csv")
+        out_path = out_path_for(item)
 
-        # ✅ 今日快取檢查
-        if os.path.exists(out_path):
-            mtime = datetime.fromtimestamp(os.path.getmtime(out_path)).date()
-            if mtime == datetime.now().date() and os.path.getsize(out_path) > 1000:
-                return {"status": "exists", "code": code}
-
-        time.sleep(random.uniform(0.5, 1.2))
-        tk = yf.Ticker(symbol)
+        datafeed.jitter(0.5, 1.2)
         # A 股建議用 2y 數據，因市場波動與政策週期較長
-        hist = tk.history(period="2y", timeout=20)
+        # 增量更新：只抓近期 K 線，遇除權息或重疊區間不一致才重抓完整歷史
+        mode = datafeed.refresh_csv(symbol, out_path, {"period": "2y", "timeout": 20})
         
-        if hist is not None and not hist.empty:
-            hist.reset_index(inplace=True)
-            hist.columns = [c.lower() for c in hist.columns]
-            # 統一存檔格式
-            hist.to_csv(out_path, index=False, encoding='utf-8-sig')
-            return {"status": "success", "code": code}
-            
+        if mode not in datafeed.NO_DATA_MODES:
+            return {"status": "success", "code": code, "mode": mode}
+        if mode == "stale":
+            # 已有歷史但近期沒有 K 線 (停牌 / 下市)：記為 empty 讓負快取退避
+            return {"status": "empty", "code": code, "mode": mode, "error": datafeed.STALE_ERROR}
         return {"status": "empty", "code": code}
-    except:
-        return {"status": "error", "code": item.split('&')[0]}
+    except Exception as e:
+        return {"status": "error", "code": item.split('&')[0], "error": str(e)}
+
+def item_key(item):
+    """清單項目 (代號&名稱) 的唯一鍵：六位數代號"""
+    return item.split('&', 1)[0]
 
-def main():
-    items = get_cn_list()
+def main(retry_failed=False, shard=None):
+    with profiler.stage("universe"):
+        items = get_cn_list()
+    # 分片模式只處理屬於本分片的代號 (shard=(i, N))
+    items = sharding.filter_items(items, item_key, shard)
     if not items:
         return {"total": 0, "success": 0, "fail": 0}
 
-    log(f"🚀 開始下載中國 A 股 (共 {len(items)} 檔)")
+    # 今日續跑清單：略過已完成的標的，或只重跑失敗的標的
+    manifest = run_manifest.RunManifest(MARKET_CODE, shard=shard)
+    todo = manifest.select(items, item_key, retry_failed)
+    # 最後一根 K 線已涵蓋最近收盤交易日者直接略過 (不進執行緒池、不打 API)
+    fresh, todo = trading_calendar.split_fresh(MARKET_CODE, todo, out_path_for)
+    for it in fresh:
+        manifest.record(item_key(it), "exists")
+    # 連續抓不到資料的標的 (下市、代號對應錯誤、停牌) 依指數退避的間隔才重新探測
+    cached, todo = negative_cache.split(manifest.catalog, todo, item_key, enabled=not retry_failed)
+    negative_cache.describe(cached, item_key, log)
     stats = {"success": 0, "exists": 0, "empty": 0, "error": 0}
+    modes = {}
+
+    # 即時行情表 (收盤後即當日 K 線) 一次補上最近交易日，只剩新上市、缺口與除權息的標的走逐檔 Yahoo
+    if todo and bulk_ingest.enabled():
+        with profiler.stage("bulk"):
+            session = trading_calendar.latest_completed_session(MARKET_CODE)
+            try:
+                bars = bulk_ingest.fetch_cn_bars(spot_frame(), session)
+            except Exception as e:
+                log(f"⚠️ A 股即時行情取得失敗: {e}")
+                bars = pd.DataFrame(columns=bulk_ingest.BAR_COLUMNS)
+            bulk, todo, reasons = bulk_ingest.append_bars(MARKET_CODE, bars, todo, out_path_for, item_key, session) \
+                if len(bars) else ([], todo, {})
+        for it in bulk:
+            manifest.record(item_key(it), "success")
+        if bulk:
+            stats["success"] += len(bulk)
+            modes["bulk"] = len(bulk)
+        log(f"📦 即時行情 {len(bars)} 檔 | 直接附加: {len(bulk)} | 改走逐檔下載: {len(todo)} {reasons or ''}")
+    log(f"🚀 開始下載中國 A 股 (共 {len(items)} 檔，已是最新 {len(fresh)} 檔，本輪待處理 {len(todo)} 檔)")
     
-    with ThreadPoolExecutor(max_workers=THREADS_CN) as executor:
-        futs = {executor.submit(download_one, it): it for it in items}
-        pbar = tqdm(total=len(items), desc="CN 下載進度")
-        for f in as_completed(futs):
-            res = f.result()
+    # 依優先順序 (未抓過 -> 流動性/落後天數 -> 上次失敗) 送出，時間預算用盡時停止
+    sched = scheduler.DeadlineScheduler(todo, scheduler.catalog_priority(os.path.dirname(DATA_DIR), out_path_for),
+                                        datafeed.worker_count(THREADS_CN), label="A 股下載")
+    with profiler.stage("download"):
+        pbar = tqdm(total=len(todo), desc="CN 下載進度")
+        for it, res in sched.run(download_one):
+            if res.get("mode"): modes[res["mode"]] = modes.get(res["mode"], 0) + 1
             stats[res.get("status", "error")] += 1
+            manifest.record(item_key(it), res.get("status", "error"), res.get("error"))
             pbar.update(1)
             
             # 每處理 100 檔稍微休息，防止 IP 封鎖
             if pbar.n % 100 == 0:
-                time.sleep(random.uniform(5, 10))
+                datafeed.jitter(5, 10)
         pbar.close()
     
-    # ✨ 重要：封裝結果並 return 給 main.py
-    report_stats = {
-        "total": len(items),
-        "success": stats["success"] + stats["exists"],
-        "fail": stats["error"] + stats["empty"]
-    }
+    manifest.close()
+    sched.report(item_key)
+    if modes:
+        log(f"🔁 更新模式統計 (full=重抓完整歷史, delta=增量附加, bulk=即時行情): {modes}")
+    
+    # ✨ 重要：封裝結果並 return 給 main.py (以今日清單為準，含先前中斷前已完成的部分)
+    report_stats = manifest.summary([item_key(it) for it in items])
+    report_stats["skipped"] = len(sched.skipped)
+    report_stats.update(negative_cache.stats(manifest.catalog, cached))
     
     log(f"📊 A 股下載完成: {report_stats}")
     return report_stats
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
-import os, io, time, random, sqlite3, requests
+import os, io, time, sqlite3
 import pandas as pd
-import yfinance as yf
 from io import StringIO
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date, timezone
 from tqdm import tqdm
+import profiler
+import datafeed
+import http_cache
+import negative_cache
+import run_manifest
+import scheduler
+import sharding
+import trading_calendar
 import urllib3
 
 # 忽略 SSL 警告 (港交所官網有時會報憑證錯誤)
@@ -38,6 +44,11 @@ def init_db():
                             sector TEXT, 
                             market TEXT,
                             updated_at TEXT)''')
+        # 每檔最後一根 K 線與寫入時間 (UTC)，供交易日曆判斷新鮮度
+        conn.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                            symbol TEXT PRIMARY KEY,
+                            last_date TEXT,
+                            synced_at TEXT)''')
         
         # 自動升級舊資料庫
         cursor = conn.execute("PRAGMA table_info(stock_info)")
@@ -51,6 +62,38 @@ def init_db():
 
 # ========== 3. 獲取港股清單 (強化穩定性) ==========
 
+def parse_hk_excel(content):
+    """港交所 secstkorder.xls -> [(代號, 名稱), ...]；找不到表頭時回傳空清單"""
+    df_raw = pd.read_excel(io.BytesIO(content), header=None)
+    
+    # 尋找包含 "Stock Code" 的正確起始行
+    hdr_idx = None
+    for i in range(len(df_raw)):
+        row_str = " ".join([str(x) for x in df_raw.iloc[i].values])
+        if "Stock Code" in row_str:
+            hdr_idx = i
+            break
+    
+    if hdr_idx is None: 
+        log("❌ 找不到 Excel 表頭，請檢查網址是否有變。")
+        return []
+    
+    # 重新整理 DataFrame
+    df = df_raw.iloc[hdr_idx+1:].copy()
+    df.columns = df_raw.iloc[hdr_idx].values
+    # 港股名稱可能在不同欄位名下 (English Stock Short Name)
+    name_col = [c for c in df.columns if 'Short Name' in str(c) and 'English' in str(c)]
+    
+    stock_list = []
+    for _, row in df.iterrows():
+        raw_code = str(row['Stock Code']).strip()
+        name = str(row[name_col[0]]).strip() if name_col else "Unknown"
+        
+        # 港股普通股邏輯：數字且長度 <= 4 (或是 5 位但前幾位是 0)
+        if raw_code.isdigit() and int(raw_code) < 10000:
+            stock_list.append((f"{raw_code.zfill(4)}.HK", name))
+    return stock_list
+
 def get_hk_stock_list():
     """獲取港股清單並確保寫入 stock_info"""
     url = "https://www.hkex.com.hk/-/media/HKEX-Market/Services/Trading/Securities/Securities-Lists/Securities-Using-Standard-Transfer-Form-(including-GEM)-By-Stock-Code-Order/secstkorder.xls"
@@ -63,51 +106,22 @@ def get_hk_stock_list():
     
     log(f"📡 正在從港交所獲取名單...")
     try:
-        # 使用 verify=False 避免 SSL 阻擋
-        r = requests.get(url, headers=headers, timeout=20, verify=False)
+        # 使用 verify=False 避免 SSL 阻擋；條件式請求 + 依內容雜湊快取解析結果 (Excel 未變動時不重新解析)
+        r = datafeed.cached_get(url, headers=headers, timeout=20, verify=False)
         r.raise_for_status()
-        
-        # 讀取 Excel
-        df_raw = pd.read_excel(io.BytesIO(r.content), header=None)
-        
-        # 尋找包含 "Stock Code" 的正確起始行
-        hdr_idx = None
-        for i in range(len(df_raw)):
-            row_str = " ".join([str(x) for x in df_raw.iloc[i].values])
-            if "Stock Code" in row_str:
-                hdr_idx = i
-                break
-        
-        if hdr_idx is None: 
-            log("❌ 找不到 Excel 表頭，請檢查網址是否有變。")
+        stock_list = [tuple(it) for it in http_cache.parsed("hk-secstkorder", r, lambda: parse_hk_excel(r.content))]
+        if not stock_list:
             return []
         
-        # 重新整理 DataFrame
-        df = df_raw.iloc[hdr_idx+1:].copy()
-        df.columns = df_raw.iloc[hdr_idx].values
-        
         conn = sqlite3.connect(DB_PATH)
-        stock_list = []
         
         # 💡 先清空舊 info 數據確保重新同步
         conn.execute("DELETE FROM stock_info")
-
-        for _, row in df.iterrows():
-            raw_code = str(row['Stock Code']).strip()
-            # 港股名稱可能在不同欄位名下 (English Stock Short Name)
-            name_col = [c for c in df.columns if 'Short Name' in str(c) and 'English' in str(c)]
-            name = str(row[name_col[0]]).strip() if name_col else "Unknown"
-            
-            # 港股普通股邏輯：數字且長度 <= 4 (或是 5 位但前幾位是 0)
-            if raw_code.isdigit() and int(raw_code) < 10000:
-                symbol = f"{raw_code.zfill(4)}.HK"
-                market = "HKEX"
-                
-                conn.execute("""
-                    INSERT OR REPLACE INTO stock_info (symbol, name, sector, market, updated_at) 
-                    VALUES (?, ?, ?, ?, ?)
-                """, (symbol, name, "Unknown", market, datetime.now().strftime("%Y-%m-%d")))
-                stock_list.append((symbol, name))
+        today = datetime.now().strftime("%Y-%m-%d")
+        conn.executemany("""
+            INSERT OR REPLACE INTO stock_info (symbol, name, sector, market, updated_at) 
+            VALUES (?, ?, ?, ?, ?)
+        """, [(symbol, name, "Unknown", "HKEX", today) for symbol, name in stock_list])
                 
         conn.commit()
         conn.close()
@@ -121,6 +135,38 @@ def get_hk_stock_list():
 
 # ========== 4. 下載邏輯 ==========
 
+def prepare_frame(hist):
+    """yfinance 格式 -> stock_prices 欄位 (日期以交易所當地日期表示)"""
+    hist = hist.reset_index()
+    hist.columns = [c.lower() for c in hist.columns]
+    if 'date' not in hist.columns: return pd.DataFrame()
+    hist['date'] = pd.to_datetime(hist['date']).dt.tz_localize(None).dt.strftime('%Y-%m-%d')
+    cols = ['date', 'open', 'high', 'low', 'close', 'volume'] + [c for c in datafeed.ACTION_COLUMNS if c in hist.columns]
+    return hist[cols]
+
+def load_tail(symbol, n=30):
+    """資料庫中該檔最近 n 根 K 線 (增量比對用)"""
+    conn = sqlite3.connect(DB_PATH, timeout=60)
+    try:
+        df = pd.read_sql_query("SELECT date, open, high, low, close, volume FROM stock_prices WHERE symbol = ? "
+                               "ORDER BY date DESC LIMIT ?", conn, params=(symbol, n))
+    finally:
+        conn.close()
+    return df.iloc[::-1].reset_index(drop=True) if not df.empty else None
+
+def write_prices(symbol, frame):
+    df_final = frame[['date', 'open', 'high', 'low', 'close', 'volume']].copy()
+    df_final['symbol'] = symbol
+    
+    conn = sqlite3.connect(DB_PATH, timeout=60)
+    df_final.to_sql('stock_prices', conn, if_exists='append', index=False, 
+                    method=lambda table, conn, keys, data_iter: 
+                    conn.executemany(f"INSERT OR REPLACE INTO {table.name} ({', '.join(keys)}) VALUES ({', '.join(['?']*len(keys))})", data_iter))
+    conn.execute("INSERT OR REPLACE INTO sync_state (symbol, last_date, synced_at) VALUES (?, ?, ?)",
+                 (symbol, df_final['date'].max(), datetime.now(timezone.utc).isoformat(timespec="seconds")))
+    conn.commit()
+    conn.close()
+
 def download_one(args):
     symbol, name, mode = args
     start_date = "2020-01-01" if mode == 'hot' else "2000-01-01"
@@ -128,56 +174,81 @@ def download_one(args):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            wait_time = random.uniform(2.0, 4.0) if IS_GITHUB_ACTIONS else random.uniform(0.2, 0.5)
-            time.sleep(wait_time)
+            if IS_GITHUB_ACTIONS: datafeed.jitter(2.0, 4.0)
+            else: datafeed.jitter(0.2, 0.5)
             
-            tk = yf.Ticker(symbol)
-            hist = tk.history(start=start_date, timeout=25, auto_adjust=True)
+            # 增量更新：以資料庫最後幾根 K 線為比對基準，遇除權息或還原價改寫才重抓完整歷史
+            df_final, fetch_mode = datafeed.refresh_frame(
+                symbol, load_tail(symbol), {"start": start_date, "timeout": 25, "auto_adjust": True}, prepare_frame)
             
-            if hist is None or hist.empty:
+            if df_final is None:
                 return {"symbol": symbol, "status": "empty"}
-                
-            hist.reset_index(inplace=True)
-            hist.columns = [c.lower() for c in hist.columns]
-            if 'date' in hist.columns:
-                hist['date'] = pd.to_datetime(hist['date']).dt.tz_localize(None).dt.strftime('%Y-%m-%d')
+            if fetch_mode == "stale":
+                # 已有歷史但近期沒有 K 線 (停牌 / 下市)：不改寫資料庫，記為 empty 讓負快取退避
+                return {"symbol": symbol, "status": "empty", "mode": fetch_mode, "error": datafeed.STALE_ERROR}
             
-            df_final = hist[['date', 'open', 'high', 'low', 'close', 'volume']].copy()
-            df_final['symbol'] = symbol
-            
-            conn = sqlite3.connect(DB_PATH, timeout=60)
-            df_final.to_sql('stock_prices', conn, if_exists='append', index=False, 
-                            method=lambda table, conn, keys, data_iter: 
-                            conn.executemany(f"INSERT OR REPLACE INTO {table.name} ({', '.join(keys)}) VALUES ({', '.join(['?']*len(keys))})", data_iter))
-            conn.close()
-            
-            return {"symbol": symbol, "status": "success"}
-        except Exception:
+            write_prices(symbol, df_final)
+            return {"symbol": symbol, "status": "success", "mode": fetch_mode}
+        except Exception as e:
             if attempt < max_retries - 1:
-                time.sleep(random.uniform(5, 12))
+                datafeed.jitter(5, 12)
                 continue
-            return {"symbol": symbol, "status": "error"}
+            return {"symbol": symbol, "status": "error", "error": str(e)}
+
+def fresh_symbols():
+    """sync_state 中已涵蓋最近一個已收盤交易日的標的集合"""
+    session = trading_calendar.latest_completed_session(MARKET_CODE)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute("SELECT symbol, last_date, synced_at FROM sync_state").fetchall()
+    finally:
+        conn.close()
+    return {sym for sym, last, synced in rows
+            if last and synced and trading_calendar.is_current(
+                MARKET_CODE, date.fromisoformat(last[:10]), datetime.fromisoformat(synced), session)}
 
-def run_sync(mode='hot'):
+def run_sync(mode='hot', retry_failed=False, shard=None):
     start_time = time.time()
     init_db()
     
-    items = get_hk_stock_list()
+    with profiler.stage("universe"):
+        items = get_hk_stock_list()
+    # 分片模式只處理屬於本分片的代號 (shard=(i, N))
+    items = sharding.filter_items(items, lambda it: it[0], shard)
     if not items:
         return {"fail_list": [], "success": 0, "has_changed": False}
 
-    log(f"🚀 開始港股同步 | 目標: {len(items)} 檔")
+    # 今日續跑清單：略過已完成的標的，或只重跑失敗的標的
+    manifest = run_manifest.RunManifest(MARKET_CODE, shard=shard)
+    todo = manifest.select(items, lambda it: it[0], retry_failed)
+    # 最後一根 K 線已涵蓋最近收盤交易日者直接略過 (不進執行緒池、不打 API)
+    current = fresh_symbols()
+    fresh = [it for it in todo if it[0] in current]
+    todo = [it for it in todo if it[0] not in current]
+    for it in fresh:
+        manifest.record(it[0], "exists")
+    # 連續抓不到資料的標的 (下市、代號對應錯誤、停牌) 依指數退避的間隔才重新探測
+    cached, todo = negative_cache.split(manifest.catalog, todo, lambda it: it[0], enabled=not retry_failed)
+    negative_cache.describe(cached, lambda it: it[0], log)
+    log(f"🚀 開始港股同步 | 目標: {len(items)} 檔 | 已是最新: {len(fresh)} 檔 | 本輪待處理: {len(todo)} 檔")
 
     stats = {"success": 0, "empty": 0, "error": 0}
-    fail_list = []
+    modes = {}
     
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_one, (it[0], it[1], mode)): it[0] for it in items}
-        for f in tqdm(as_completed(futures), total=len(items), desc="HK同步"):
-            res = f.result()
+    # 依優先順序 (未抓過 -> 流動性/落後天數 -> 上次失敗) 送出，時間預算用盡時停止
+    sched = scheduler.DeadlineScheduler(todo, scheduler.warehouse_priority(DB_PATH, MARKET_CODE),
+                                        datafeed.worker_count(MAX_WORKERS), label="港股同步")
+    with profiler.stage("download"):
+        for it, res in tqdm(sched.run(lambda it: download_one((it[0], it[1], mode))), total=len(todo), desc="HK同步"):
+            if res.get("mode"): modes[res["mode"]] = modes.get(res["mode"], 0) + 1
             s = res.get("status", "error")
             stats[s if s in stats else 'error'] += 1
-            if s == "error": fail_list.append(res.get("symbol"))
+            manifest.record(it[0], s, res.get("error"))
+    manifest.close()
+    sched.report(lambda it: it[0])
+    if modes:
+        log(f"🔁 更新模式統計 (full=重抓完整歷史, delta=增量附加): {modes}")
+    fail_list = manifest.failed()
 
     log("🧹 資料庫 VACUUM...")
     conn = sqlite3.connect(DB_PATH)
@@ -187,10 +258,15 @@ def run_sync(mode='hot'):
     duration = (time.time() - start_time) / 60
     log(f"📊 同步完成！費時: {duration:.1f} 分鐘")
     
+    # 統計以今日清單為準 (含先前中斷前已完成的部分)，fail_list 供 --retry-failed 參考
+    summary = manifest.summary([it[0] for it in items])
     return {
-        "success": stats['success'],
-        "error": stats['error'],
+        "success": summary['success'],
+        "error": summary['error'],
+        "fail": summary['fail'],
         "total": len(items),
+        "skipped": len(sched.skipped),
+        **negative_cache.stats(manifest.catalog, cached),
         "fail_list": fail_list,
         "has_changed": stats['success'] > 0
     }
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
-import os, sys, time, random, subprocess, sqlite3
+import os, sys, time, subprocess, sqlite3
 import pandas as pd
-import yfinance as yf
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date, timezone
 from tqdm import tqdm
+import profiler
+import datafeed
+import negative_cache
+import run_manifest
+import scheduler
+import sharding
+import trading_calendar
 
 # ====== 自動安裝必要套件 ======
 def ensure_pkg(pkg_install_name, import_name):
@@ -45,6 +50,11 @@ def init_db():
                             name TEXT, 
                             sector TEXT, 
                             updated_at TEXT)''')
+        # 每檔最後一根 K 線與寫入時間 (UTC)，供交易日曆判斷新鮮度
+        conn.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                            symbol TEXT PRIMARY KEY,
+                            last_date TEXT,
+                            synced_at TEXT)''')
         
         # 💡 自動升級：檢查並新增 market 欄位
         cursor = conn.execute("PRAGMA table_info(stock_info)")
@@ -97,6 +107,38 @@ def get_jp_stock_list():
 
 # ========== 4. 核心下載邏輯 ==========
 
+def prepare_frame(hist):
+    """yfinance 格式 -> stock_prices 欄位 (日期以交易所當地日期表示)"""
+    hist = hist.reset_index()
+    hist.columns = [c.lower() for c in hist.columns]
+    if 'date' not in hist.columns: return pd.DataFrame()
+    hist['date'] = pd.to_datetime(hist['date']).dt.tz_localize(None).dt.strftime('%Y-%m-%d')
+    cols = ['date', 'open', 'high', 'low', 'close', 'volume'] + [c for c in datafeed.ACTION_COLUMNS if c in hist.columns]
+    return hist[cols]
+
+def load_tail(symbol, n=30):
+    """資料庫中該檔最近 n 根 K 線 (增量比對用)"""
+    conn = sqlite3.connect(DB_PATH, timeout=60)
+    try:
+        df = pd.read_sql_query("SELECT date, open, high, low, close, volume FROM stock_prices WHERE symbol = ? "
+                               "ORDER BY date DESC LIMIT ?", conn, params=(symbol, n))
+    finally:
+        conn.close()
+    return df.iloc[::-1].reset_index(drop=True) if not df.empty else None
+
+def write_prices(symbol, frame):
+    df_final = frame[['date', 'open', 'high', 'low', 'close', 'volume']].copy()
+    df_final['symbol'] = symbol
+    
+    conn = sqlite3.connect(DB_PATH, timeout=60)
+    df_final.to_sql('stock_prices', conn, if_exists='append', index=False, 
+                    method=lambda table, conn, keys, data_iter: 
+                    conn.executemany(f"INSERT OR REPLACE INTO {table.name} ({', '.join(keys)}) VALUES ({', '.join(['?']*len(keys))})", data_iter))
+    conn.execute("INSERT OR REPLACE INTO sync_state (symbol, last_date, synced_at) VALUES (?, ?, ?)",
+                 (symbol, df_final['date'].max(), datetime.now(timezone.utc).isoformat(timespec="seconds")))
+    conn.commit()
+    conn.close()
+
 def download_one(args):
     symbol, name, mode = args
     start_date = "2020-01-01" if mode == 'hot' else "2000-01-01"
@@ -104,58 +146,81 @@ def download_one(args):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            time.sleep(random.uniform(1.5, 3.0) if IS_GITHUB_ACTIONS else 0.2)
+            if IS_GITHUB_ACTIONS: datafeed.jitter(1.5, 3.0)
+            else: datafeed.jitter(0.2, 0.2)
             
-            tk = yf.Ticker(symbol)
-            hist = tk.history(start=start_date, timeout=25, auto_adjust=True)
+            # 增量更新：以資料庫最後幾根 K 線為比對基準，遇除權息或還原價改寫才重抓完整歷史
+            df_final, fetch_mode = datafeed.refresh_frame(
+                symbol, load_tail(symbol), {"start": start_date, "timeout": 25, "auto_adjust": True}, prepare_frame)
             
-            if hist is None or hist.empty:
+            if df_final is None:
                 return {"symbol": symbol, "status": "empty"}
-                
-            hist.reset_index(inplace=True)
-            hist.columns = [c.lower() for c in hist.columns]
+            if fetch_mode == "stale":
+                # 已有歷史但近期沒有 K 線 (停牌 / 下市)：不改寫資料庫，記為 empty 讓負快取退避
+                return {"symbol": symbol, "status": "empty", "mode": fetch_mode, "error": datafeed.STALE_ERROR}
             
-            # 處理日期格式
-            if 'date' in hist.columns:
-                hist['date'] = pd.to_datetime(hist['date']).dt.tz_localize(None).dt.strftime('%Y-%m-%d')
-            
-            df_final = hist[['date', 'open', 'high', 'low', 'close', 'volume']].copy()
-            df_final['symbol'] = symbol
-            
-            # 寫入資料庫
-            conn = sqlite3.connect(DB_PATH, timeout=60)
-            df_final.to_sql('stock_prices', conn, if_exists='append', index=False, 
-                            method=lambda table, conn, keys, data_iter: 
-                            conn.executemany(f"INSERT OR REPLACE INTO {table.name} ({', '.join(keys)}) VALUES ({', '.join(['?']*len(keys))})", data_iter))
-            conn.close()
-            
-            return {"symbol": symbol, "status": "success"}
-        except:
+            write_prices(symbol, df_final)
+            return {"symbol": symbol, "status": "success", "mode": fetch_mode}
+        except Exception as e:
             if attempt < max_retries - 1:
-                time.sleep(random.uniform(5, 10))
+                datafeed.jitter(5, 10)
                 continue
-            return {"symbol": symbol, "status": "error"}
+            return {"symbol": symbol, "status": "error", "error": str(e)}
+
+def fresh_symbols():
+    """sync_state 中已涵蓋最近一個已收盤交易日的標的集合"""
+    session = trading_calendar.latest_completed_session(MARKET_CODE)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute("SELECT symbol, last_date, synced_at FROM sync_state").fetchall()
+    finally:
+        conn.close()
+    return {sym for sym, last, synced in rows
+            if last and synced and trading_calendar.is_current(
+                MARKET_CODE, date.fromisoformat(last[:10]), datetime.fromisoformat(synced), session)}
 
-def run_sync(mode='hot'):
+def run_sync(mode='hot', retry_failed=False, shard=None):
     start_time = time.time()
     init_db()
     
-    items = get_jp_stock_list()
+    with profiler.stage("universe"):
+        items = get_jp_stock_list()
+    # 分片模式只處理屬於本分片的代號 (shard=(i, N))
+    items = sharding.filter_items(items, lambda it: it[0], shard)
     if not items:
         return {"fail_list": [], "success": 0, "has_changed": False}
 
-    log(f"🚀 開始日股同步 ({mode}) | 目標: {len(items)} 檔")
+    # 今日續跑清單：略過已完成的標的，或只重跑失敗的標的
+    manifest = run_manifest.RunManifest(MARKET_CODE, shard=shard)
+    todo = manifest.select(items, lambda it: it[0], retry_failed)
+    # 最後一根 K 線已涵蓋最近收盤交易日者直接略過 (不進執行緒池、不打 API)
+    current = fresh_symbols()
+    fresh = [it for it in todo if it[0] in current]
+    todo = [it for it in todo if it[0] not in current]
+    for it in fresh:
+        manifest.record(it[0], "exists")
+    # 連續抓不到資料的標的 (下市、代號對應錯誤、停牌) 依指數退避的間隔才重新探測
+    cached, todo = negative_cache.split(manifest.catalog, todo, lambda it: it[0], enabled=not retry_failed)
+    negative_cache.describe(cached, lambda it: it[0], log)
+    log(f"🚀 開始日股同步 ({mode}) | 目標: {len(items)} 檔 | 已是最新: {len(fresh)} 檔 | 本輪待處理: {len(todo)} 檔")
 
     stats = {"success": 0, "empty": 0, "error": 0}
-    fail_list = []
+    modes = {}
     
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_one, (it[0], it[1], mode)): it[0] for it in items}
-        for f in tqdm(as_completed(futures), total=len(items), desc="JP同步"):
-            res = f.result()
+    # 依優先順序 (未抓過 -> 流動性/落後天數 -> 上次失敗) 送出，時間預算用盡時停止
+    sched = scheduler.DeadlineScheduler(todo, scheduler.warehouse_priority(DB_PATH, MARKET_CODE),
+                                        datafeed.worker_count(MAX_WORKERS), label="日股同步")
+    with profiler.stage("download"):
+        for it, res in tqdm(sched.run(lambda it: download_one((it[0], it[1], mode))), total=len(todo), desc="JP同步"):
+            if res.get("mode"): modes[res["mode"]] = modes.get(res["mode"], 0) + 1
             s = res.get("status", "error")
             stats[s if s in stats else 'error'] += 1
-            if s == "error": fail_list.append(res.get("symbol"))
+            manifest.record(it[0], s, res.get("error"))
+    manifest.close()
+    sched.report(lambda it: it[0])
+    if modes:
+        log(f"🔁 更新模式統計 (full=重抓完整歷史, delta=增量附加): {modes}")
+    fail_list = manifest.failed()
 
     # 資料庫優化
     log("🧹 執行資料庫優化 (VACUUM)...")
@@ -166,10 +231,15 @@ def run_sync(mode='hot'):
     duration = (time.time() - start_time) / 60
     log(f"📊 同步完成！費時: {duration:.1f} 分鐘")
     
+    # 統計以今日清單為準 (含先前中斷前已完成的部分)，fail_list 供 --retry-failed 參考
+    summary = manifest.summary([it[0] for it in items])
     return {
-        "success": stats['success'],
-        "error": stats['error'],
+        "success": summary['success'],
+        "error": summary['error'],
+        "fail": summary['fail'],
         "total": len(items),
+        "skipped": len(sched.skipped),
+        **negative_cache.stats(manifest.catalog, cached),
         "fail_list": fail_list,
         "has_changed": stats['success'] > 0
     }
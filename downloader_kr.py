@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
-import os, sys, time, random, logging, warnings, subprocess, json
-from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os, sys, logging, warnings, subprocess
 from tqdm import tqdm
+import profiler
+import bulk_ingest
+import datafeed
+import negative_cache
+import run_manifest
+import scheduler
+import sharding
+import trading_calendar
 import pandas as pd
-import yfinance as yf
 
 # ====== 自動安裝必要套件 ======
 def ensure_pkg(pkg: str):
@@ -29,8 +34,6 @@ LIST_DIR = os.path.join(BASE_DIR, "data", MARKET_CODE, "lists")
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(LIST_DIR, exist_ok=True)
 
-# 續跑清單紀錄檔案
-MANIFEST_CSV = Path(LIST_DIR) / "kr_manifest.csv"
 THREADS = 4
 
 def log(msg: str):
@@ -48,11 +51,20 @@ def standardize_df(df: pd.DataFrame) -> pd.DataFrame:
     df.columns = [c.lower() for c in df.columns]
     if 'date' not in df.columns: return pd.DataFrame()
     
-    # 移除時區資訊
-    df['date'] = pd.to_datetime(df['date'], utc=True).dt.tz_localize(None).dt.strftime('%Y-%m-%d')
+    # 以交易所當地日期存檔 (先轉 UTC 再去時區會讓日期提早一天)
+    df['date'] = pd.to_datetime(df['date'], utc=True).dt.tz_convert("Asia/Seoul").dt.strftime('%Y-%m-%d')
     req = ['date','open','high','low','close','volume']
     return df[req] if all(c in df.columns for c in req) else pd.DataFrame()
 
+def krx_listing(date, market):
+    """pykrx 單一市場的代號與名稱清單"""
+    tickers = krx.get_market_ticker_list(date, market=market)
+    return pd.DataFrame({"code": tickers, "name": [krx.get_market_ticker_name(t) for t in tickers]})
+
+def krx_ohlcv(date, market):
+    """pykrx 單一市場某日的全市場 OHLCV (代號由索引轉為 티커 欄)"""
+    return krx.get_market_ohlcv(date, market=market).reset_index()
+
 def get_kr_list():
     """從 KRX 獲取最新 KOSPI/KOSDAQ 普通股清單"""
     today = pd.Timestamp.today().strftime("%Y%m%d")
@@ -61,9 +73,8 @@ def get_kr_list():
     try:
         # 抓取 KOSPI (KS) 與 KOSDAQ (KQ)
         for mk, bd in [("KOSPI","KS"), ("KOSDAQ","KQ")]:
-            tickers = krx.get_market_ticker_list(today, market=mk)
-            for t in tickers:
-                name = krx.get_market_ticker_name(t)
+            listing = datafeed.source_frame(f"pykrx/market_ticker_list_{mk}", krx_listing, today, mk)
+            for t, name in zip(listing["code"], listing["name"]):
                 # 過濾：排除優先股 (通常代號第6位不是0) 與 衍生品
                 if t.endswith('0'): 
                     lst.append({"code": t, "name": name, "board": bd, "status": "pending"})
@@ -81,74 +92,95 @@ def download_one(row_data):
     idx, row = row_data
     code, board = row['code'], row['board']
     symbol = map_symbol_kr(code, board)
-    # 存檔名稱範例: 005930.KS.csv
-    out_path = os.path.join(DATA_DIR, f"{code}.{board}.csv")
-    
-    # ✅ 今日快取檢查
-    if os.path.exists(out_path):
-        mtime = datetime.fromtimestamp(os.path.getmtime(out_path)).date()
-        if mtime == datetime.now().date() and os.path.getsize(out_path) > 1000:
-            return idx, "exists"
+    # 存檔名稱範例: 005930.KS.csv (新鮮度已由 main 依交易日曆預先過濾)
+    out_path = out_path_for(row)
 
     try:
-        time.sleep(random.uniform(0.3, 1.0)) # 隨機延遲防止封鎖
-        tk = yf.Ticker(symbol)
-        df_raw = tk.history(period="2y", interval="1d", auto_adjust=False)
-        df = standardize_df(df_raw)
+        datafeed.jitter(0.3, 1.0) # 隨機延遲防止封鎖
+        # 增量更新：只抓近期 K 線，重疊區間不一致 (分割等改寫歷史) 才重抓完整歷史
+        mode = datafeed.refresh_csv(symbol, out_path, {"period": "2y", "interval": "1d", "auto_adjust": False},
+                                    prepare=standardize_df)
         
-        if not df.empty:
-            df.to_csv(out_path, index=False, encoding='utf-8-sig')
-            return idx, "done"
-        return idx, "empty"
-    except:
-        return idx, "failed"
+        if mode not in datafeed.NO_DATA_MODES:
+            return idx, "done", None
+        # stale (已有歷史但近期沒有 K 線) 同樣記為 empty，讓負快取退避
+        return idx, "empty", datafeed.STALE_ERROR if mode == "stale" else None
+    except Exception as e:
+        return idx, "failed", str(e)
 
-from datetime import datetime
+def item_key(row):
+    """清單列的唯一鍵：與存檔名稱一致 (如 005930.KS)"""
+    return f"{row['code']}.{row['board']}"
 
-def main():
+def out_path_for(row):
+    return os.path.join(DATA_DIR, f"{item_key(row)}.csv")
+
+def main(retry_failed=False, shard=None):
     log("🇰🇷 啟動韓股下載引擎 (KOSPI/KOSDAQ)")
     
     # 1. 獲取標的名單
-    mf = get_kr_list()
+    with profiler.stage("universe"):
+        mf = get_kr_list()
+    # 分片模式只處理屬於本分片的代號 (shard=(i, N))
+    if shard is not None and not mf.empty:
+        mf = mf[[sharding.in_shard(item_key(row), shard) for _, row in mf.iterrows()]].reset_index(drop=True)
     if mf.empty:
         return {"total": 0, "success": 0, "fail": 0}
 
-    # 2. 偵測本機已存在的檔案 (續跑機制)
-    existing_files = [f for f in os.listdir(DATA_DIR) if f.endswith(".csv")]
-    for f in existing_files:
-        code_part = f.replace(".csv", "")
-        if "." in code_part:
-            c, b = code_part.split(".")
-            mf.loc[(mf['code'] == c) & (mf['board'] == b), "status"] = "exists"
-
-    todo = mf[mf["status"] == "pending"]
-    log(f"📝 總標的：{len(mf)} | 待處理：{len(todo)} | 已存在：{len(mf[mf['status']=='exists'])}")
-
-    # 3. 多執行緒下載
-    stats = {"done": 0, "exists": len(mf[mf['status']=='exists']), "empty": 0, "failed": 0}
+    # 2. 今日續跑清單 (取代舊版只在結尾寫入的 kr_manifest.csv)：略過已完成的標的，或只重跑失敗的標的
+    manifest = run_manifest.RunManifest(MARKET_CODE, shard=shard)
+    todo = manifest.select(list(mf.iterrows()), lambda r: item_key(r[1]), retry_failed)
+    # 最後一根 K 線已涵蓋最近收盤交易日者直接略過 (不進執行緒池、不打 API)
+    fresh, todo = trading_calendar.split_fresh(MARKET_CODE, todo, lambda r: out_path_for(r[1]))
+    for idx, row in fresh:
+        mf.at[idx, "status"] = "exists"
+        manifest.record(item_key(row), "exists")
+    # 連續抓不到資料的標的 (下市、代號對應錯誤、停牌) 依指數退避的間隔才重新探測
+    cached, todo = negative_cache.split(manifest.catalog, todo, lambda r: item_key(r[1]), enabled=not retry_failed)
+    negative_cache.describe(cached, lambda r: item_key(r[1]), log)
+    stats = {"done": 0, "exists": 0, "empty": 0, "failed": 0}
+    skipped = 0
+
+    # 3. pykrx 全市場 OHLCV 一次補上最近交易日，只剩新上市、缺口與分割等改寫歷史的標的走逐檔 Yahoo
+    if todo and bulk_ingest.enabled():
+        with profiler.stage("bulk"):
+            session = trading_calendar.latest_completed_session(MARKET_CODE)
+            bars = bulk_ingest.fetch_kr_bars(session, krx_ohlcv)
+            bulk, todo, reasons = bulk_ingest.append_bars(MARKET_CODE, bars, todo, lambda r: out_path_for(r[1]),
+                                                          lambda r: item_key(r[1]), session) \
+                if len(bars) else ([], todo, {})
+        for idx, row in bulk:
+            mf.at[idx, "status"] = "done"
+            manifest.record(item_key(row), "done")
+        stats["done"] += len(bulk)
+        log(f"📦 全市場 OHLCV {len(bars)} 檔 | 直接附加: {len(bulk)} | 改走逐檔下載: {len(todo)} {reasons or ''}")
+    log(f"📝 總標的：{len(mf)} | 待處理：{len(todo)} | 略過：{len(mf) - len(todo)}")
+
+    # 4. 多執行緒下載 (每完成一檔即寫入清單)
     
-    if not todo.empty:
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = {executor.submit(download_one, item): item for item in todo.iterrows()}
+    if todo:
+        # 依優先順序 (未抓過 -> 流動性/落後天數 -> 上次失敗) 送出，時間預算用盡時停止
+        sched = scheduler.DeadlineScheduler(
+            todo, scheduler.catalog_priority(os.path.dirname(DATA_DIR), lambda r: out_path_for(r[1])),
+            datafeed.worker_count(THREADS), label="韓股下載")
+        with profiler.stage("download"):
             pbar = tqdm(total=len(todo), desc="韓股下載進度")
             
-            for f in as_completed(futures):
-                idx, status = f.result()
+            for item, (idx, status, err) in sched.run(download_one):
                 mf.at[idx, "status"] = status
-                if status in ["done", "empty", "failed"]:
-                    stats[status if status != "done" else "done"] += 1
+                stats[status] += 1
+                manifest.record(item_key(item[1]), status, err)
                 pbar.update(1)
             pbar.close()
+        sched.report(lambda r: item_key(r[1]))
+        skipped = len(sched.skipped)
 
-    # 4. 儲存續跑清單
-    mf.to_csv(MANIFEST_CSV, index=False)
+    manifest.close()
     
-    # ✨ 重要：構建回傳給 main.py 的統計字典
-    report_stats = {
-        "total": len(mf),
-        "success": len(mf[mf["status"].isin(["done", "exists"])]),
-        "fail": len(mf[mf["status"].isin(["empty", "failed"])])
-    }
+    # ✨ 重要：構建回傳給 main.py 的統計字典 (以今日清單為準，含先前中斷前已完成的部分)
+    report_stats = manifest.summary([item_key(row) for _, row in mf.iterrows()])
+    report_stats["skipped"] = skipped
+    report_stats.update(negative_cache.stats(manifest.catalog, cached))
     
     print("\n" + "="*50)
     log(f"📊 韓股任務完成報告: {report_stats}")
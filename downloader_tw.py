@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 import os
-import time
-import random
-import requests
 import pandas as pd
-import yfinance as yf
 from io import StringIO
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
+import profiler
+import bulk_ingest
+import datafeed
+import http_cache
+import negative_cache
+import run_manifest
+import scheduler
+import sharding
+import trading_calendar
 from pathlib import Path
 
 # ========== 核心參數設定 ==========
@@ -23,6 +27,19 @@ Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
 def log(msg: str):
     print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
 
+def parse_isin_page(text, suffix):
+    """證交所 ISIN 清單頁 -> ["代號.TW&名稱", ...]"""
+    items = []
+    df_list = pd.read_html(StringIO(text), header=0)
+    if not df_list: return items
+    df = df_list[0]
+    for _, row in df.iterrows():
+        code = str(row['有價證券代號']).strip()
+        name = str(row['有價證券名稱']).strip()
+        if code and '有價證券' not in code:
+            items.append(f"{code}{suffix}&{name}")
+    return items
+
 def get_full_stock_list():
     """獲取台股全市場清單 (雙重機制：證交所 JSP + Akshare 備援)"""
     url_configs = [
@@ -39,15 +56,11 @@ def get_full_stock_list():
     for cfg in url_configs:
         try:
             headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
-            resp = requests.get(cfg['url'], timeout=15, headers=headers)
-            df_list = pd.read_html(StringIO(resp.text), header=0)
-            if not df_list: continue
-            df = df_list[0]
-            for _, row in df.iterrows():
-                code = str(row['有價證券代號']).strip()
-                name = str(row['有價證券名稱']).strip()
-                if code and '有價證券' not in code:
-                    all_items.append(f"{code}{cfg['suffix']}&{name}")
+            # 條件式請求 + 依內容雜湊快取解析結果：清單未變動時不重新下載、不重新解析 HTML
+            resp = datafeed.cached_get(cfg['url'], timeout=15, headers=headers)
+            resp.raise_for_status()
+            all_items.extend(http_cache.parsed(f"tw-isin-{cfg['name']}", resp,
+                                               lambda: parse_isin_page(resp.text, cfg['suffix'])))
         except Exception as e:
             continue
 
@@ -57,7 +70,7 @@ def get_full_stock_list():
         try:
             import akshare as ak
             # 獲取上市與上櫃清單
-            df_tw_listed = ak.stock_tw_spot_em() # 台灣市場即時行情
+            df_tw_listed = datafeed.source_frame("akshare/stock_tw_spot_em", ak.stock_tw_spot_em) # 台灣市場即時行情
             for _, row in df_tw_listed.iterrows():
                 code = str(row['代码'])
                 name = str(row['名称'])
@@ -72,72 +85,108 @@ def get_full_stock_list():
     log(f"✅ 台股清單獲取完成，共 {len(final_res)} 檔標的。")
     return final_res
 
+def out_path_for(item):
+    """清單項目 (代號&名稱) 對應的 CSV 路徑；格式錯誤時回傳 None"""
+    parts = item.split('&', 1)
+    if len(parts) < 2: return None
+    yf_tkr, name = parts
+    safe_name = "".join([c for c in name if c.isalnum() or c in (' ', '_', '-')]).strip()
+    return os.path.join(DATA_DIR, f"{yf_tkr}_{safe_name}.csv")
+
 def download_stock_data(item):
-    """具備隨機延遲與自動重試的下載邏輯"""
+    """具備隨機延遲與自動重試的下載邏輯 (新鮮度已由 main 依交易日曆預先過濾)"""
     yf_tkr = "ParseError"
     try:
-        parts = item.split('&', 1)
-        if len(parts) < 2: return {"status": "error", "tkr": item}
-        
-        yf_tkr, name = parts
-        safe_name = "".join([c for c in name if c.isalnum() or c in (' ', '_', '-')]).strip()
-        out_path = os.path.join(DATA_DIR, f"{yf_tkr}_{safe_name}.csv")
-        
-        # 今日快取檢查
-        if os.path.exists(out_path):
-            mtime = datetime.fromtimestamp(os.path.getmtime(out_path)).date()
-            if mtime == datetime.now().date() and os.path.getsize(out_path) > 1000:
-                return {"status": "exists", "tkr": yf_tkr}
-
-        time.sleep(random.uniform(0.5, 1.2))
-        tk = yf.Ticker(yf_tkr)
-        
+        out_path = out_path_for(item)
+        if out_path is None: return {"status": "error", "tkr": item}
+        yf_tkr = item_key(item)
+
+        datafeed.jitter(0.5, 1.2)
+        last_err = None
         for attempt in range(2):
             try:
-                hist = tk.history(period="2y", timeout=15)
-                if hist is not None and not hist.empty:
-                    hist.reset_index(inplace=True)
-                    hist.columns = [c.lower() for c in hist.columns]
-                    hist.to_csv(out_path, index=False, encoding='utf-8-sig')
-                    return {"status": "success", "tkr": yf_tkr}
+                # 增量更新：只抓近期 K 線，遇除權息或重疊區間不一致才重抓 2 年完整歷史
+                mode = datafeed.refresh_csv(yf_tkr, out_path, {"period": "2y", "timeout": 15})
+                if mode not in datafeed.NO_DATA_MODES:
+                    return {"status": "success", "tkr": yf_tkr, "mode": mode}
+                # 已有歷史但近期沒有 K 線：不必再試，記為 empty 讓負快取退避
+                if mode == "stale":
+                    return {"status": "empty", "tkr": yf_tkr, "mode": mode, "error": datafeed.STALE_ERROR}
                 if attempt == 1: return {"status": "empty", "tkr": yf_tkr}
-            except:
-                time.sleep(random.uniform(3, 7))
+            except Exception as e:
+                last_err = str(e)
+                datafeed.jitter(3, 7)
 
-        return {"status": "empty", "tkr": yf_tkr}
-    except:
-        return {"status": "error", "tkr": yf_tkr}
+        return {"status": "empty", "tkr": yf_tkr, "error": last_err}
+    except Exception as e:
+        return {"status": "error", "tkr": yf_tkr, "error": str(e)}
 
-from datetime import datetime
+def item_key(item):
+    """清單項目 (代號&名稱) 的唯一鍵：Yahoo 代號"""
+    return item.split('&', 1)[0]
 
-def main():
-    items = get_full_stock_list()
+def main(retry_failed=False, shard=None):
+    with profiler.stage("universe"):
+        items = get_full_stock_list()
+    # 分片模式只處理屬於本分片的代號 (shard=(i, N))
+    items = sharding.filter_items(items, item_key, shard)
     if not items:
         return {"total": 0, "success": 0, "fail": 0}
-        
-    log(f"🚀 啟動台股下載任務，目標總數: {len(items)}")
+
+    # 今日續跑清單：略過已完成的標的，或只重跑失敗的標的
+    manifest = run_manifest.RunManifest(MARKET_CODE, shard=shard)
+    todo = manifest.select(items, item_key, retry_failed)
+    # 最後一根 K 線已涵蓋最近收盤交易日者直接略過 (不進執行緒池、不打 API)
+    fresh, todo = trading_calendar.split_fresh(MARKET_CODE, todo, out_path_for)
+    for it in fresh:
+        manifest.record(item_key(it), "exists")
+    # 連續抓不到資料的標的 (下市、代號對應錯誤、停牌) 依指數退避的間隔才重新探測
+    cached, todo = negative_cache.split(manifest.catalog, todo, item_key, enabled=not retry_failed)
+    negative_cache.describe(cached, item_key, log)
     
     stats = {"success": 0, "exists": 0, "empty": 0, "error": 0}
+    modes = {}
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_stock_data, it): it for it in items}
-        pbar = tqdm(total=len(items), desc="台股下載")
+    # 全市場日行情：一兩次請求補上最近交易日的 K 線，只剩新上市、缺口與除權息的標的走逐檔 Yahoo
+    if todo and bulk_ingest.enabled():
+        with profiler.stage("bulk"):
+            session = trading_calendar.latest_completed_session(MARKET_CODE)
+            bars = bulk_ingest.fetch_tw_bars(session)
+            bulk, todo, reasons = bulk_ingest.append_bars(MARKET_CODE, bars, todo, out_path_for, item_key, session) \
+                if len(bars) else ([], todo, {})
+        for it in bulk:
+            manifest.record(item_key(it), "success")
+        if bulk:
+            stats["success"] += len(bulk)
+            modes["bulk"] = len(bulk)
+        log(f"📦 全市場日行情 {len(bars)} 檔 | 直接附加: {len(bulk)} | 改走逐檔下載: {len(todo)} {reasons or ''}")
+    log(f"🚀 啟動台股下載任務，目標總數: {len(items)} | 已是最新: {len(fresh)} | 本輪待處理: {len(todo)}")
+
+    # 依優先順序 (未抓過 -> 流動性/落後天數 -> 上次失敗) 送出，時間預算用盡時停止
+    sched = scheduler.DeadlineScheduler(todo, scheduler.catalog_priority(os.path.dirname(DATA_DIR), out_path_for),
+                                        datafeed.worker_count(MAX_WORKERS), label="台股下載")
+    with profiler.stage("download"):
+        pbar = tqdm(total=len(todo), desc="台股下載")
         
-        for future in as_completed(futures):
-            res = future.result()
+        for it, res in sched.run(download_stock_data):
+            if res.get("mode"): modes[res["mode"]] = modes.get(res["mode"], 0) + 1
             stats[res["status"]] += 1
+            manifest.record(item_key(it), res["status"], res.get("error"))
             pbar.update(1)
             
             if pbar.n % 100 == 0:
-                time.sleep(random.uniform(5, 10))
+                datafeed.jitter(5, 10)
         pbar.close()
     
-    # ✨ 重要：構建回傳給 main.py 的統計字典
-    report_stats = {
-        "total": len(items),
-        "success": stats["success"] + stats["exists"],
-        "fail": stats["error"] + stats["empty"]
-    }
+    manifest.close()
+    sched.report(item_key)
+    if modes:
+        log(f"🔁 更新模式統計 (full=重抓完整歷史, delta=增量附加, bulk=全市場日行情): {modes}")
+    
+    # ✨ 重要：構建回傳給 main.py 的統計字典 (以今日清單為準，含先前中斷前已完成的部分)
+    report_stats = manifest.summary([item_key(it) for it in items])
+    report_stats["skipped"] = len(sched.skipped)
+    report_stats.update(negative_cache.stats(manifest.catalog, cached))
     
     print("\n" + "="*50)
     log(f"📊 台股下載完成報告: {report_stats}")
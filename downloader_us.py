@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 import os
-import time
-import random
 import json
-import requests
 import pandas as pd
-import yfinance as yf
 from datetime import datetime
 from io import StringIO
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
+import profiler
+import datafeed
+import http_cache
+import negative_cache
+import run_manifest
+import scheduler
+import sharding
+import trading_calendar
 from pathlib import Path
 
 # ========== 核心參數設定 ==========
@@ -35,6 +38,18 @@ def classify_security(name: str, is_etf: bool) -> str:
     if any(kw in n_upper for kw in exclude_keywords): return "Exclude"
     return "Common Stock"
 
+def parse_symbol_directory(text, symbol_col):
+    """nasdaqtrader 代號目錄 (| 分隔) -> 普通股 ["代號&名稱", ...]"""
+    rows = []
+    df = pd.read_csv(StringIO(text), sep="|")
+    df = df[df["Test Issue"] == "N"].dropna(subset=[symbol_col, "Security Name"])
+    for _, row in df.iterrows():
+        name = str(row["Security Name"])
+        if classify_security(name, row["ETF"] == "Y") == "Common Stock":
+            symbol = str(row[symbol_col]).strip().replace('$', '-')
+            rows.append(f"{symbol}&{name}")
+    return rows
+
 def get_full_stock_list():
     """
     ⚡ 快取化清單獲取：優先從 Nasdaq 官網抓取清單，並過濾出普通股
@@ -51,28 +66,18 @@ def get_full_stock_list():
     all_rows = []
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
 
-    # 1. NASDAQ 市場清單
+    # 1. NASDAQ 市場清單 (條件式請求；內容未變動時沿用上次的解析結果)
     try:
-        r1 = requests.get("https://www.nasdaqtrader.com/dynamic/symdir/nasdaqlisted.txt", timeout=15, headers=headers)
-        df1 = pd.read_csv(StringIO(r1.text), sep="|")
-        df1 = df1[df1["Test Issue"] == "N"].dropna(subset=["Symbol", "Security Name"])
-        for _, row in df1.iterrows():
-            name = str(row["Security Name"])
-            if classify_security(name, row["ETF"] == "Y") == "Common Stock":
-                symbol = str(row['Symbol']).strip().replace('$', '-')
-                all_rows.append(f"{symbol}&{name}")
+        r1 = datafeed.cached_get("https://www.nasdaqtrader.com/dynamic/symdir/nasdaqlisted.txt", timeout=15, headers=headers)
+        r1.raise_for_status()
+        all_rows += http_cache.parsed("us-nasdaqlisted", r1, lambda: parse_symbol_directory(r1.text, "Symbol"))
     except Exception as e: log(f"⚠️ NASDAQ 獲取失敗: {e}")
 
     # 2. NYSE 與其餘市場清單
     try:
-        r2 = requests.get("https://www.nasdaqtrader.com/dynamic/symdir/otherlisted.txt", timeout=15, headers=headers)
-        df2 = pd.read_csv(StringIO(r2.text), sep="|")
-        df2 = df2[df2["Test Issue"] == "N"].dropna(subset=["NASDAQ Symbol", "Security Name"])
-        for _, row in df2.iterrows():
-            name = str(row["Security Name"])
-            if classify_security(name, row["ETF"] == "Y") == "Common Stock":
-                symbol = str(row['NASDAQ Symbol']).strip().replace('$', '-')
-                all_rows.append(f"{symbol}&{name}")
+        r2 = datafeed.cached_get("https://www.nasdaqtrader.com/dynamic/symdir/otherlisted.txt", timeout=15, headers=headers)
+        r2.raise_for_status()
+        all_rows += http_cache.parsed("us-otherlisted", r2, lambda: parse_symbol_directory(r2.text, "NASDAQ Symbol"))
     except Exception as e: log(f"⚠️ NYSE/Other 獲取失敗: {e}")
 
     final_list = list(set(all_rows))
@@ -86,75 +91,98 @@ def get_full_stock_list():
         log("❌ 無法獲取任何美股標的清單。")
         return []
 
+def out_path_for(item):
+    """清單項目 (代號&名稱) 對應的 CSV 路徑 (移除檔名非法字元)；格式錯誤時回傳 None"""
+    parts = item.split('&', 1)
+    if len(parts) < 2: return None
+    yf_tkr, name = parts
+    safe_name = "".join([c for c in name if c.isalnum() or c in (' ', '_', '-')]).strip()
+    return os.path.join(DATA_DIR, f"{yf_tkr}_{safe_name}.csv")
+
 def download_stock_data(item):
     """
-    ⚡ 檔案級快取下載邏輯
+    ⚡ 單檔下載邏輯 (新鮮度已由 main 依交易日曆預先過濾)
     """
     try:
-        parts = item.split('&', 1)
-        if len(parts) < 2: return {"status": "error"}
-        yf_tkr, name = parts
-        
-        # 移除檔名非法字元
-        safe_name = "".join([c for c in name if c.isalnum() or c in (' ', '_', '-')]).strip()
-        out_path = os.path.join(DATA_DIR, f"{yf_tkr}_{safe_name}.csv")
-        
-        # ✅ 快取檢查：檢查檔案是否存在且是今天更新的
-        if os.path.exists(out_path):
-            mtime = datetime.fromtimestamp(os.path.getmtime(out_path)).date()
-            if mtime == datetime.now().date() and os.path.getsize(out_path) > 1000:
-                return {"status": "exists", "tkr": yf_tkr}
-
-        # --- 若無快取則下載 ---
-        time.sleep(random.uniform(0.4, 1.2))
-        tk = yf.Ticker(yf_tkr)
-        
+        out_path = out_path_for(item)
+        if out_path is None: return {"status": "error"}
+        yf_tkr = item_key(item)
+
+        # --- 下載 ---
+        datafeed.jitter(0.4, 1.2)
+        last_err = None
         for attempt in range(2):
             try:
-                hist = tk.history(period="2y", timeout=20)
-                if hist is not None and not hist.empty:
-                    hist.reset_index(inplace=True)
-                    hist.columns = [c.lower() for c in hist.columns]
-                    hist.to_csv(out_path, index=False, encoding='utf-8-sig')
-                    return {"status": "success", "tkr": yf_tkr}
+                # 增量更新：只抓近期 K 線，遇除權息或重疊區間不一致才重抓 2 年完整歷史
+                mode = datafeed.refresh_csv(yf_tkr, out_path, {"period": "2y", "timeout": 20})
+                if mode not in datafeed.NO_DATA_MODES:
+                    return {"status": "success", "tkr": yf_tkr, "mode": mode}
+                # 已有歷史但近期沒有 K 線：不必再試，記為 empty 讓負快取退避
+                if mode == "stale":
+                    return {"status": "empty", "tkr": yf_tkr, "mode": mode, "error": datafeed.STALE_ERROR}
                 if attempt == 1: return {"status": "empty", "tkr": yf_tkr}
             except Exception as e:
+                last_err = str(e)
                 if "Rate limited" in str(e): 
-                    time.sleep(random.uniform(20, 40))
-            time.sleep(random.uniform(3, 6))
+                    datafeed.jitter(20, 40)
+            datafeed.jitter(3, 6)
 
-        return {"status": "empty", "tkr": yf_tkr}
-    except: 
-        return {"status": "error"}
+        return {"status": "empty", "tkr": yf_tkr, "error": last_err}
+    except Exception as e: 
+        return {"status": "error", "error": str(e)}
 
-def main():
-    items = get_full_stock_list()
+def item_key(item):
+    """清單項目 (代號&名稱) 的唯一鍵：Yahoo 代號"""
+    return item.split('&', 1)[0]
+
+def main(retry_failed=False, shard=None):
+    with profiler.stage("universe"):
+        items = get_full_stock_list()
+    # 分片模式只處理屬於本分片的代號 (shard=(i, N))
+    items = sharding.filter_items(items, item_key, shard)
     if not items:
         return {"total": 0, "success": 0, "fail": 0}
 
-    log(f"🚀 啟動美股下載任務，目標總數: {len(items)}")
+    # 今日續跑清單：略過已完成的標的，或只重跑失敗的標的
+    manifest = run_manifest.RunManifest(MARKET_CODE, shard=shard)
+    todo = manifest.select(items, item_key, retry_failed)
+    # 最後一根 K 線已涵蓋最近收盤交易日者直接略過 (不進執行緒池、不打 API)
+    fresh, todo = trading_calendar.split_fresh(MARKET_CODE, todo, out_path_for)
+    for it in fresh:
+        manifest.record(item_key(it), "exists")
+    # 連續抓不到資料的標的 (下市、代號對應錯誤、停牌) 依指數退避的間隔才重新探測
+    cached, todo = negative_cache.split(manifest.catalog, todo, item_key, enabled=not retry_failed)
+    negative_cache.describe(cached, item_key, log)
+    log(f"🚀 啟動美股下載任務，目標總數: {len(items)} | 已是最新: {len(fresh)} | 本輪待處理: {len(todo)}")
     stats = {"success": 0, "exists": 0, "empty": 0, "error": 0}
+    modes = {}
     
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_stock_data, it): it for it in items}
-        pbar = tqdm(total=len(items), desc="美股下載進度", unit="檔")
+    # 依優先順序 (未抓過 -> 流動性/落後天數 -> 上次失敗) 送出，時間預算用盡時停止
+    sched = scheduler.DeadlineScheduler(todo, scheduler.catalog_priority(os.path.dirname(DATA_DIR), out_path_for),
+                                        datafeed.worker_count(MAX_WORKERS), label="美股下載")
+    with profiler.stage("download"):
+        pbar = tqdm(total=len(todo), desc="美股下載進度", unit="檔")
         
-        for future in as_completed(futures):
-            res = future.result()
+        for it, res in sched.run(download_stock_data):
+            if res.get("mode"): modes[res["mode"]] = modes.get(res["mode"], 0) + 1
             stats[res.get("status", "error")] += 1
+            manifest.record(item_key(it), res.get("status", "error"), res.get("error"))
             pbar.update(1)
             
             # 每成功下載 100 檔額外休息，防止被 Yahoo 封鎖
             if pbar.n % 100 == 0:
-                time.sleep(random.uniform(10, 20))
+                datafeed.jitter(10, 20)
         pbar.close()
     
-    # ✨ 重要：構建回傳給 main.py 的統計字典
-    report_stats = {
-        "total": len(items),
-        "success": stats["success"] + stats["exists"],
-        "fail": stats["error"] + stats["empty"]
-    }
+    manifest.close()
+    sched.report(item_key)
+    if modes:
+        log(f"🔁 更新模式統計 (full=重抓完整歷史, delta=增量附加): {modes}")
+    
+    # ✨ 重要：構建回傳給 main.py 的統計字典 (以今日清單為準，含先前中斷前已完成的部分)
+    report_stats = manifest.summary([item_key(it) for it in items])
+    report_stats["skipped"] = len(sched.skipped)
+    report_stats.update(negative_cache.stats(manifest.catalog, cached))
     
     print("\n" + "="*50)
     log(f"📊 美股下載完成報告: {report_stats}")
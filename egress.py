@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+多出口連線池：Yahoo 以用戶端身分/IP 限流，單一出口只能靠降低併發與長休避開封鎖。
+設定多個出口 (HTTP proxy、來源 IP 或不同的 session 身分) 後，個股 K 線請求平均分散到各出口，
+每個出口有自己的 token bucket 與健康分數，被限流或連續失敗的出口自動暫停 (冷卻時間指數遞增)，
+總吞吐量隨出口數增加。
+
+設定方式：專案目錄下的 egress.json，或環境變數 STOCK_MONITOR_EGRESS (JSON 字串或檔案路徑)：
+
+    [{"name": "direct", "rps": 2},
+     {"name": "proxy-a", "proxy": "http://10.0.0.2:3128", "rps": 2, "burst": 4},
+     {"name": "nic-2", "source_address": "192.168.1.12", "rps": 2, "user_agent": "Mozilla/5.0 ..."}]
+
+未設定時維持原本的單一出口行為 (datafeed.history 直接呼叫 yfinance)。
+"""
+import os
+import json
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EGRESS_ENV = "STOCK_MONITOR_EGRESS"
+CONFIG_PATH = os.path.join(BASE_DIR, "egress.json")
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+# 健康分數低於門檻即暫停；暫停時間 BENCH_SECONDS * 2^(連續暫停次數-1)，上限 MAX_BENCH_SECONDS
+BENCH_BELOW = 0.3
+BENCH_SECONDS = 30.0
+MAX_BENCH_SECONDS = 600.0
+# 各種結果對健康分數的影響
+SUCCESS_RECOVERY = 0.2
+THROTTLE_PENALTY = 0.5
+ERROR_PENALTY = 0.8
+
+class TokenBucket:
+    """執行緒安全的 token bucket；rate <= 0 代表不限速。reserve() 預約一個 token 並回傳需等待的秒數"""
+    def __init__(self, rate, capacity=1.0):
+        self.rate = float(rate or 0)
+        self.capacity = max(1.0, float(capacity or 1))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_estimate(self, now=None):
+        if self.rate <= 0: return 0.0
+        with self._lock:
+            self._refill(now or time.monotonic())
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self):
+        if self.rate <= 0: return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+class SourceAddressAdapter(HTTPAdapter):
+    """把連線綁定到指定的本機來源 IP (多網卡 / 多 IP 主機)"""
+    def __init__(self, source_address, **kwargs):
+        self.source_address = (source_address, 0)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["source_address"] = self.source_address
+        return super().init_poolmanager(*args, **kwargs)
+
+class Egress:
+    """單一出口：獨立的 requests.Session (proxy / 來源 IP / User-Agent)、限速器與健康狀態"""
+    def __init__(self, name, proxy=None, source_address=None, rps=0.0, burst=1, user_agent=None, headers=None):
+        self.name = name
+        self.proxy = proxy
+        self.bucket = TokenBucket(rps, burst)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent or DEFAULT_USER_AGENT
+        self.session.headers.update(headers or {})
+        if proxy:
+            self.session.proxies = {"http": proxy, "https": proxy}
+        if source_address:
+            adapter = SourceAddressAdapter(source_address)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        self.health = 1.0
+        self.benched_until = 0.0
+        self.strikes = 0
+        self.counts = {"ok": 0, "throttled": 0, "error": 0, "benched": 0}
+
+    def summary(self):
+        return {"name": self.name, "health": round(self.health, 3), "benched": self.benched_until > time.monotonic(),
+                **self.counts}
+
+class EgressPool:
+    """
+    acquire() 挑選「預估等待時間 / 健康分數」最小的可用出口並預約 token；
+    report() 依結果更新健康分數，低於 BENCH_BELOW 即暫停，暫停期滿後以半健康狀態重新試用。
+    """
+    def __init__(self, egresses):
+        if not egresses:
+            raise ValueError("出口池至少需要一個出口")
+        self.egresses = list(egresses)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.egresses)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                ready = []
+                for e in self.egresses:
+                    if e.benched_until and e.benched_until <= now:
+                        # 冷卻期滿：以半健康狀態重新試用
+                        e.benched_until = 0.0
+                        e.health = max(e.health, 0.5)
+                    if not e.benched_until:
+                        ready.append(e)
+                if ready:
+                    chosen = min(ready, key=lambda e: (e.bucket.wait_estimate(now) + 0.01) / max(e.health, 0.05))
+                    delay = chosen.bucket.reserve()
+                else:
+                    chosen, delay = None, min(e.benched_until for e in self.egresses) - now
+            if chosen is not None:
+                if delay > 0: time.sleep(delay)
+                return chosen
+            # 全部出口都在冷卻中
+            time.sleep(max(0.05, delay))
+
+    def report(self, egress, status):
+        """status：HTTP 狀態碼 (200/404 視為正常)，或 "exc" 代表連線例外"""
+        with self._lock:
+            if status in (200, 404):
+                egress.counts["ok"] += 1
+                egress.strikes = 0
+                egress.health += (1 - egress.health) * SUCCESS_RECOVERY
+                return
+            if status == 429:
+                egress.counts["throttled"] += 1
+                egress.health *= THROTTLE_PENALTY
+            else:
+                egress.counts["error"] += 1
+                egress.health *= ERROR_PENALTY
+            if egress.health < BENCH_BELOW and not egress.benched_until:
+                egress.strikes += 1
+                egress.counts["benched"] += 1
+                egress.benched_until = time.monotonic() + min(MAX_BENCH_SECONDS, BENCH_SECONDS * 2 ** (egress.strikes - 1))
+
+    def summary(self):
+        return [e.summary() for e in self.egresses]
+
+# ========== 全域設定 ==========
+_POOL = None
+_LOADED = False
+_POOL_LOCK = threading.Lock()
+
+def load_profiles(spec=None):
+    """spec：JSON 字串、JSON 檔路徑或清單；未提供時依序讀取 STOCK_MONITOR_EGRESS、egress.json"""
+    if spec is None:
+        spec = os.getenv(EGRESS_ENV, "").strip() or (CONFIG_PATH if os.path.exists(CONFIG_PATH) else None)
+    if spec is None or isinstance(spec, list):
+        return spec or []
+    if spec.lstrip().startswith("["):
+        return json.loads(spec)
+    with open(spec, encoding="utf-8") as f:
+        return json.load(f)
+
+def configure(profiles):
+    """以設定清單 (dict) 建立全域出口池；傳入空清單則停用 (回到單一出口)"""
+    global _POOL, _LOADED
+    with _POOL_LOCK:
+        _POOL = EgressPool([Egress(**p) for p in profiles]) if profiles else None
+        _LOADED = True
+    return _POOL
+
+def pool():
+    """全域出口池 (首次呼叫時載入設定)；未設定時回傳 None"""
+    if not _LOADED:
+        configure(load_profiles())
+    return _POOL
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+清單端點的磁碟 HTTP 快取 (data/http_cache/)：證交所 ISIN 頁面、nasdaqlisted/otherlisted、
+港交所 secstkorder.xls 等每天都要抓的「全市場清單」。
+
+- 回應本體連同 ETag / Last-Modified 存檔，下次以條件式請求 (If-None-Match / If-Modified-Since)
+  重新驗證：伺服器回 304 時直接沿用本體，不必重新下載數 MB 的 HTML / Excel
+- 解析結果依「本體內容雜湊」另存 (parsed/<名稱>-<雜湊>.json)：清單沒有變動時連解析都略過
+- 網路失敗時退回上一次的本體 (清單通常只有零星變動，勝過退回寫死的備援名單)
+- 總容量超過 STOCK_MONITOR_HTTP_CACHE_MB (預設 64 MB) 時，依最近使用時間淘汰最舊的項目
+
+    python http_cache.py            # 列出快取內容與容量
+    python http_cache.py --clear
+"""
+import os
+import json
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "data", "http_cache")
+MAX_MB_ENV = "STOCK_MONITOR_HTTP_CACHE_MB"
+DEFAULT_MAX_MB = 64
+# 替身伺服器 (壓測) 的回應以此前綴另立快取鍵與解析結果名稱，不得覆蓋正式清單 (網路失敗時會退回快取本體)
+STANDIN_PREFIX = "standin:"
+
+class CachedResponse:
+    """與 requests.Response 相容的最小介面 (status_code / content / text / raise_for_status)"""
+    def __init__(self, url, status_code, content, encoding=None, content_hash=None, from_cache=False, stale=False,
+                 key=None):
+        self.url = url
+        self.key = key or url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.content_hash = content_hash or hashlib.sha256(content).hexdigest()
+        # from_cache：本體取自快取 (304 或網路失敗)；stale：網路失敗、未經重新驗證
+        self.from_cache = from_cache
+        self.stale = stale
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+def _max_bytes():
+    return float(os.getenv(MAX_MB_ENV, "") or DEFAULT_MAX_MB) * 1024 * 1024
+
+def _paths(url, root=None):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    base = os.path.join(root or CACHE_DIR, key)
+    return base + ".json", base + ".body"
+
+def _load_meta(url, root=None):
+    meta_path, body_path = _paths(url, root)
+    if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+def _write(path, data, mode="wb"):
+    tmp = path + ".tmp"
+    with open(tmp, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _touch(*paths):
+    for p in paths:
+        if os.path.exists(p): os.utime(p)
+
+def _cached(url, meta, root=None, stale=False):
+    meta_path, body_path = _paths(url, root)
+    with open(body_path, "rb") as f:
+        content = f.read()
+    _touch(meta_path, body_path)
+    return CachedResponse(url, 200, content, meta.get("encoding"), meta.get("content_hash"), from_cache=True, stale=stale,
+                          key=url)
+
+def fetch(url, getter=requests.get, root=None, key=None, **kwargs):
+    """
+    條件式 GET：getter(url, **kwargs) 為實際送出請求的函式 (datafeed.http_get 會再改寫替身網址並記錄統計)，
+    key 為快取鍵 (預設即 url)。回傳 CachedResponse；非 200/304 的回應原樣包裝 (不寫入快取)。
+    """
+    key = key or url
+    meta = _load_meta(key, root)
+    headers = dict(kwargs.pop("headers", None) or {})
+    if meta:
+        if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        resp = getter(url, headers=headers, **kwargs)
+    except requests.RequestException:
+        if meta:
+            return _cached(key, meta, root, stale=True)
+        raise
+    if resp.status_code == 304 and meta:
+        return _cached(key, meta, root)
+    if resp.status_code != 200:
+        if meta and resp.status_code >= 500:
+            return _cached(key, meta, root, stale=True)
+        return CachedResponse(url, resp.status_code, resp.content, resp.encoding, key=key)
+
+    encoding = resp.encoding or resp.apparent_encoding
+    content_hash = hashlib.sha256(resp.content).hexdigest()
+    meta_path, body_path = _paths(key, root)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    _write(body_path, resp.content)
+    _write(meta_path, json.dumps({
+        "url": key, "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified"),
+        "encoding": encoding, "content_hash": content_hash, "size": len(resp.content),
+        "fetched_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }, ensure_ascii=False), "w")
+    evict(root)
+    return CachedResponse(url, 200, resp.content, encoding, content_hash, key=key)
+
+# ========== 解析結果快取 ==========
+
+def _parsed_path(name, content_hash, root=None):
+    return os.path.join(root or CACHE_DIR, "parsed", f"{name}-{content_hash[:16]}.json")
+
+def parsed(name, resp, parse_fn, root=None):
+    """
+    以回應本體的內容雜湊快取 parse_fn() 的結果 (須可轉為 JSON，tuple 會變成 list)。
+    同名的舊雜湊結果在寫入新結果時刪除；空結果不快取 (通常代表解析失敗)。
+    替身回應 (快取鍵以 STANDIN_PREFIX 開頭) 的結果另以 standin- 名稱存放，不會刪除正式清單的解析結果。
+    """
+    if getattr(resp, "key", "").startswith(STANDIN_PREFIX):
+        name = f"standin-{name}"
+    path = _parsed_path(name, resp.content_hash, root)
+    if os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                result = json.load(f)
+            _touch(path)
+            return result
+        except ValueError:
+            pass
+    result = parse_fn()
+    if result:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for old in os.listdir(os.path.dirname(path)):
+            if old.startswith(f"{name}-") and old.endswith(".json") and old != os.path.basename(path):
+                os.remove(os.path.join(os.path.dirname(path), old))
+        _write(path, json.dumps(result, ensure_ascii=False), "w")
+        evict(root)
+    return result
+
+# ========== 容量管理 ==========
+
+def entries(root=None):
+    """[(最近使用時間, 位元組數, [檔案...]), ...]：回應本體與其中繼資料算同一項"""
+    root = root or CACHE_DIR
+    out = []
+    if os.path.isdir(root):
+        for f in os.listdir(root):
+            if not f.endswith(".json"): continue
+            files = [os.path.join(root, f), os.path.join(root, f[:-len(".json")] + ".body")]
+            files = [p for p in files if os.path.exists(p)]
+            out.append((max(os.path.getmtime(p) for p in files), sum(os.path.getsize(p) for p in files), files))
+    parsed_dir = os.path.join(root, "parsed")
+    if os.path.isdir(parsed_dir):
+        for f in os.listdir(parsed_dir):
+            p = os.path.join(parsed_dir, f)
+            out.append((os.path.getmtime(p), os.path.getsize(p), [p]))
+    return out
+
+def evict(root=None, max_bytes=None):
+    """總容量超過上限時由最久未使用的項目開始刪除，回傳刪除的項目數"""
+    max_bytes = _max_bytes() if max_bytes is None else max_bytes
+    items = sorted(entries(root))
+    total = sum(size for _, size, _ in items)
+    removed = 0
+    for _, size, files in items:
+        if total <= max_bytes: break
+        for p in files:
+            os.remove(p)
+        total -= size
+        removed += 1
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the on-disk HTTP cache for universe lists")
+    parser.add_argument("--clear", action="store_true", help="清空快取")
+    args = parser.parse_args()
+
+    if args.clear:
+        n = evict(max_bytes=0)
+        print(f"🧹 已清除 {n} 個快取項目")
+        return
+    for mtime, size, files in sorted(entries(), reverse=True):
+        label = files[0]
+        if label.endswith(".json") and os.path.dirname(label) == CACHE_DIR:
+            with open(label, encoding="utf-8") as f:
+                label = json.load(f).get("url", label)
+        print(f"{datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M} | {size / 1024:8.1f} KB | {label}")
+    total = sum(size for _, size, _ in entries())
+    print(f"📦 共 {total / 1024 / 1024:.2f} MB / 上限 {_max_bytes() / 1024 / 1024:.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+盤中模式：每隔固定秒數批次抓取即時報價，更新每檔各區間的最高/收盤/最低報酬與分布，
+分布明顯位移時寫入盤中快照 (data/<market>/snapshots/intraday_<日期>.jsonl) 並推播 Telegram。
+
+    python intraday.py --market tw-share --interval 60
+    STOCK_MONITOR_STANDIN=http://127.0.0.1:8765 python intraday.py --market tw-share --interval 2 --iterations 5 --ignore-hours
+
+基準收盤價與已收盤 K 線的區間極值每日只算一次 (ReferenceState)；盤中每筆報價只移動該檔所在的分箱，
+不重掃全市場。
+"""
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+import analyzer
+import datafeed
+import notifier
+import snapshot_store
+import trading_calendar
+
+POLL_SECONDS = 60
+QUOTE_BATCH = 200
+# 分布位移門檻 (百分點)：上漲佔比或強勢區佔比相對上次發布的快照變動超過即發布並推播
+SHIFT_POINTS = 5.0
+ALERT_METRICS = snapshot_store.TREND_METRICS
+
+def log(msg: str):
+    print(f"{datetime.now():%H:%M:%S}: {msg}")
+
+def quote_symbol(market_id, ticker):
+    """CSV 檔名代號 -> 報價代號 (A 股檔名只有六位數代碼)"""
+    if market_id == "cn-share":
+        return f"{ticker}.SS" if ticker.startswith("6") else f"{ticker}.SZ"
+    return ticker
+
+# ========== 每日基準 (開盤前算一次) ==========
+
+class ReferenceState:
+    """
+    以「今日為最新一根 K 線」預先算好各區間的基準收盤價 close[-(days+1)]，
+    以及視窗內已收盤 K 線的最高/最低價；盤中報酬 = (max(已收盤極值, 當日高/低) 或 最新價) 對基準價的漲跌幅。
+    """
+    def __init__(self, market_id, today, periods=None, data_root="./data"):
+        self.market_id = market_id
+        self.today = today
+        self.periods = periods or analyzer.PERIODS
+        self.tickers, self.names, rows = [], [], []
+        cutoff = today.isoformat()
+        for f in analyzer.market_files(market_id, data_root):
+            try:
+                df = pd.read_csv(f, usecols=lambda c: c.lower() in ("date", "close", "high", "low"))
+            except Exception:
+                continue
+            df.columns = [c.lower() for c in df.columns]
+            if "date" not in df.columns: continue
+            # 今日若已寫入 (盤中的半根 K 線)，改由即時報價取代
+            dates = df["date"].astype(str).str[:10].values
+            keep = dates < cutoff
+            if keep.sum() < analyzer.MIN_BARS: continue
+            tkr, nm = analyzer.parse_ticker_name(f.name.replace(".csv", ""), market_id)
+            self.tickers.append(tkr)
+            self.names.append(nm)
+            rows.append(self._reference(df["close"].values[keep].astype(float), df["high"].values[keep].astype(float),
+                                        df["low"].values[keep].astype(float), dates[keep]))
+        self.symbols = [quote_symbol(market_id, t) for t in self.tickers]
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        # 各區間的 (標的數,) 陣列；該檔 K 線不足的區間為 NaN
+        self.base, self.hmax, self.lmin = {}, {}, {}
+        for p_name, _, _ in self.periods:
+            vals = np.array([r.get(p_name, (np.nan, np.nan, np.nan)) for r in rows], dtype=float).reshape(-1, 3)
+            self.base[p_name], self.hmax[p_name], self.lmin[p_name] = vals[:, 0], vals[:, 1], vals[:, 2]
+
+    def _reference(self, close, high, low, dates):
+        """與 analyzer.compute_returns 相同的區間定義，只是最後一根 K 線 (今日) 尚未出現"""
+        n = len(close)
+        suffix_max = np.fmax.accumulate(high[::-1])
+        suffix_min = np.fmin.accumulate(low[::-1])
+        out = {}
+        for p_name, _, days in self.periods:
+            # 週 K / 月 K 根數型區間的盤中變化可忽略，不納入即時分布
+            if analyzer.bar_period(days): continue
+            if days == "ytd":
+                # 今年已收盤的 K 線數 + 今日
+                days = n - int(np.searchsorted(dates, f"{self.today.year}-")) + 1
+            if n < days: continue
+            prev = close[-days]
+            if not prev > 0: continue
+            k = days - 1
+            out[p_name] = (prev, suffix_max[k - 1] if k else np.nan, suffix_min[k - 1] if k else np.nan)
+        return out
+
+# ========== 即時分布 ==========
+
+class LiveBreadth:
+    """
+    每個指標保留每檔目前的報酬與一個 OnlineHistogram；報價更新時只對數值有變動的標的
+    從舊分箱 remove、加入新分箱 (每檔 O(1))，不重算全市場。
+    """
+    def __init__(self, ref, edges=analyzer.PLOT_BINS):
+        self.ref = ref
+        self.edges = np.asarray(edges, dtype=float)
+        self.columns = [f"{p[0]}_{t[0]}" for p in ref.periods for t in analyzer.RETURN_TYPES]
+        n = len(ref.tickers)
+        self.values = {c: np.full(n, np.nan) for c in self.columns}
+        self.hists = {c: analyzer.OnlineHistogram(self.edges) for c in self.columns}
+        self.quoted = np.zeros(n, dtype=bool)
+
+    def update(self, quotes):
+        """quotes 為 datafeed.quotes 的結果；回傳本批對應到的標的數"""
+        idx = np.array([self.ref.index[s] for s in quotes.index if s in self.ref.index], dtype=int)
+        if not len(idx): return 0
+        q = quotes.loc[[self.ref.symbols[i] for i in idx]]
+        price, high, low = q["price"].values, q["high"].values, q["low"].values
+        self.quoted[idx] = True
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for p_name, _, _ in self.ref.periods:
+                base = self.ref.base[p_name][idx]
+                new = {
+                    "High": (np.fmax(self.ref.hmax[p_name][idx], high) - base) / base * 100,
+                    "Close": (price - base) / base * 100,
+                    "Low": (np.fmin(self.ref.lmin[p_name][idx], low) - base) / base * 100,
+                }
+                for r_type, values in new.items():
+                    col = f"{p_name}_{r_type}"
+                    old = self.values[col][idx]
+                    moved = ~((old == values) | (np.isnan(old) & np.isnan(values)))
+                    if not moved.any(): continue
+                    self.hists[col].remove(old[moved])
+                    self.hists[col].add(values[moved])
+                    self.values[col][idx[moved]] = values[moved]
+        return len(idx)
+
+    def snapshot(self, extreme_floor=100.0):
+        """與每日快照相同格式 (分位數為分箱估計值)，另加盤中時間"""
+        metrics = {c: h.summary() for c, h in self.hists.items() if h.n}
+        extremes = {}
+        for col in self.columns:
+            if not col.endswith("_High"): continue
+            hit = np.nonzero(self.values[col] >= extreme_floor)[0]
+            if len(hit):
+                hit = hit[np.argsort(-self.values[col][hit])]
+                extremes[col[:-len("_High")]] = [[self.ref.tickers[i], round(float(self.values[col][i]), 1)] for i in hit]
+        return {
+            "date": self.ref.today.isoformat(), "time": datetime.now().strftime("%H:%M:%S"),
+            "market": self.ref.market_id, "created_at": datetime.now().isoformat(timespec="seconds"),
+            "n_tickers": int(self.quoted.sum()), "bin_edges": self.edges.tolist(),
+            "metrics": metrics, "extremes": extremes, "source": "intraday",
+        }
+
+def distribution_shift(prev, cur, metrics=ALERT_METRICS, points=SHIFT_POINTS):
+    """比較兩份快照，回傳超過門檻的位移說明 (空清單代表沒有明顯位移)"""
+    lines = []
+    for name in metrics:
+        a, b = prev["metrics"].get(name), cur["metrics"].get(name)
+        if not a or not b: continue
+        d_up = b["up_share"] - a["up_share"]
+        top_a = snapshot_store.top_share(a, prev["bin_edges"])
+        top_b = snapshot_store.top_share(b, cur["bin_edges"])
+        if abs(d_up) >= points or abs(top_b - top_a) >= points:
+            lines.append(f"{name}: 上漲 {a['up_share']:.1f}% → {b['up_share']:.1f}% ({d_up:+.1f}) | "
+                         f"強勢區 {top_a:.1f}% → {top_b:.1f}% ({top_b - top_a:+.1f})")
+    return lines
+
+# ========== 輪詢主迴圈 ==========
+
+def poll_once(live, batch=QUOTE_BATCH):
+    """依批次抓取全部代號的報價並更新分布，回傳 (更新檔數, 失敗批次數)"""
+    updated, failed = 0, 0
+    symbols = live.ref.symbols
+    for lo in range(0, len(symbols), batch):
+        try:
+            updated += live.update(datafeed.quotes(symbols[lo:lo + batch]))
+        except Exception as e:
+            failed += 1
+            log(f"⚠️ 報價批次 {lo // batch + 1} 失敗: {e}")
+    return updated, failed
+
+def run_intraday(market_id, interval=POLL_SECONDS, batch=QUOTE_BATCH, iterations=0, ignore_hours=False,
+                 data_root="./data", periods=None, points=SHIFT_POINTS, notify=True):
+    today = trading_calendar.local_today(market_id)
+    if not ignore_hours and not trading_calendar.is_trading_day(market_id, today):
+        log(f"😴 {market_id} 今日 ({today}) 休市，盤中模式結束。")
+        return None
+
+    t0 = time.perf_counter()
+    ref = ReferenceState(market_id, today, periods, data_root)
+    if not ref.tickers:
+        log(f"⚠️ 找不到 {market_id} 的 CSV 數據檔案。")
+        return None
+    live = LiveBreadth(ref)
+    log(f"📐 {market_id} 基準建立完成：{len(ref.tickers)} 檔，耗時 {time.perf_counter() - t0:.1f}s")
+
+    out_name = f"intraday_{today.isoformat()}.jsonl"
+    agent = notifier.StockNotifier() if notify else None
+    published, polls = None, 0
+    while True:
+        if not ignore_hours and not trading_calendar.is_session_open(market_id):
+            if datetime.now(trading_calendar.market_tz(market_id)) >= trading_calendar.session_close(market_id, today):
+                log("🔔 已收盤，盤中模式結束。")
+                break
+            time.sleep(interval)
+            continue
+
+        started = time.perf_counter()
+        updated, failed = poll_once(live, batch)
+        snap = live.snapshot()
+        shift = distribution_shift(published, snap, points=points) if published else []
+        if published is None or shift:
+            snapshot_store.append_snapshots(market_id, [snap], data_root, out_name)
+            published = snap
+        if shift:
+            log("📣 分布位移:\n  " + "\n  ".join(shift))
+            if agent:
+                agent.send_telegram(f"📈 <b>{market_id.upper()} 盤中分布位移</b>\n" + "\n".join(shift))
+        polls += 1
+        log(f"⏱️ 第 {polls} 輪：更新 {updated} 檔 | 失敗批次 {failed} | 耗時 {time.perf_counter() - started:.2f}s")
+        if iterations and polls >= iterations:
+            break
+        time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+    return live
+
+def main():
+    parser = argparse.ArgumentParser(description="Intraday breadth monitor with incremental histograms")
+    parser.add_argument("--market", default="tw-share", choices=list(trading_calendar.MARKETS))
+    parser.add_argument("--interval", type=float, default=POLL_SECONDS, help="輪詢間隔 (秒)")
+    parser.add_argument("--batch", type=int, default=QUOTE_BATCH, help="每次報價請求的代號數")
+    parser.add_argument("--iterations", type=int, default=0, help="輪詢次數上限 (0 = 直到收盤)")
+    parser.add_argument("--shift-points", type=float, default=SHIFT_POINTS, help="觸發快照/推播的位移門檻 (百分點)")
+    parser.add_argument("--periods", default=None, help="同 main.py --periods")
+    parser.add_argument("--data-root", default="./data")
+    parser.add_argument("--ignore-hours", action="store_true", help="不檢查交易時段 (搭配替身伺服器測試)")
+    parser.add_argument("--no-notify", action="store_true", help="只寫快照，不推播 Telegram")
+    args = parser.parse_args()
+
+    periods = analyzer.parse_periods(args.periods) if args.periods else None
+    run_intraday(args.market, args.interval, args.batch, args.iterations, args.ignore_hours,
+                 args.data_root, periods, args.shift_points, not args.no_notify)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import time
 import argparse
 import traceback
@@ -13,47 +14,72 @@ import downloader_cn
 import downloader_jp
 import downloader_kr
 import analyzer
+import breakout_alerts
+import catalog
+import data_snapshot
 import notifier
+import profiler
+import scheduler
+import sharding
+import snapshot_store
+import subscriptions
+import trading_calendar
 
-def run_market_pipeline(market_id, market_name, emoji):
+# 市場配置表
+MARKETS_CONFIG = {
+    "tw-share": {"name": "台灣股市", "emoji": "🇹🇼"},
+    # "hk-share": {"name": "香港股市", "emoji": "🇭🇰"},
+    # "cn-share": {"name": "中國股市", "emoji": "🇨🇳"},
+    # "jp-share": {"name": "日本股市", "emoji": "🇯🇵"},
+    # "kr-share": {"name": "韓國股市", "emoji": "🇰🇷"},
+    # "us-share": {"name": "美國股市", "emoji": "🇺🇸"}
+}
+
+def download_market(market_id, market_name, retry_failed=False, shard=None):
     """
-    執行單一市場的完整管線：下載 -> 分析 -> 寄信
+    Step 1：呼叫該市場的下載器並輸出下載報告，回傳下載統計 (未知市場回傳 None)。
+    常駐服務 (service.py) 每個新交易日也經由此函式更新 K 線
     """
-    print("\n" + "="*60)
-    print(f"{emoji} 啟動管線：{market_name} ({market_id})")
-    print("="*60)
-
     # 初始化統計變數，預設為 0
     stats = {"total": 0, "success": 0, "fail": 0}
-    
-    # 建立通知器實例 (用於發送 Telegram 與 Resend 郵件)
-    agent = notifier.StockNotifier()
 
-    # --- Step 1: 數據獲取 ---
     print(f"【Step 1: 數據獲取】正在更新 {market_name} 原始 K 線資料...")
     try:
         res = None
         # 根據市場 ID 呼叫對應的下載器主函數
         if market_id == "tw-share":
-            res = downloader_tw.main()
+            res = downloader_tw.main(retry_failed=retry_failed, shard=shard)
         elif market_id == "us-share":
-            res = downloader_us.main()
+            res = downloader_us.main(retry_failed=retry_failed, shard=shard)
         elif market_id == "hk-share":
-            res = downloader_hk.main()
+            res = downloader_hk.run_sync(mode='hot', retry_failed=retry_failed, shard=shard)
         elif market_id == "cn-share":
-            res = downloader_cn.main()
+            res = downloader_cn.main(retry_failed=retry_failed, shard=shard)
         elif market_id == "jp-share":
-            res = downloader_jp.main()
+            res = downloader_jp.run_sync(mode='hot', retry_failed=retry_failed, shard=shard)
         elif market_id == "kr-share":
-            res = downloader_kr.main()
+            res = downloader_kr.main(retry_failed=retry_failed, shard=shard)
         else:
             print(f"⚠️ 未知的市場 ID: {market_id}")
-            return
+            return None
 
         # ✨ 數據標準化：對接新版下載器的 return 字典
         if isinstance(res, dict):
             stats = res
             print(f"📊 [下載報告] 總計: {stats.get('total', 0)} | 成功: {stats.get('success', 0)} | 失敗: {stats.get('fail', 0)}")
+            if stats.get('skipped'):
+                print(f"⏳ 時間預算用盡，略過 {stats['skipped']} 檔低優先標的 (未寫入續跑清單，下次執行會優先補抓)")
+            if stats.get('negative_cached') or stats.get('reinstated'):
+                print(f"🧊 負快取略過 {stats.get('negative_cached', 0)} 檔連續無資料的標的 | 本輪恢復 {stats.get('reinstated', 0)} 檔 "
+                      f"(python negative_cache.py --market {market_id} 查看明細)")
+            if stats.get('fail', 0):
+                # 失敗原因由資料目錄查詢 (每檔最後一次下載狀態)，不必翻找日誌
+                failures = catalog.for_market(market_id).failures()
+                for tkr, status, error, at in failures[:10]:
+                    print(f"   ❌ {tkr} [{status}] {(error or '')[:80]} ({at})")
+                if len(failures) > 10:
+                    print(f"   ... 其餘 {len(failures) - 10} 檔請執行 python catalog.py stats --market {market_id}")
+                print(f"💡 失敗標的已記錄於今日續跑清單，可執行 python main.py --market {market_id} --retry-failed 只重抓失敗部分")
         elif res is not None and hasattr(res, '__len__'):
             # 相容舊版回傳 List 的格式
             stats = {"total": len(res), "success": len(res), "fail": 0}
@@ -64,11 +90,50 @@ def run_market_pipeline(market_id, market_name, emoji):
     except Exception as e:
         print(f"❌ {market_name} 數據下載過程發生嚴重異常: {e}")
 
+    return stats
+
+def run_market_pipeline(market_id, market_name, emoji, retry_failed=False, force=False, periods=None, shard=None):
+    """
+    執行單一市場的完整管線：下載 -> 分析 -> 寄信
+    shard=(i, N) 時只下載並彙整本分片，寫出部分結果後結束 (由 run_merge_pipeline 合併寄信)
+    """
+    print("\n" + "="*60)
+    print(f"{emoji} 啟動管線：{market_name} ({market_id})")
+    print("="*60)
+
+    # --- Step 0: 交易日曆 ---
+    # 排程固定在平日觸發，遇到休市日或同一交易日重跑時直接結束，避免數千次無效抓取
+    session = trading_calendar.latest_completed_session(market_id)
+    if not (force or retry_failed) and not trading_calendar.has_new_session(market_id):
+        print(f"😴 {market_name} 最近已收盤交易日 {session} 已處理過 (休市或重複排程)，略過本次管線。加上 --force 可強制執行。")
+        return
+    print(f"📅 {market_name} 最近已收盤交易日: {session}")
+
+    # 建立通知器實例 (用於發送 Telegram 與 Resend 郵件)
+    agent = notifier.StockNotifier()
+
+    # --- Step 1: 數據獲取 ---
+    stats = download_market(market_id, market_name, retry_failed, shard)
+    if stats is None:
+        return
+
+    if shard is not None:
+        # --- 分片模式：只彙整本分片並寫出部分結果，不繪圖、不寄信 ---
+        print(f"\n【Step 2: 分片彙整】{market_name} 分片 {shard[0]}/{shard[1]}...")
+        try:
+            agg = analyzer.run_partial_analysis(market_id, shard, periods=periods)
+            out = sharding.save_partial(agg, market_id, session, shard, periods, stats)
+            print(f"✅ 分片 {shard[0]}/{shard[1]} 完成：{len(agg.tickers)} 檔，部分結果已寫入 {out}")
+            print(f"💡 所有分片完成後執行 python main.py --market {market_id} --merge {shard[1]} 合併並寄送報告")
+        except Exception as e:
+            print(f"❌ {market_name} 分片彙整出錯:\n{traceback.format_exc()}")
+        return
+
     # --- Step 2: 數據分析 & 繪圖 ---
     print(f"\n【Step 2: 矩陣分析】正在計算 {market_name} 動能分布並生成圖表...")
     try:
         # 呼叫分析核心，這會產生 9 張矩陣圖與報酬報表
-        img_paths, report_df, text_reports = analyzer.run_global_analysis(market_id=market_id)
+        img_paths, report_df, text_reports = analyzer.run_global_analysis(market_id=market_id, periods=periods)
         
         if report_df is None or report_df.empty:
             print(f"⚠️ {market_name} 分析結果為空 (可能是 CSV 資料不足)，跳過寄信步驟。")
@@ -80,27 +145,131 @@ def run_market_pipeline(market_id, market_name, emoji):
         print(f"\n【Step 3: 報表發送】正在透過 Resend 傳送郵件...")
         
         # 將下載統計 (stats) 與分析結果一併送出
-        success_sent = agent.send_stock_report(
-            market_name=market_name,
-            img_data=img_paths,
-            report_df=report_df,
-            text_reports=text_reports,
-            stats=stats
-        )
-        
-        if success_sent:
-            print(f"✅ {market_name} 監控報告已成功寄達！")
-        else:
-            print(f"❌ {market_name} 報告寄送失敗 (請檢查 API Key 或日誌)。")
+        send_report(agent, market_id, market_name, session, img_paths, report_df, text_reports, stats)
 
     except Exception as e:
         print(f"❌ {market_name} 分析或寄信過程出錯:\n{traceback.format_exc()}")
 
+def send_report(agent, market_id, market_name, session, img_paths, report_df, text_reports, stats, extras=True):
+    """寄出主報表；extras=False 時只重寄郵件，不再發送 Telegram 警示與訂閱報表 (常駐服務重試寄信)"""
+    trend_text = snapshot_store.trend_text(market_id)
+    # 52 週新高 / 新低警示 (分析階段已寫入 results/breakouts_<交易日>.json)
+    breakouts = breakout_alerts.load_results(market_id, session)
+    alerts_html = breakout_alerts.report_html(breakouts)
+    success_sent = agent.send_stock_report(
+        market_name=market_name,
+        img_data=img_paths,
+        report_df=report_df,
+        text_reports=text_reports,
+        stats=stats,
+        trend_text=trend_text,
+        extra_html=alerts_html
+    )
+    fanned = 0
+    alert_text = breakout_alerts.telegram_text(market_name, breakouts) if extras else None
+    if alert_text:
+        agent.send_telegram(alert_text)
+
+    # 訂閱者的個人化報表：共用同一次分析結果與圖檔，只做子集查詢與組裝
+    try:
+        if extras:
+            fanned = subscriptions.fan_out(agent, market_id, market_name, img_paths, report_df, text_reports, stats,
+                                           trend_text, extra_html=alerts_html)
+    except Exception as e:
+        print(f"❌ {market_name} 訂閱報表分送出錯: {e}")
+    # 只有訂閱者、未設定 REPORT_RECEIVER_EMAIL 時，任一封送達即視為本交易日已處理
+    success_sent = success_sent or (fanned > 0 and not agent.receiver_email)
+    
+    if success_sent:
+        trading_calendar.mark_session_processed(market_id, session)
+        print(f"✅ {market_name} 監控報告已成功寄達！")
+    else:
+        print(f"❌ {market_name} 報告寄送失敗 (請檢查 API Key 或日誌)。")
+    return success_sent
+
+def run_merge_pipeline(market_id, market_name, emoji, shard_count, force=False):
+    """
+    合併步驟：讀取各分片的部分結果 -> 加總分箱家數、串接報表欄位 -> 繪圖 -> 寄出單一報告
+    """
+    print("\n" + "="*60)
+    print(f"{emoji} 合併分片：{market_name} ({market_id}) x {shard_count}")
+    print("="*60)
+
+    session = trading_calendar.latest_completed_session(market_id)
+    if not force and not trading_calendar.has_new_session(market_id):
+        print(f"😴 {market_name} 最近已收盤交易日 {session} 已處理過，略過合併。加上 --force 可強制執行。")
+        return
+
+    parts, missing = sharding.load_partials(market_id, session, shard_count)
+    if not parts:
+        print(f"⚠️ {market_name} {session} 沒有任何分片的部分結果，跳過寄信步驟。")
+        return
+    if missing:
+        print(f"⚠️ 缺少分片 {missing} 的部分結果，報告只涵蓋 {len(parts)}/{shard_count} 個分片。")
+
+    try:
+        agg, periods = analyzer.merge_partials(parts)
+        stats = sharding.merge_stats(parts)
+        print(f"📊 [下載報告] 總計: {stats['total']} | 成功: {stats['success']} | 失敗: {stats['fail']}")
+        img_paths, report_df, text_reports = analyzer.publish_analysis(agg, market_id, periods=periods)
+        if report_df is None or report_df.empty:
+            print(f"⚠️ {market_name} 合併結果為空，跳過寄信步驟。")
+            return
+        print(f"✅ 合併完成！共 {len(report_df)} 檔有效數據。")
+
+        print(f"\n【Step 3: 報表發送】正在透過 Resend 傳送郵件...")
+        send_report(notifier.StockNotifier(), market_id, market_name, session, img_paths, report_df, text_reports, stats)
+    except Exception as e:
+        print(f"❌ {market_name} 合併或寄信過程出錯:\n{traceback.format_exc()}")
+
+def run_profiled_pipeline(market_id, market_name, emoji, profile=False, retry_failed=False, force=False, periods=None,
+                          shard=None):
+    """
+    包裝 run_market_pipeline：啟用 --profile 時為各階段產出 pstats 與 collapsed stack
+    """
+    if not profile:
+        return run_market_pipeline(market_id, market_name, emoji, retry_failed, force, periods, shard)
+
+    profiler.start(market_id)
+    try:
+        return run_market_pipeline(market_id, market_name, emoji, retry_failed, force, periods, shard)
+    finally:
+        out_dir = profiler.stop()
+        print(f"🔬 {market_name} 效能剖析已輸出至: {out_dir}")
+
 def main():
+    # 資料庫封存檔 (冷啟動還原)：python main.py snapshot export|import|inspect --market tw-share
+    if len(sys.argv) > 1 and sys.argv[1] == "snapshot":
+        return data_snapshot.main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description="Global Stock Monitor Orchestrator")
     parser.add_argument('--market', type=str, default='all', 
                         choices=['tw-share', 'us-share', 'hk-share', 'cn-share', 'jp-share', 'kr-share', 'all'])
+    parser.add_argument('--profile', action='store_true',
+                        help='逐階段剖析效能，輸出至 output/profiles/<market>/<date>/')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='只重抓今日續跑清單中 error/empty 的標的')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略交易日曆，即使沒有新的已收盤交易日也執行完整管線')
+    parser.add_argument('--periods', type=str, default=None,
+                        help='自訂分析區間，如 Week,Month,Quarter,YTD,D90:90,Y3:36M (36M/104W 以月K/週K根數計算；預設週/月/年繪圖，季/半年/YTD 僅計算)')
+    parser.add_argument('--max-memory-mb', type=float, default=None,
+                        help='分析階段的記憶體上限 (MB)，以串流分批彙整控制峰值 (同 STOCK_MONITOR_MAX_MEMORY_MB)')
+    parser.add_argument('--time-budget', type=float, default=None, metavar='MIN',
+                        help='每個市場下載階段的時間預算 (分鐘)，依優先順序下載、截止前停止 (同 STOCK_MONITOR_TIME_BUDGET)')
+    parser.add_argument('--shard', type=str, default=None,
+                        help='分片模式 i/N：依代號穩定雜湊只處理第 i 片 (共 N 片)，寫出部分結果後結束')
+    parser.add_argument('--merge', type=int, default=None, metavar='N',
+                        help='合併 N 個分片的部分結果，繪圖並寄出單一報告 (不下載)')
     args = parser.parse_args()
+    if args.shard and args.merge:
+        parser.error("--shard 與 --merge 不可同時使用")
+    shard = sharding.parse_shard(args.shard) if args.shard else None
+    if args.max_memory_mb:
+        os.environ[analyzer.MAX_MEMORY_ENV] = str(args.max_memory_mb)
+    if args.time_budget:
+        os.environ[scheduler.TIME_BUDGET_ENV] = str(args.time_budget)
+    periods = analyzer.parse_periods(args.periods) if args.periods else None
 
     start_time = time.time()
     
@@ -114,25 +283,21 @@ def main():
     print(f"🚀 執行目標: {args.market}")
     print("🚀 " + "="*55 + "\n")
 
-    # 市場配置表
-    markets_config = {
-        "tw-share": {"name": "台灣股市", "emoji": "🇹🇼"},
-        # "hk-share": {"name": "香港股市", "emoji": "🇭🇰"},
-        # "cn-share": {"name": "中國股市", "emoji": "🇨🇳"},
-        # "jp-share": {"name": "日本股市", "emoji": "🇯🇵"},
-        # "kr-share": {"name": "韓國股市", "emoji": "🇰🇷"},
-        # "us-share": {"name": "美國股市", "emoji": "🇺🇸"}
-    }
+    def run(m_id, m_info):
+        if args.merge:
+            return run_merge_pipeline(m_id, m_info["name"], m_info["emoji"], args.merge, args.force)
+        return run_profiled_pipeline(m_id, m_info["name"], m_info["emoji"], args.profile, args.retry_failed,
+                                     args.force, periods, shard)
 
     if args.market == 'all':
         # 依序執行所有市場
-        for m_id, m_info in markets_config.items():
-            run_market_pipeline(m_id, m_info["name"], m_info["emoji"])
+        for m_id, m_info in MARKETS_CONFIG.items():
+            run(m_id, m_info)
     else:
         # 執行指定市場
-        m_info = markets_config.get(args.market)
+        m_info = MARKETS_CONFIG.get(args.market)
         if m_info:
-            run_market_pipeline(args.market, m_info["name"], m_info["emoji"])
+            run(args.market, m_info)
         else:
             print(f"❌ 找不到對應的市場配置: {args.market}")
 
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+負快取：連續抓不到資料 (empty / error) 的標的 (下市、代號後綴對應錯誤、停牌) 不再每天全額重試。
+資料目錄 (catalog) 記錄每檔連續失敗的交易日數 misses 與最後一次下載時間 fetched_at，
+連續失敗兩天以上時，下次探測日 = 最後一次下載日 + min(MAX_TTL_DAYS, BASE_TTL_DAYS * 2^(misses-1)) 天：
+
+    misses  1  2  3  4  5   6+
+    間隔    -  2  4  8  16  30 天
+
+第一次失敗不略過 (可能只是暫時性錯誤，同日續跑與隔天照常重試)；任何一次抓到資料即歸零並恢復每日下載。
+--retry-failed 不受負快取限制。
+
+    python negative_cache.py --market tw-share      # 列出目前被略過的標的與下次探測日
+"""
+import argparse
+from datetime import datetime, timedelta
+
+import catalog
+
+BASE_TTL_DAYS = 1
+MAX_TTL_DAYS = 30
+# 下載報告中列出的略過標的數
+LOG_LIMIT = 10
+
+def ttl_days(misses):
+    if not misses or misses < 2:
+        return 0
+    return min(MAX_TTL_DAYS, BASE_TTL_DAYS * 2 ** (int(misses) - 1))
+
+def retry_after(row):
+    """目錄列的下次探測日 (UTC 日期)；未被負快取時回傳 None"""
+    if not row or not ttl_days(row.get("misses")) or not row.get("fetched_at"):
+        return None
+    return datetime.fromisoformat(row["fetched_at"]).date() + timedelta(days=ttl_days(row["misses"]))
+
+def is_cached(row, today=None):
+    after = retry_after(row)
+    return after is not None and (today or catalog.utc_today()) < after
+
+def split(cat, items, key_fn, enabled=True, today=None):
+    """把待辦清單分成 (負快取中略過, 需要下載)；enabled=False 時 (--retry-failed) 全部保留"""
+    cat.reinstated.clear()
+    if not enabled:
+        return [], list(items)
+    today = today or catalog.utc_today()
+    cached, todo = [], []
+    for it in items:
+        (cached if is_cached(cat.rows.get(key_fn(it)), today) else todo).append(it)
+    return cached, todo
+
+def stats(cat, cached):
+    """併入下載統計 (main.py 印出、notifier 寫進報告)"""
+    return {"negative_cached": len(cached), "reinstated": len(cat.reinstated)}
+
+def describe(cached, key_fn, log):
+    """下載前的負快取摘要"""
+    if not cached:
+        return
+    keys = [key_fn(it) for it in cached]
+    more = f" ... 等 {len(keys)} 檔" if len(keys) > LOG_LIMIT else ""
+    log(f"🧊 負快取略過 {len(keys)} 檔連續無資料的標的: {', '.join(keys[:LOG_LIMIT])}{more}")
+
+def entries(cat, today=None):
+    """目前被略過的標的 [(代號, 連續失敗次數, 下次探測日, 最後錯誤), ...]，依下次探測日排序"""
+    today = today or catalog.utc_today()
+    rows = [r for r in cat.rows.values() if is_cached(r, today)]
+    return sorted(((r["ticker"], r["misses"], retry_after(r).isoformat(), r.get("last_error")) for r in rows),
+                  key=lambda e: (e[2], e[0]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the negative cache of repeatedly empty tickers")
+    parser.add_argument("--market", default="tw-share", choices=catalog.MARKET_IDS)
+    parser.add_argument("--data-root", default=catalog.DATA_ROOT)
+    args = parser.parse_args()
+
+    rows = entries(catalog.for_market(args.market, args.data_root))
+    for ticker, misses, after, error in rows:
+        print(f"{ticker} | 連續失敗 {misses} 日 | 下次探測 {after} | {(error or '')[:80]}")
+    print(f"🧊 {args.market} 負快取中共 {len(rows)} 檔")
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import os
 import requests
 import resend
 import pandas as pd
+import profiler
+from analyzer import period_label
 from datetime import datetime, timedelta
 
 class StockNotifier:
@@ -31,14 +33,8 @@ class StockNotifier:
             return True
         except: return False
 
-    def send_stock_report(self, market_name, img_data, report_df, text_reports, stats=None):
-        """🚀 專業版：寄送 HTML 報表"""
-        print(f"DEBUG: notifier 正在處理 {market_name} 報告 (Stats: {stats})")
-
-        if not self.resend_api_key:
-            print("⚠️ 缺少 Resend API Key，無法寄信。 সন")
-            return False
-
+    def build_report_html(self, market_name, img_data, report_df, text_reports, stats=None, trend_text="", extra_html=""):
+        """組裝 HTML 報表內容，回傳 (html, 覆蓋率字串, 報表時間)；extra_html 為訂閱者專屬區塊"""
         report_time = self.get_now_time_str()
         if stats is None: stats = {}
         total_count = stats.get('total', len(report_df))
@@ -73,6 +69,20 @@ class StockNotifier:
                 <p>💡 提示：可至 <a href="{p_url}" target="_blank">{p_name}</a> 查看即時技術線圖。</p>
         """
 
+        if stats.get('negative_cached') or stats.get('reinstated'):
+            html_content += f"""
+                <p style="color: #636e72; font-size: 13px;">🧊 負快取：略過 <b>{stats.get('negative_cached', 0)}</b> 檔連續無資料的標的 (下市/停牌/代號錯誤，依指數退避重新探測)，
+                本次恢復 <b>{stats.get('reinstated', 0)}</b> 檔。</p>"""
+
+        html_content += extra_html
+
+        if trend_text:
+            html_content += f"""
+            <div style="margin-bottom: 30px;">
+                <h4 style="color: #8e44ad;">📈 分布日變化與趨勢</h4>
+                <pre style="background-color: #f4f1f8; color: #2d3436; padding: 15px; font-size: 12px; white-space: pre-wrap;">{trend_text}</pre>
+            </div>"""
+
         for img in img_data:
             html_content += f"""
             <div style="margin-bottom: 40px; text-align: center;">
@@ -81,7 +91,7 @@ class StockNotifier:
             </div>"""
 
         for period, report in text_reports.items():
-            p_zh = {"Week": "週", "Month": "月", "Year": "年"}.get(period, period)
+            p_zh = period_label(period)
             html_content += f"""
             <div style="margin-bottom: 20px;">
                 <h4 style="color: #16a085;">📊 {p_zh} K線報酬分布明細</h4>
@@ -89,12 +99,49 @@ class StockNotifier:
             </div>"""
 
         html_content += "</div></body></html>"
+        return html_content, success_rate, report_time
 
+    def build_attachments(self, img_data):
+        """將圖檔轉為 Resend 內嵌附件 (cid)"""
         attachments = []
         for img in img_data:
             if os.path.exists(img['path']):
                 with open(img['path'], "rb") as f:
                     attachments.append({"content": list(f.read()), "filename": f"{img['id']}.png", "content_id": img['id'], "disposition": "inline"})
+        return attachments
+
+    def send_batch(self, messages):
+        """
+        寄出多封已組好的郵件 ({to, subject, html, attachments})，回傳成功封數。
+        Resend 的批次端點不支援附件 (內嵌圖)，因此逐封送出；附件內容由呼叫端預先編碼、共用。
+        """
+        if not messages:
+            return 0
+        if not self.resend_api_key:
+            print("⚠️ 缺少 Resend API Key，無法寄送訂閱報表。")
+            return 0
+        sent = 0
+        for msg in messages:
+            try:
+                resend.Emails.send({"from": "StockMonitor <onboarding@resend.dev>", "to": str(msg["to"]),
+                                    "subject": msg["subject"], "html": msg["html"], "attachments": msg["attachments"]})
+                sent += 1
+            except Exception as e:
+                print(f"❌ 訂閱報表寄送失敗 ({msg['to']}): {e}")
+        print(f"✅ 訂閱報表已寄送 {sent}/{len(messages)} 封")
+        return sent
+
+    def send_stock_report(self, market_name, img_data, report_df, text_reports, stats=None, trend_text="", extra_html=""):
+        """🚀 專業版：寄送 HTML 報表"""
+        print(f"DEBUG: notifier 正在處理 {market_name} 報告 (Stats: {stats})")
+
+        if not self.resend_api_key:
+            print("⚠️ 缺少 Resend API Key，無法寄信。 সন")
+            return False
+
+        with profiler.stage("report"):
+            html_content, success_rate, report_time = self.build_report_html(market_name, img_data, report_df, text_reports, stats, trend_text, extra_html)
+            attachments = self.build_attachments(img_data)
 
         # --- 關鍵修正：檢查信箱並強制轉為字串 ---
         if not self.receiver_email:
@@ -102,15 +149,16 @@ class StockNotifier:
             return False
 
         try:
-            resend.Emails.send({
-                "from": "StockMonitor <onboarding@resend.dev>",
-                "to": str(self.receiver_email),
-                "subject": f"🚀 {market_name} 全方位監控報告 - {report_time.split(' ')[0]}",
-                "html": html_content,
-                "attachments": attachments
-            })
-            print(f"✅ {market_name} 郵件報告已寄送！")
-            self.send_telegram(f"📊 <b>{market_name} 監控報表已送達</b>\n涵蓋率: {success_rate}")
+            with profiler.stage("send"):
+                resend.Emails.send({
+                    "from": "StockMonitor <onboarding@resend.dev>",
+                    "to": str(self.receiver_email),
+                    "subject": f"🚀 {market_name} 全方位監控報告 - {report_time.split(' ')[0]}",
+                    "html": html_content,
+                    "attachments": attachments
+                })
+                print(f"✅ {market_name} 郵件報告已寄送！")
+                self.send_telegram(f"📊 <b>{market_name} 監控報表已送達</b>\n涵蓋率: {success_rate}")
             return True
         except Exception as e:
             print(f"❌ 寄送失敗: {e}")
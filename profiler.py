@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
+# ========== 效能剖析設定 ==========
+PROFILE_ROOT = Path("./output/profiles")
+# 取樣間隔 (秒)：10ms 對 GIL 的干擾極小，又足以看出熱點
+SAMPLE_INTERVAL = 0.01
+
+# 目前啟用中的剖析器 (未啟用時 stage() 直接回傳空的 context)
+_active = None
+_NULL_STAGE = nullcontext()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+class _Stage:
+    """單一階段的 context：主執行緒以 cProfile 記錄，其餘執行緒交由取樣器"""
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __enter__(self):
+        self.owner._enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.owner._exit(self.name)
+        return False
+
+
+class StageProfiler:
+    """
+    分階段剖析器：
+    - 建立剖析器的執行緒 (管線主執行緒) 以 cProfile 精確記錄，輸出 .pstats
+    - 背景取樣器定期擷取「所有」執行緒的堆疊 (含 ThreadPoolExecutor 的下載 worker)，
+      輸出 flamegraph 工具可讀的 collapsed stack (.folded)
+    同一階段可重複進出 (例如每個 CSV 各進一次 load)，統計會自動累加。
+    """
+    def __init__(self, market_id, out_root=PROFILE_ROOT, interval=SAMPLE_INTERVAL):
+        self.market_id = market_id
+        self.out_dir = Path(out_root) / market_id / datetime.now().strftime("%Y-%m-%d")
+        self.interval = interval
+        self.profiles = {}
+        self.samples = {}
+        self.wall = Counter()
+        self.calls = Counter()
+        self._owner = threading.get_ident()
+        self._stack = []
+        self._t0 = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    # ---------- 階段切換 ----------
+    def stage(self, name):
+        if threading.get_ident() != self._owner:
+            # worker 執行緒不啟用 cProfile，僅依賴取樣器
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def _enter(self, name):
+        if self._stack:
+            self.profiles[self._stack[-1]].disable()
+        prof = self.profiles.get(name)
+        if prof is None:
+            prof = self.profiles[name] = cProfile.Profile()
+        with self._lock:
+            self._stack.append(name)
+        self._t0.append(time.perf_counter())
+        self.calls[name] += 1
+        prof.enable()
+
+    def _exit(self, name):
+        self.profiles[name].disable()
+        self.wall[name] += time.perf_counter() - self._t0.pop()
+        with self._lock:
+            self._stack.pop()
+        if self._stack:
+            self.profiles[self._stack[-1]].enable()
+
+    # ---------- 全執行緒取樣 ----------
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                current = self._stack[-1] if self._stack else None
+            if current is None:
+                continue
+            names = {t.ident: t.name for t in threading.enumerate()}
+            bucket = self.samples.setdefault(current, Counter())
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(tid, f"thread-{tid}"))
+                stack.append(current)
+                bucket[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        """停止取樣並寫出各階段 .pstats / .folded 與摘要"""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        while self._stack:
+            self._exit(self._stack[-1])
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        summary = [f"{'階段':<12} | {'次數':>8} | {'耗時(秒)':>10} | {'樣本數':>8}", "-" * 50]
+        for name, prof in self.profiles.items():
+            try:
+                pstats.Stats(prof).dump_stats(str(self.out_dir / f"{name}.pstats"))
+            except TypeError:
+                # 階段內沒有任何 Python 呼叫時 pstats 會拋錯，略過即可
+                pass
+            stacks = self.samples.get(name, Counter())
+            with open(self.out_dir / f"{name}.folded", "w", encoding="utf-8") as f:
+                for stack, cnt in stacks.most_common():
+                    f.write(f"{stack} {cnt}\n")
+            summary.append(f"{name:<12} | {self.calls[name]:>8} | {self.wall[name]:>10.2f} | {sum(stacks.values()):>8}")
+
+        with open(self.out_dir / "summary.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(summary) + "\n")
+        return self.out_dir
+
+
+def start(market_id, out_root=PROFILE_ROOT, interval=SAMPLE_INTERVAL):
+    """啟用全域剖析器，之後各模組的 profiler.stage() 才會實際記錄"""
+    global _active
+    if _active is not None:
+        _active.stop()
+    _active = StageProfiler(market_id, out_root=out_root, interval=interval).start()
+    return _active
+
+
+def stop():
+    """停止剖析並回傳輸出目錄 (未啟用時回傳 None)"""
+    global _active
+    if _active is None:
+        return None
+    out_dir = _active.stop()
+    _active = None
+    return out_dir
+
+
+def stage(name):
+    """
+    標記一個管線階段：
+        with profiler.stage("download"):
+            ...
+    未啟用 --profile 時為零成本的空 context。
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name)
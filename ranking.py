@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+排名索引：分析完成後把每檔的各區間報酬連同「每個指標的排序索引」存成
+data/<market>/results/ranking_<交易日>.npz，之後的篩選查詢不必重跑分析或重讀股價：
+
+    python ranking.py --market tw-share top Month_High -n 50
+    python ranking.py --market tw-share range Year_Close -30 -20
+    python ranking.py --market tw-share get 2330.TW --date 2026-10-16
+
+前 N 名與區間查詢以二分搜尋 (np.searchsorted) 在排序後的數值上定位，單一代號以排序後的代號陣列查找；
+索引載入後快取在行程內 (同一路徑、檔案未更新時不重讀)，供儀表板與機器人重複查詢。
+"""
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+
+RESULTS_DIR = "results"
+# 每個市場保留的索引天數
+KEEP_DAYS = 30
+_CACHE = {}
+
+def results_dir(market_id, data_root="./data"):
+    return Path(data_root) / market_id / RESULTS_DIR
+
+def index_path(market_id, session_date, data_root="./data"):
+    return results_dir(market_id, data_root) / f"ranking_{session_date}.npz"
+
+def available_dates(market_id, data_root="./data"):
+    return sorted(p.stem[len("ranking_"):] for p in results_dir(market_id, data_root).glob("ranking_*.npz"))
+
+# ========== 建立索引 ==========
+
+def save_index(df_res, market_id, session_date, data_root="./data", keep_days=KEEP_DAYS):
+    """
+    df_res 為 analyzer 的結果 (Ticker, Full_Name 與各指標欄位)。每個指標存兩個陣列：
+    排除 NaN 後由小到大的數值 (<指標>__v) 與對應的列號 (<指標>__i)；另存逐列的數值矩陣供單檔查詢。
+    """
+    # 存成定長 unicode 陣列 (不需 pickle 即可載入)
+    tickers = df_res["Ticker"].astype(str).to_numpy(dtype=str)
+    arrays = {"tickers": tickers, "names": df_res["Full_Name"].astype(str).to_numpy(dtype=str),
+              "ticker_order": np.argsort(tickers, kind="stable").astype(np.int32)}
+    metrics = [c for c in df_res.columns if c not in ("Ticker", "Full_Name")]
+    for col in metrics:
+        values = df_res[col].values.astype(np.float32)
+        valid = np.nonzero(~np.isnan(values))[0]
+        order = valid[np.argsort(values[valid], kind="stable")].astype(np.int32)
+        arrays[f"{col}__v"] = values[order]
+        arrays[f"{col}__i"] = order
+    arrays["metrics"] = np.array(metrics)
+    arrays["values"] = df_res[metrics].values.astype(np.float32)
+
+    path = index_path(market_id, session_date, data_root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.stem + ".tmp.npz")
+    np.savez(tmp, **arrays)
+    tmp.replace(path)
+    for old in available_dates(market_id, data_root)[:-keep_days] if keep_days else []:
+        index_path(market_id, old, data_root).unlink(missing_ok=True)
+    return path
+
+# ========== 查詢 ==========
+
+class RankingIndex:
+    """單一交易日的排名索引 (唯讀)"""
+    def __init__(self, path):
+        self.path = Path(path)
+        with np.load(self.path) as data:
+            self.arrays = {k: data[k] for k in data.files}
+        self.tickers = self.arrays["tickers"]
+        self.names = self.arrays["names"]
+        self.metrics = self.arrays["metrics"].tolist()
+        self._sorted_tickers = self.tickers[self.arrays["ticker_order"]]
+
+    def _check(self, metric):
+        if metric not in self.metrics:
+            raise KeyError(f"未知的指標: {metric} (可用: {', '.join(self.metrics)})")
+        return self.arrays[f"{metric}__v"], self.arrays[f"{metric}__i"]
+
+    def _rows(self, metric, values, rows):
+        return [{"ticker": str(self.tickers[r]), "name": str(self.names[r]), metric: round(float(v), 3)}
+                for v, r in zip(values, rows)]
+
+    def top(self, metric, n=50, ascending=False):
+        """指標前 N 名 (預設由高到低)"""
+        values, rows = self._check(metric)
+        if ascending:
+            return self._rows(metric, values[:n], rows[:n])
+        return self._rows(metric, values[::-1][:n], rows[::-1][:n])
+
+    def between(self, metric, lo=None, hi=None):
+        """指標介於 [lo, hi) 的標的 (由小到大)，與分布圖的分箱邊界一致"""
+        values, rows = self._check(metric)
+        i = 0 if lo is None else int(np.searchsorted(values, lo, side="left"))
+        j = len(values) if hi is None else int(np.searchsorted(values, hi, side="left"))
+        return self._rows(metric, values[i:j], rows[i:j])
+
+    def get(self, ticker):
+        """單一代號的全部指標；找不到時回傳 None"""
+        k = int(np.searchsorted(self._sorted_tickers, ticker))
+        if k >= len(self._sorted_tickers) or self._sorted_tickers[k] != ticker:
+            return None
+        r = int(self.arrays["ticker_order"][k])
+        row = {"ticker": str(self.tickers[r]), "name": str(self.names[r])}
+        for metric, v in zip(self.metrics, self.arrays["values"][r]):
+            row[metric] = None if np.isnan(v) else round(float(v), 3)
+        return row
+
+def load_index(market_id, session_date=None, data_root="./data"):
+    """讀取指定交易日 (預設最新一次) 的索引；同一檔案未更新時直接回傳快取"""
+    if session_date is None:
+        dates = available_dates(market_id, data_root)
+        if not dates:
+            return None
+        session_date = dates[-1]
+    path = index_path(market_id, session_date, data_root)
+    if not path.exists():
+        return None
+    key = str(path.resolve())
+    mtime = path.stat().st_mtime
+    cached = _CACHE.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = _CACHE[key] = (mtime, RankingIndex(path))
+    return cached[1]
+
+# ========== CLI ==========
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the persisted ranking index")
+    parser.add_argument("--market", default="tw-share")
+    parser.add_argument("--date", default=None, help="交易日 YYYY-MM-DD，預設為最新一次分析")
+    parser.add_argument("--data-root", default="./data")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_top = sub.add_parser("top", help="指標前 N 名")
+    p_top.add_argument("metric")
+    p_top.add_argument("-n", type=int, default=50)
+    p_top.add_argument("--ascending", action="store_true", help="由低到高")
+    p_range = sub.add_parser("range", help="指標介於 [lo, hi) 的標的")
+    p_range.add_argument("metric")
+    p_range.add_argument("lo", type=float)
+    p_range.add_argument("hi", type=float)
+    p_get = sub.add_parser("get", help="單一代號的全部指標")
+    p_get.add_argument("ticker")
+    sub.add_parser("metrics", help="列出可查詢的指標與交易日")
+    args = parser.parse_args()
+
+    index = load_index(args.market, args.date, args.data_root)
+    if index is None:
+        print(f"⚠️ 找不到 {args.market} {args.date or '最新'} 的排名索引，請先執行 main.py 完成分析。")
+        return
+    if args.command == "top":
+        result = index.top(args.metric, args.n, args.ascending)
+    elif args.command == "range":
+        result = index.between(args.metric, args.lo, args.hi)
+    elif args.command == "get":
+        result = index.get(args.ticker)
+    else:
+        result = {"metrics": index.metrics, "dates": available_dates(args.market, args.data_root)}
+
+    if args.json or not isinstance(result, list):
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    for row in result:
+        print(" | ".join(f"{v}" for v in row.values()))
+    print(f"共 {len(result)} 檔")
+
+if __name__ == "__main__":
+    main()
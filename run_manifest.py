@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import threading
+from datetime import datetime
+from collections import Counter
+
+import catalog
+
+# ========== 續跑清單 (每市場、每日一份) ==========
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_ROOT = os.path.join(BASE_DIR, "data")
+
+DONE_STATUS = {"success", "exists"}
+FAILED_STATUS = {"error", "empty"}
+# 舊版下載器的狀態名稱統一對應
+STATUS_ALIAS = {"done": "success", "failed": "error"}
+
+
+def manifest_path(market_id, day=None, root=None, shard=None):
+    day = day or datetime.now().strftime("%Y-%m-%d")
+    # 分片各自一份清單，避免同機多個分片同時寫入/壓縮同一檔案
+    suffix = f"_shard{shard[0]}of{shard[1]}" if shard else ""
+    return os.path.join(root or DATA_ROOT, market_id, "lists", f"manifest_{day}{suffix}.jsonl")
+
+
+class RunManifest:
+    """
+    逐檔增量落地的下載清單 (JSON Lines，一行一筆狀態更新，後寫覆蓋先寫)：
+    - 中途被中斷 (CI 逾時、被封鎖) 時，已完成的標的不會重抓
+    - --retry-failed 只重跑 error / empty 的標的
+    """
+    def __init__(self, market_id, day=None, root=None, shard=None):
+        self.market_id = market_id
+        self.root = root
+        self.path = manifest_path(market_id, day, root, shard)
+        # 資料目錄保留每檔最後一次下載狀態 (跨日失敗報告、負快取用)
+        self.catalog = catalog.for_market(market_id, root or DATA_ROOT)
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._fh = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    self.entries[rec["ticker"]] = rec
+                except (ValueError, KeyError):
+                    # 最後一行可能因中斷而寫到一半，直接忽略
+                    continue
+
+    def record(self, ticker, status, error=None):
+        """寫入單一標的狀態並立即 flush，確保中斷時不遺失進度"""
+        status = STATUS_ALIAS.get(status, status)
+        with self._lock:
+            prev = self.entries.get(ticker, {})
+            attempts = prev.get("attempts", 0) + (0 if status == "exists" else 1)
+            rec = {"ticker": ticker, "status": status, "attempts": attempts,
+                   "last_error": error or (prev.get("last_error") if status in FAILED_STATUS else None),
+                   "updated_at": datetime.now().isoformat(timespec="seconds")}
+            self.entries[ticker] = rec
+            if self._fh is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._fh = open(self.path, "a", encoding="utf-8")
+            self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._fh.flush()
+        self.catalog.record_status(ticker, status, rec["last_error"])
+
+    def select(self, items, key_fn, retry_failed=False):
+        """
+        依今日清單過濾待辦：
+        - 一般模式：略過今日已成功 (success/exists) 的標的 (續跑)
+        - retry_failed：只保留今日 error/empty 的標的
+        """
+        if retry_failed:
+            return [it for it in items if self.entries.get(key_fn(it), {}).get("status") in FAILED_STATUS]
+        return [it for it in items if self.entries.get(key_fn(it), {}).get("status") not in DONE_STATUS]
+
+    def status_of(self, ticker):
+        return self.entries.get(ticker, {}).get("status")
+
+    def failed(self):
+        return sorted(t for t, rec in self.entries.items() if rec["status"] in FAILED_STATUS)
+
+    def summary(self, keys):
+        """以整個宇宙為分母的統計 (回傳給 main.py / notifier)"""
+        counts = Counter(self.status_of(k) for k in keys)
+        success = sum(counts[s] for s in DONE_STATUS)
+        return {"total": len(keys), "success": success, "fail": len(keys) - success,
+                "error": counts["error"], "empty": counts["empty"]}
+
+    def close(self):
+        """收尾時壓縮成每檔一行，避免重跑多次後檔案膨脹"""
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            if not self.entries:
+                return
+            tmp = self.path + ".tmp"
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                for rec in self.entries.values():
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+截止時間感知的下載排程：每個市場的下載階段有一個總時間預算 (分鐘)，
+待辦標的依優先順序送進執行緒池，而不是依清單順序一次全部送出：
+
+    1. 從未抓過的標的 (目錄中沒有任何 K 線)
+    2. 已有資料者依「近期平均成交值 (流動性) + 落後天數」由高到低
+    3. 最後一次下載失敗 (empty / error) 的標的
+
+執行緒池中同時只有 workers 檔在跑，每完成一檔即以指數平滑更新單檔耗時；
+剩餘時間不足以再完成一檔 (含安全餘裕) 時停止送出新工作，等待中的工作跑完即結束，
+未處理的低優先標的列入 skipped 報告 (不寫入續跑清單，下一輪或 --retry-failed 會再排入)。
+
+    python main.py --market us-share --time-budget 45     # 或設定 STOCK_MONITOR_TIME_BUDGET=45
+"""
+import os
+import math
+import time
+import sqlite3
+from collections import deque
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import catalog
+
+TIME_BUDGET_ENV = "STOCK_MONITOR_TIME_BUDGET"
+# 單檔耗時的指數平滑係數，與尚無樣本時的預設值 (秒)
+EWMA_ALPHA = 0.2
+INITIAL_TASK_SEC = 5.0
+# 截止前的安全餘裕：預估單檔耗時的倍數 + 固定秒數
+SAFETY_FACTOR = 1.5
+SAFETY_SEC = 5.0
+# 落後天數的加分 (每日，以 log10 成交值為單位) 與上限天數，避免下市標的永遠排在最前
+STALE_WEIGHT = 0.2
+MAX_STALE_DAYS = 5
+# 報告中列出的略過標的數；有時間預算時每完成幾檔輸出一次進度預估
+SKIP_LOG_LIMIT = 20
+PROGRESS_EVERY = 100
+
+def log(msg: str):
+    print(f"{time.strftime('%H:%M:%S')}: {msg}")
+
+def budget_seconds(minutes=None):
+    """時間預算 (秒)；未指定時讀取 STOCK_MONITOR_TIME_BUDGET (分鐘)，皆未設定回傳 None (不限時)"""
+    if minutes is None:
+        minutes = os.getenv(TIME_BUDGET_ENV, "").strip() or None
+    if minutes is None:
+        return None
+    minutes = float(minutes)
+    return minutes * 60 if minutes > 0 else None
+
+# ========== 優先順序 ==========
+
+def priority_key(entry, today=None):
+    """
+    entry 為目錄列 (或含 last_date / turnover / status 的 dict)，None 代表目錄中沒有紀錄。
+    回傳排序鍵，數值小者優先。
+    """
+    failed = bool(entry) and entry.get("status") in catalog.FAILED_STATUS
+    if not entry or not entry.get("last_date"):
+        return (2 if failed else 0, 0.0)
+    if failed:
+        return (2, 0.0)
+    turnover = entry.get("turnover") or 0.0
+    try:
+        stale = ((today or date.today()) - date.fromisoformat(str(entry["last_date"])[:10])).days
+    except ValueError:
+        stale = MAX_STALE_DAYS
+    score = math.log10(1.0 + max(turnover, 0.0)) + STALE_WEIGHT * min(max(stale, 0), MAX_STALE_DAYS)
+    return (1, -score)
+
+def catalog_priority(market_dir, path_fn):
+    """CSV 型下載器的排序鍵函式：path_fn(清單項目) -> CSV 路徑，依該市場目錄的紀錄排序"""
+    cat = catalog.existing(market_dir)
+    today = date.today()
+    if cat is None:
+        return lambda it: priority_key(None, today)
+    def key(it):
+        path = path_fn(it)
+        return priority_key(cat.entry_for(path) if path else None, today)
+    return key
+
+def warehouse_priority(db_path, market_id, symbol_fn=lambda it: it[0]):
+    """
+    SQLite 倉儲型下載器 (港/日股) 的排序鍵函式：最後 K 線日期取自 sync_state，
+    流動性為近期 K 線的平均成交值，最後一次下載狀態取自該市場目錄
+    """
+    cutoff = (date.today() - timedelta(days=catalog.TURNOVER_BARS * 2)).isoformat()
+    conn = sqlite3.connect(db_path)
+    try:
+        last = dict(conn.execute("SELECT symbol, last_date FROM sync_state").fetchall())
+        turnover = dict(conn.execute("SELECT symbol, AVG(close * volume) FROM stock_prices WHERE date >= ? "
+                                     "GROUP BY symbol", (cutoff,)).fetchall())
+    finally:
+        conn.close()
+    cat = catalog.existing(os.path.join(catalog.DATA_ROOT, market_id))
+    status = cat.rows if cat else {}
+    today = date.today()
+    def key(it):
+        sym = symbol_fn(it)
+        if sym not in last and sym not in status:
+            return priority_key(None, today)
+        return priority_key({"last_date": last.get(sym), "turnover": turnover.get(sym),
+                             "status": (status.get(sym) or {}).get("status")}, today)
+    return key
+
+# ========== 排程 ==========
+
+class DeadlineScheduler:
+    """
+    run(fn) 為產生器：依優先順序執行 fn(項目)，每完成一檔 yield (項目, 結果)。
+    budget_sec 為 None 時讀取環境變數；0 或未設定代表不限時 (仍依優先順序)。
+    """
+    def __init__(self, items, key_fn=None, workers=4, budget_sec=None, label="下載"):
+        self.pending = deque(sorted(items, key=key_fn) if key_fn else items)
+        self.total = len(self.pending)
+        self.workers = max(1, int(workers))
+        self.budget = budget_seconds() if budget_sec is None else (budget_sec or None)
+        self.label = label
+        self.started = time.monotonic()
+        self.deadline = self.started + self.budget if self.budget else None
+        self.task_sec = None
+        self.done = 0
+        self.skipped = []
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def estimate(self):
+        """預估單檔耗時 (秒)"""
+        return INITIAL_TASK_SEC if self.task_sec is None else self.task_sec
+
+    def can_start(self):
+        """剩餘時間是否足以再完成一檔"""
+        if self.deadline is None:
+            return True
+        return self.remaining() > self.estimate() * SAFETY_FACTOR + SAFETY_SEC
+
+    def throughput(self):
+        """目前的實際吞吐量 (檔/秒)"""
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def projected(self):
+        """依目前單檔耗時與併發數，預估截止前還能完成的檔數 (不限時回傳 None)"""
+        if self.deadline is None:
+            return None
+        left = max(0.0, self.remaining() - SAFETY_SEC)
+        return int(left / self.estimate() * self.workers)
+
+    def _observe(self, seconds):
+        self.done += 1
+        self.task_sec = seconds if self.task_sec is None else (1 - EWMA_ALPHA) * self.task_sec + EWMA_ALPHA * seconds
+
+    @staticmethod
+    def _timed(fn, item):
+        t0 = time.monotonic()
+        res = fn(item)
+        return res, time.monotonic() - t0
+
+    def run(self, fn):
+        if self.deadline is not None:
+            log(f"⏳ {self.label}時間預算 {self.budget / 60:.1f} 分鐘，依優先順序處理 {self.total} 檔")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+            while self.pending or running:
+                # 只讓 workers 檔同時執行：其餘留在優先佇列，截止前可隨時停止送出
+                while self.pending and len(running) < self.workers and self.can_start():
+                    item = self.pending.popleft()
+                    running[executor.submit(self._timed, fn, item)] = item
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    item = running.pop(fut)
+                    res, seconds = fut.result()
+                    self._observe(seconds)
+                    if self.deadline is not None and self.done % PROGRESS_EVERY == 0:
+                        log(f"⏱️ {self.label}已完成 {self.done}/{self.total} 檔 | 單檔約 {self.estimate():.1f}s | "
+                            f"截止前預估還能完成 {self.projected()} 檔 (待處理 {len(self.pending) + len(running)})")
+                    yield item, res
+        self.skipped = list(self.pending)
+        self.pending.clear()
+
+    def report(self, key_fn=str):
+        """下載結束後的略過報告 (未略過時不輸出)"""
+        if not self.skipped:
+            return
+        names = ", ".join(key_fn(it) for it in self.skipped[:SKIP_LOG_LIMIT])
+        more = f" ... 等 {len(self.skipped)} 檔" if len(self.skipped) > SKIP_LOG_LIMIT else ""
+        log(f"⏳ 時間預算用盡：完成 {self.done}/{self.total} 檔 (約 {self.throughput():.2f} 檔/秒)，"
+            f"略過低優先標的 {len(self.skipped)} 檔: {names}{more}")
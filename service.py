@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""
+常駐服務模式：單一行程保留各市場的價格面板、分析結果與圖表 (PNG 位元組)，依內部排程在每個新的已收盤交易日
+下載 -> 增量分析 -> (可選) 寄信，並在本機 HTTP 端點提供查詢，不必每次冷啟動重讀數千個 CSV：
+
+    GET  /health                                      服務狀態與各市場最後更新時間
+    GET  /markets/<id>/distribution                   各指標分箱家數與摘要 (與每日快照同格式)
+    GET  /markets/<id>/ranking/top?metric=Week_High&n=20[&ascending=1]
+    GET  /markets/<id>/ranking/range?metric=Week_High&lo=50&hi=100
+    GET  /markets/<id>/ranking/ticker?ticker=2330
+    GET  /markets/<id>/breakouts                      52 週新高 / 新低警示
+    GET  /markets/<id>/charts                         圖表清單；/charts/<圖表 id>.png 取得圖檔
+    GET  /markets/<id>/report                         HTML 報表 (圖表改為本服務網址)
+    POST /markets/<id>/refresh                        立即下載並重新分析 (背景執行)
+
+- 價格面板以檔案 (mtime, size) 判斷是否變動：新交易日只重讀下載器改寫過的 CSV，其餘沿用記憶體中的欄位
+- 啟動時先以磁碟上既有的 K 線暖機 (不下載、不寄信、不寫入快照 / 排名 / 新高新低狀態)，端點立即可用
+- 新交易日判斷沿用 trading_calendar；分析完成即記為已同步，寄信失敗時只依 SEND_RETRY_BACKOFF 退避重寄郵件
+- --no-send 時只更新記憶體狀態，不寄信、也不標記交易日已處理
+
+    python service.py --markets tw-share --interval 300 --port 8780
+    python service.py --markets tw-share,cn-share --no-send
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import traceback
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import main as pipeline
+import analyzer
+import breakout_alerts
+import notifier
+import ranking
+import trading_calendar
+
+PORT_ENV = "STOCK_MONITOR_SERVICE_PORT"
+DEFAULT_PORT = 8780
+DEFAULT_HOST = "127.0.0.1"
+# 排程檢查新交易日的間隔 (秒)
+DEFAULT_INTERVAL = 300
+# ranking/top 未指定 n 時的筆數
+DEFAULT_TOP_N = 50
+# 郵件寄送失敗後各次重試前的等待 (秒)；全部用完仍失敗即放棄該交易日的郵件
+SEND_RETRY_BACKOFF = (300, 900, 1800, 3600)
+
+def log(msg: str):
+    print(f"{time.strftime('%H:%M:%S')}: {msg}")
+
+def market_name(market_id):
+    return pipeline.MARKETS_CONFIG.get(market_id, {}).get("name", market_id.upper())
+
+# ========== 記憶體狀態 ==========
+
+class PricePanel:
+    """日 K 分析欄位 (date/close/high/low) 的記憶體快取：路徑 -> ((mtime_ns, size), DataFrame)，只重讀有變動的檔案"""
+    def __init__(self):
+        self.frames = {}
+        self.reads = 0
+        self.hits = 0
+
+    def load(self, path):
+        key = str(path)
+        st = os.stat(key)
+        sig = (st.st_mtime_ns, st.st_size)
+        cached = self.frames.get(key)
+        if cached is not None and cached[0] == sig:
+            self.hits += 1
+            return cached[1]
+        df = analyzer.read_prices(key)
+        df.columns = [c.lower() for c in df.columns]
+        self.frames[key] = (sig, df)
+        self.reads += 1
+        return df
+
+    def prune(self, paths):
+        """移除已不在市場清單中的檔案 (下市、改名)"""
+        keep = {str(p) for p in paths}
+        for key in [k for k in self.frames if k not in keep]:
+            del self.frames[key]
+
+class MarketState:
+    """
+    單一市場某次分析的結果 (建立後不再修改，更新時整個替換，讀取端不需加鎖)。
+    persisted=False 為暖機狀態：本次未寫入排名與新高新低結果，改讀磁碟上最近一次的結果
+    """
+    def __init__(self, market_id, session, agg, images, report_df, text_reports, stats, data_root, persisted=True):
+        self.market_id = market_id
+        self.persisted = persisted
+        self.session = str(session)
+        self.updated_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.hists = agg.hists
+        self.extremes = agg.sorted_extremes()
+        self.report_df = report_df
+        self.text_reports = text_reports
+        self.stats = stats or {}
+        self.images = images
+        self.charts = {}
+        for img in images:
+            with open(img["path"], "rb") as f:
+                self.charts[img["id"]] = f.read()
+        key = session if persisted else None
+        self.breakouts = breakout_alerts.load_results(market_id, key, data_root)
+        self.ranking = ranking.load_index(market_id, key, data_root)
+
+    def distribution(self):
+        metrics = {col: hist.summary() for col, hist in self.hists.items() if hist.n}
+        return {"market": self.market_id, "session": self.session, "n_tickers": int(len(self.report_df)),
+                "bin_edges": [float(e) for e in analyzer.PLOT_BINS], "metrics": metrics, "extremes": self.extremes}
+
+class MarketService:
+    """單一市場的常駐管線：價格面板 + 最近一次分析結果；refresh 同時只會有一個在執行"""
+    def __init__(self, market_id, periods=None, data_root="./data", image_root="./output/images", send=True):
+        self.market_id = market_id
+        self.name = market_name(market_id)
+        self.periods = periods
+        self.data_root = data_root
+        self.image_root = image_root
+        self.send = send
+        self.panel = PricePanel()
+        # 新高新低狀態：整個服務期間共用同一個 SQLite 連線，每輪以 begin() 清空上一輪的警示
+        self.tracker = breakout_alerts.for_market(market_id, data_root)
+        self.state = None
+        self.lock = threading.Lock()
+        # 本行程已下載並分析過的交易日 (起始值沿用 main.py 排程的已處理紀錄)
+        self.synced = trading_calendar.last_processed_session(market_id)
+        # 寄送失敗待重試的郵件：{"session", "attempts", "next_at"}
+        self.pending_send = None
+        self.error = None
+
+    def due(self):
+        return str(trading_calendar.latest_completed_session(self.market_id)) != str(self.synced)
+
+    def refresh(self, download=True):
+        """
+        下載 (可略過) -> 以價格面板增量分析 -> 替換記憶體狀態 -> (可選) 寄信；已有 refresh 執行中時回傳 False。
+        download=False (暖機) 只建立記憶體狀態：不更新新高新低狀態，也不寫入快照、排名索引與警示結果
+        """
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            t0 = time.time()
+            session = trading_calendar.latest_completed_session(self.market_id)
+            stats = self.state.stats if self.state else {}
+            if download:
+                stats = pipeline.download_market(self.market_id, self.name) or {}
+
+            files = analyzer.market_files(self.market_id, self.data_root)
+            self.panel.prune(files)
+            reads, hits = self.panel.reads, self.panel.hits
+            shown = [p[0] for p in self.periods] if self.periods else None
+            report_cols = [f"{p}_High" for p in (shown or analyzer.REPORT_PERIODS)]
+            if download:
+                self.tracker.begin(session)
+            agg = analyzer.stream_market_returns(files, self.market_id, self.periods, None, report_cols,
+                                                 self.tracker if download else None, loader=self.panel.load)
+            images, report_df, text_reports = analyzer.publish_analysis(agg, self.market_id, self.data_root,
+                                                                        self.image_root, self.periods, persist=download)
+            if report_df is None or report_df.empty:
+                log(f"⚠️ {self.name} 分析結果為空 (可能是 CSV 資料不足)，保留上一次的狀態。")
+                return True
+            if not download:
+                # 暖機資料是下載前的 K 線，以磁碟上最近一次排名索引的交易日標示
+                dates = ranking.available_dates(self.market_id, self.data_root)
+                session = dates[-1] if dates else (self.synced or session)
+            self.state = MarketState(self.market_id, session, agg, images, report_df, text_reports, stats,
+                                     self.data_root, persisted=download)
+            self.error = None
+            log(f"✅ {self.name} {session} 分析完成：{len(report_df)} 檔 | 重讀 {self.panel.reads - reads} 檔、"
+                f"沿用記憶體 {self.panel.hits - hits} 檔 | {time.time() - t0:.1f}s")
+
+            if not download:
+                return True
+            # 分析已完成即記為已同步：寄信失敗不會讓下一輪重跑下載、分析、Telegram 與訂閱報表
+            self.synced = str(session)
+            self.pending_send = None
+            if self.send and not pipeline.send_report(notifier.StockNotifier(), self.market_id, self.name, session,
+                                                      images, report_df, text_reports, stats):
+                self.pending_send = {"session": str(session), "attempts": 1,
+                                     "next_at": time.time() + SEND_RETRY_BACKOFF[0]}
+                log(f"⏳ {self.name} {session} 郵件寄送失敗，{SEND_RETRY_BACKOFF[0]}s 後重試")
+            return True
+        except Exception as e:
+            self.error = str(e)
+            log(f"❌ {self.name} 常駐管線出錯:\n{traceback.format_exc()}")
+            return True
+        finally:
+            self.lock.release()
+
+    def retry_send(self):
+        """依退避時間重寄上一次失敗的郵件 (只重寄主報表)；超過 SEND_RETRY_BACKOFF 次數即放棄，回傳是否寄達"""
+        pending = self.pending_send
+        if pending is None or time.time() < pending["next_at"]:
+            return False
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            st = self.state
+            if self.pending_send is not pending or st is None or st.session != pending["session"]:
+                return False
+            pending["attempts"] += 1
+            try:
+                ok = pipeline.send_report(notifier.StockNotifier(), self.market_id, self.name, st.session, st.images,
+                                          st.report_df, st.text_reports, st.stats, extras=False)
+            except Exception as e:
+                log(f"❌ {self.name} 重寄郵件出錯: {e}")
+                ok = False
+            if ok:
+                self.pending_send = None
+            elif pending["attempts"] > len(SEND_RETRY_BACKOFF):
+                log(f"🚨 {self.name} {pending['session']} 郵件已重試 {pending['attempts'] - 1} 次仍失敗，放棄寄送")
+                self.pending_send = None
+            else:
+                wait = SEND_RETRY_BACKOFF[pending["attempts"] - 1]
+                pending["next_at"] = time.time() + wait
+                log(f"⏳ {self.name} {pending['session']} 第 {pending['attempts']} 次寄送失敗，{wait}s 後重試")
+            return ok
+        finally:
+            self.lock.release()
+
+    def refresh_async(self, download=True):
+        if self.lock.locked():
+            return False
+        threading.Thread(target=self.refresh, args=(download,), daemon=True).start()
+        return True
+
+    def status(self):
+        st = self.state
+        return {"market": self.market_id, "name": self.name, "session": st.session if st else None,
+                "updated_at": st.updated_at if st else None, "n_tickers": int(len(st.report_df)) if st else 0,
+                "synced": self.synced, "busy": self.lock.locked(), "panel_files": len(self.panel.frames),
+                "warm": bool(st and not st.persisted),
+                "send_attempts": self.pending_send["attempts"] if self.pending_send else 0, "error": self.error}
+
+# ========== 排程 ==========
+
+def run_schedule(services, interval, stop):
+    """每 interval 秒檢查各市場是否出現新的已收盤交易日，有則下載並更新狀態；否則處理到期的郵件重試"""
+    while not stop.wait(interval):
+        for svc in services.values():
+            if svc.due():
+                log(f"📅 {svc.name} 出現新的已收盤交易日 {trading_calendar.latest_completed_session(svc.market_id)}，開始更新")
+                svc.refresh(download=True)
+            else:
+                svc.retry_send()
+
+# ========== HTTP ==========
+
+def make_handler(services):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, body=b"", ctype="application/json; charset=utf-8"):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, payload, code=200):
+            self._send(code, json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8"))
+
+        def _error(self, code, msg):
+            self._json({"error": msg}, code)
+
+        def _market(self, segs):
+            """/markets/<id>/... -> (服務, 狀態)；找不到或尚未分析時已回應錯誤並回傳 (None, None)"""
+            svc = services.get(segs[1]) if len(segs) >= 2 else None
+            if svc is None:
+                self._error(404, f"未啟用的市場: {segs[1] if len(segs) >= 2 else ''}")
+                return None, None
+            if svc.state is None and self.command == "GET":
+                self._error(503, f"{svc.name} 尚未完成第一次分析")
+                return None, None
+            return svc, svc.state
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            segs = [s for s in parts.path.split("/") if s]
+            query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+
+            if segs in ([], ["health"]):
+                return self._json({"status": "ok", "markets": [s.status() for s in services.values()]})
+            if segs[:1] != ["markets"] or len(segs) < 3:
+                return self._error(404, f"未知的路徑: {parts.path}")
+            svc, st = self._market(segs)
+            if st is None:
+                return
+            route = segs[2]
+
+            if route == "distribution":
+                return self._json(st.distribution())
+            if route == "breakouts":
+                return self._json(st.breakouts or {"market": st.market_id, "session": st.session, "alerts": {}})
+            if route == "charts" and len(segs) == 3:
+                return self._json([{"id": img["id"], "label": img["label"], "url": f"/markets/{st.market_id}/charts/{img['id']}.png"}
+                                   for img in st.images])
+            if route == "charts" and len(segs) == 4:
+                body = st.charts.get(segs[3].removesuffix(".png"))
+                if body is None:
+                    return self._error(404, f"找不到圖表: {segs[3]}")
+                return self._send(200, body, "image/png")
+            if route == "report":
+                html, _, _ = notifier.StockNotifier().build_report_html(svc.name, st.images, st.report_df, st.text_reports,
+                                                                       st.stats, extra_html=breakout_alerts.report_html(st.breakouts))
+                html = html.replace('src="cid:', f'src="/markets/{st.market_id}/charts/')
+                return self._send(200, html.encode("utf-8"), "text/html; charset=utf-8")
+            if route == "ranking" and len(segs) == 4:
+                return self._ranking(st, segs[3], query)
+            return self._error(404, f"未知的路徑: {parts.path}")
+
+        def _ranking(self, st, op, query):
+            if st.ranking is None:
+                return self._error(503, f"{st.market_id} {st.session} 沒有排名索引")
+            try:
+                if op == "ticker":
+                    row = st.ranking.get(query.get("ticker", ""))
+                    return self._json(row) if row else self._error(404, f"找不到代號: {query.get('ticker')}")
+                metric = query.get("metric", "")
+                if op == "top":
+                    rows = st.ranking.top(metric, int(query.get("n", DEFAULT_TOP_N)), query.get("ascending") in ("1", "true"))
+                elif op == "range":
+                    lo = float(query["lo"]) if query.get("lo") else None
+                    hi = float(query["hi"]) if query.get("hi") else None
+                    rows = st.ranking.between(metric, lo, hi)
+                else:
+                    return self._error(404, f"未知的排名查詢: {op}")
+            except KeyError as e:
+                return self._error(400, str(e.args[0]) if e.args else str(e))
+            except ValueError as e:
+                return self._error(400, str(e))
+            return self._json({"market": st.market_id, "session": st.session, "metric": metric, "rows": rows})
+
+        def do_POST(self):
+            segs = [s for s in urlsplit(self.path).path.split("/") if s]
+            if segs[:1] != ["markets"] or segs[2:] != ["refresh"]:
+                return self._error(404, f"未知的路徑: {self.path}")
+            svc, _ = self._market(segs)
+            if svc is None:
+                return
+            if not svc.refresh_async(download=True):
+                return self._json({"status": "busy", "market": svc.market_id}, 409)
+            return self._json({"status": "accepted", "market": svc.market_id}, 202)
+
+    return Handler
+
+def start_server(services, host=DEFAULT_HOST, port=None):
+    """在背景執行緒啟動 HTTP 端點，回傳 (server, url)"""
+    port = DEFAULT_PORT if port is None else port
+    server = ThreadingHTTPServer((host, port), make_handler(services))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+# ========== CLI ==========
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running warm service with in-memory market state")
+    parser.add_argument("--markets", default="tw-share", help="逗號分隔的市場 ID")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=int(os.getenv(PORT_ENV, DEFAULT_PORT)))
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="檢查新交易日的間隔 (秒)")
+    parser.add_argument("--periods", type=str, default=None, help="自訂分析區間 (同 main.py --periods)")
+    parser.add_argument("--no-send", action="store_true", help="只更新記憶體狀態，不寄送郵件 / Telegram")
+    parser.add_argument("--data-root", default="./data")
+    args = parser.parse_args()
+
+    periods = analyzer.parse_periods(args.periods) if args.periods else None
+    services = {m: MarketService(m, periods, args.data_root, send=not args.no_send)
+                for m in (x.strip() for x in args.markets.split(",")) if m}
+    server, url = start_server(services, args.host, args.port)
+    log(f"🛰️ 常駐服務已啟動：{url} | 市場 {', '.join(services)} | 每 {args.interval:g}s 檢查新交易日"
+        f"{' | 不寄信' if args.no_send else ''}")
+
+    # 暖機：以磁碟上既有的 K 線建立記憶體狀態 (不下載、不寄信)，之後交給排程
+    for svc in services.values():
+        svc.refresh(download=False)
+
+    stop = threading.Event()
+    try:
+        for svc in services.values():
+            if svc.due():
+                svc.refresh(download=True)
+        run_schedule(services, args.interval, stop)
+    except KeyboardInterrupt:
+        log("👋 收到中斷訊號，停止常駐服務")
+    finally:
+        stop.set()
+        server.shutdown()
+        for svc in services.values():
+            svc.tracker.close()
+
+if __name__ == "__main__":
+    main()
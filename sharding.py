@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+宇宙分片：以代號的穩定雜湊 (crc32) 把標的分配到 N 個 worker，同一檔永遠落在同一分片
+(快取、續跑清單都留在同一台機器)。各分片自行下載並彙整成「部分結果」，
+再由合併步驟 (analyzer.merge_partials) 加總分箱家數、串接報表欄位，只產出一份報告。
+
+    python main.py --market us-share --shard 1/4     # 每個 worker 各跑一片
+    python main.py --market us-share --merge 4       # 全部完成後合併、繪圖、寄信
+
+部分結果位於 output/shards/<market>/<交易日>/part_<i>of<N>.csv (報表欄位) 與 .json (直方圖、飆股、新高新低警示、下載統計)。
+"""
+import json
+import zlib
+import pandas as pd
+from pathlib import Path
+
+SHARD_ROOT = Path("./output/shards")
+# 合併時加總的下載統計欄位
+STAT_KEYS = ["total", "success", "fail", "error", "empty", "skipped", "negative_cached", "reinstated"]
+
+def parse_shard(spec):
+    """解析 "i/N" (1 <= i <= N)，回傳 (i, N)"""
+    try:
+        index, count = (int(x) for x in str(spec).split("/", 1))
+    except ValueError:
+        raise ValueError(f"分片格式應為 i/N，例如 1/4: {spec}")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"分片編號超出範圍: {spec}")
+    return index, count
+
+def shard_of(key, count):
+    """代號所屬的分片 (1..N)；crc32 不受 PYTHONHASHSEED 影響，跨機器、跨次執行皆一致"""
+    return zlib.crc32(str(key).encode("utf-8")) % count + 1
+
+def in_shard(key, shard):
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+def filter_items(items, key_fn, shard):
+    """只保留屬於本分片的清單項目 (shard 為 None 時原樣回傳)"""
+    if shard is None:
+        return items
+    return [it for it in items if in_shard(key_fn(it), shard)]
+
+def shard_label(shard):
+    return f"{shard[0]}of{shard[1]}"
+
+# ========== 部分結果 ==========
+
+def partial_dir(market_id, session, root=None):
+    return Path(root or SHARD_ROOT) / market_id / str(session)
+
+def save_partial(agg, market_id, session, shard, periods=None, stats=None, root=None):
+    """
+    把分片的 StreamingAnalysis 寫成部分結果：報表欄位 (CSV) + 各指標直方圖與飆股清單 (JSON)。
+    periods 為 --periods 的解析結果 (None 表示預設區間)，合併端據此決定繪圖區間。
+    JSON 最後寫入，合併端以 JSON 存在與否判斷該分片是否完成。
+    """
+    out_dir = partial_dir(market_id, session, root)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    base = out_dir / f"part_{shard_label(shard)}"
+    agg.frame().to_csv(base.with_suffix(".csv"), index=False, encoding="utf-8-sig")
+    meta = {
+        "market": market_id, "session": str(session), "shard": list(shard),
+        "periods": [list(p) for p in periods] if periods else None,
+        "columns": agg.columns, "keep": agg.keep,
+        "hists": {c: h.state() for c, h in agg.hists.items()},
+        "extremes": agg.extremes, "alerts": agg.alerts, "stats": stats or {},
+    }
+    tmp = base.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    tmp.replace(base.with_suffix(".json"))
+    return base.with_suffix(".json")
+
+def load_partials(market_id, session, count, root=None):
+    """讀取 1..N 各分片的部分結果，回傳 (部分結果清單, 缺少的分片編號)"""
+    parts, missing = [], []
+    for i in range(1, count + 1):
+        base = partial_dir(market_id, session, root) / f"part_{shard_label((i, count))}"
+        if not base.with_suffix(".json").exists():
+            missing.append(i)
+            continue
+        with open(base.with_suffix(".json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["frame"] = pd.read_csv(base.with_suffix(".csv"), dtype={"Ticker": str, "Full_Name": str})
+        parts.append(meta)
+    return parts, missing
+
+def merge_stats(parts):
+    """加總各分片的下載統計"""
+    return {k: sum(int(p["stats"].get(k, 0) or 0) for p in parts) for k in STAT_KEYS}
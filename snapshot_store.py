@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+每日分布快照：把當日各區間/指標的分箱家數、摘要統計與 >100% 飆股清單
+追加寫入 data/<market>/snapshots/snapshots.jsonl (一行一個交易日，同日重跑以最後一筆為準)。
+趨勢報表只需讀取數 KB 的快照，不必從原始股價重算歷史。
+"""
+import json
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+
+SNAPSHOT_FILE = "snapshots.jsonl"
+# 趨勢追蹤的指標與「強勢區」門檻 (報酬率 >= 20% 的分箱)
+TREND_METRICS = ["Week_Close", "Month_Close", "Year_Close"]
+TOP_BIN_FLOOR = 20.0
+TREND_DAYS = 30
+
+def snapshot_path(market_id, data_root="./data", name=SNAPSHOT_FILE):
+    return Path(data_root) / market_id / "snapshots" / name
+
+def metric_summary(values, edges):
+    """單一指標的分箱家數與摘要統計 (分箱與分布圖一致：超過上限者併入最後一格)"""
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return None
+    counts, _ = np.histogram(np.clip(values, edges[0], edges[-1]), bins=edges)
+    p10, median, p90 = np.percentile(values, [10, 50, 90])
+    return {
+        "n": int(len(values)),
+        "counts": counts.tolist(),
+        "mean": round(float(values.mean()), 3),
+        "median": round(float(median), 3),
+        "p10": round(float(p10), 3),
+        "p90": round(float(p90), 3),
+        "up_share": round(float((values > 0).mean() * 100), 3),
+    }
+
+def build_snapshot(df_res, market_id, session_date, edges, extreme_floor=100.0, histograms=None, extremes=None):
+    """
+    由 analyzer 的結果 DataFrame 建立當日快照 (dict，可直接序列化為 JSON)。
+    串流模式下 df_res 只含報表欄位：其餘指標改用 histograms (OnlineHistogram) 的摘要，
+    飆股清單則直接採用串流過程收集的 extremes。
+    """
+    metrics = {}
+    given_extremes = extremes
+    extremes = {}
+    for col in df_res.columns:
+        if col in ("Ticker", "Full_Name"): continue
+        summary = metric_summary(df_res[col].values.astype(float), edges)
+        if summary is None: continue
+        metrics[col] = summary
+        if given_extremes is None and col.endswith("_High"):
+            hit = df_res[df_res[col] >= extreme_floor].sort_values(col, ascending=False)
+            if not hit.empty:
+                extremes[col[:-len("_High")]] = [[t, round(float(v), 1)] for t, v in zip(hit["Ticker"], hit[col])]
+    for col, hist in (histograms or {}).items():
+        if col not in metrics and hist.summary() is not None:
+            metrics[col] = hist.summary()
+    if given_extremes is not None:
+        extremes = given_extremes
+    return {
+        "date": str(session_date),
+        "market": market_id,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "n_tickers": int(len(df_res)),
+        "bin_edges": [float(e) for e in edges],
+        "metrics": metrics,
+        "extremes": extremes,
+    }
+
+def append_snapshot(snapshot, data_root="./data"):
+    return append_snapshots(snapshot["market"], [snapshot], data_root)
+
+def append_snapshots(market_id, snapshots, data_root="./data", name=SNAPSHOT_FILE):
+    """批次追加 (歷史回補一次寫入數百日；盤中模式以 name 寫入當日的 intraday 檔)"""
+    path = snapshot_path(market_id, data_root, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for snap in snapshots:
+            f.write(json.dumps(snap, ensure_ascii=False) + "\n")
+    return path
+
+def load_snapshots(market_id, data_root="./data", days=None):
+    """依日期排序回傳快照清單；同一日期多筆時取最後寫入者"""
+    path = snapshot_path(market_id, data_root)
+    if not path.exists():
+        return []
+    by_date = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                snap = json.loads(line)
+                by_date[snap["date"]] = snap
+            except (ValueError, KeyError):
+                continue
+    snaps = [by_date[d] for d in sorted(by_date)]
+    return snaps[-days:] if days else snaps
+
+def top_share(metric, edges, floor=TOP_BIN_FLOOR):
+    """強勢區 (分箱下緣 >= floor) 家數佔比 (%)"""
+    lows = np.asarray(edges[:-1])
+    counts = np.asarray(metric["counts"])
+    return float(counts[lows >= floor].sum() / max(metric["n"], 1) * 100)
+
+def trend_series(snaps, metric_name, floor=TOP_BIN_FLOOR):
+    """[(日期, 強勢區佔比, 中位數, 上漲家數佔比), ...]"""
+    rows = []
+    for snap in snaps:
+        m = snap["metrics"].get(metric_name)
+        if m is None: continue
+        rows.append((snap["date"], top_share(m, snap["bin_edges"], floor), m["median"], m["up_share"]))
+    return rows
+
+def trend_text(market_id, data_root="./data", days=TREND_DAYS, metrics=None):
+    """產出郵件用的趨勢摘要：日變化 (與前一交易日比較) 與近 N 日強勢區佔比區間"""
+    snaps = load_snapshots(market_id, data_root, days)
+    if len(snaps) < 2:
+        return ""
+    prev_date, cur_date = snaps[-2]["date"], snaps[-1]["date"]
+    lines = [f"比較基準: {prev_date} -> {cur_date} | 近 {len(snaps)} 個交易日 | 強勢區: >= {TOP_BIN_FLOOR:.0f}%",
+             f"{'指標':<12} | {'上漲佔比':<16} | {'強勢區佔比':<16} | {'中位數':<16} | 強勢區區間", "-" * 90]
+    for name in (metrics or TREND_METRICS):
+        series = trend_series(snaps, name)
+        if len(series) < 2 or series[-1][0] != cur_date: continue
+        (_, top0, med0, up0), (_, top1, med1, up1) = series[-2], series[-1]
+        tops = [r[1] for r in series]
+        lines.append(f"{name:<12} | {up1:5.1f}% ({up1 - up0:+5.1f}) | {top1:5.1f}% ({top1 - top0:+5.1f}) | "
+                     f"{med1:5.1f}% ({med1 - med0:+5.1f}) | {min(tops):.1f}% ~ {max(tops):.1f}%")
+    return "\n".join(lines) if len(lines) > 3 else ""
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+本機 Yahoo / 交易所替身伺服器：提供錄製或合成的 K 線 (v8 chart)、盤中報價 (v7 quote) 與清單回應，
+可設定延遲、錯誤率與 429 限流行為，供下載器離線壓測。
+
+    python standin_server.py --port 8765 --latency-ms 80 --error-rate 0.02 --rps 30
+    STOCK_MONITOR_STANDIN=http://127.0.0.1:8765 python main.py --market tw-share
+
+--record 模式會把請求轉發到真實上游並把回應存進 --recordings，之後即可原樣重播。
+--rps 為「每個用戶端身分」的上限 (以 X-Forwarded-For 區分)，搭配 --proxies 啟動的轉發代理模擬多出口。
+"""
+import io
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs, quote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RECORDINGS_DIR = Path("./output/standin/recordings")
+
+# 各 Yahoo 代號後綴對應的交易所時區 (影響 chart meta 與日期)
+SUFFIX_TZ = {
+    ".TW": "Asia/Taipei", ".TWO": "Asia/Taipei", ".HK": "Asia/Hong_Kong",
+    ".SS": "Asia/Shanghai", ".SZ": "Asia/Shanghai", ".T": "Asia/Tokyo",
+    ".KS": "Asia/Seoul", ".KQ": "Asia/Seoul",
+}
+# 合成盤中報價：每 QUOTE_STEP_SEC 秒走一步，最多 QUOTE_MAX_STEPS 步後循環
+QUOTE_MAX_STEPS = 5000
+RANGE_DAYS = {"1d": 1, "5d": 5, "1mo": 22, "3mo": 66, "6mo": 130, "1y": 252, "2y": 504, "5y": 1260, "10y": 2520, "max": 5000}
+
+
+class StandInConfig:
+    """替身行為參數 (皆可於執行中修改，壓測工具會直接調整)"""
+    def __init__(self, latency_ms=50.0, latency_jitter_ms=30.0, error_rate=0.0, throttle_rate=0.0,
+                 empty_rate=0.01, rps=0.0, universe=2000, recordings=RECORDINGS_DIR, record=False, seed=7,
+                 action_rate=0.0, quote_step_sec=1.0):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.empty_rate = empty_rate
+        self.rps = rps
+        self.universe = universe
+        self.recordings = Path(recordings)
+        self.record = record
+        self.seed = seed
+        # 當日發生除權息 (還原價格整段改寫) 的代號比例
+        self.action_rate = action_rate
+        # 盤中報價每隔幾秒變動一次 (測試時調小即可在短時間內看到分布移動)
+        self.quote_step_sec = quote_step_sec
+
+
+class StandInState:
+    """伺服器端共用狀態：設定、每個用戶端身分的 token bucket 與計數器"""
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.counters = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def allow(self, client="local"):
+        """簡易 token bucket (每個用戶端身分各一個，模擬 Yahoo 依 IP 限流)：rps <= 0 代表不限速"""
+        rps = self.config.rps
+        if rps <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            tokens, last = self.buckets.get(client, (rps, now))
+            tokens = min(rps, tokens + (now - last) * rps)
+            allowed = tokens >= 1
+            self.buckets[client] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+
+# ========== 合成資料 ==========
+
+def _rng_for(key, seed):
+    return np.random.default_rng(zlib.crc32(f"{seed}:{key}".encode()))
+
+def _tz_for(symbol):
+    for suffix, tz in SUFFIX_TZ.items():
+        if symbol.upper().endswith(suffix):
+            return tz
+    return "America/New_York"
+
+@lru_cache(maxsize=16)
+def _business_days(end_day):
+    """2000-01-03 起至 end_day 的平日 (numpy datetime64[D])，同一天內重複使用"""
+    days = np.arange(np.datetime64("2000-01-03"), np.datetime64(end_day) + 1, dtype="datetime64[D]")
+    return days[np.is_busday(days)]
+
+def synthetic_chart(symbol, params, seed=7, action_rate=0.0):
+    """
+    依代號決定性地產生隨機漫步 K 線，格式同 Yahoo v8 chart (quote 為未還原價，adjclose 為還原收盤價)。
+    action_rate > 0 時，部分代號在最新交易日除息：回傳配息事件，且之前的還原收盤價全部以還原因子改寫。
+    """
+    tz = _tz_for(symbol)
+    today = pd.Timestamp.now(tz=tz).normalize()
+    # 完整歷史固定從 2000 年起算，任何區間請求都取同一條路徑，增量下載才能對得上
+    full = _business_days(str(today.date()))
+    if "period1" in params:
+        start = pd.Timestamp(int(params["period1"][0]), unit="s", tz="UTC").tz_convert(tz).date()
+        end = pd.Timestamp(int(params.get("period2", [int(time.time())])[0]), unit="s", tz="UTC").tz_convert(tz).date()
+        pos = np.nonzero((full >= np.datetime64(start)) & (full <= np.datetime64(end)))[0]
+    else:
+        n = RANGE_DAYS.get(params.get("range", ["1mo"])[0], 22)
+        pos = np.arange(max(0, len(full) - n), len(full))
+
+    rng = _rng_for(symbol, seed)
+    rets = rng.normal(0.0003, rng.uniform(0.01, 0.04), size=len(full))
+    close = rng.uniform(5, 500) * np.exp(np.cumsum(rets))
+    raw = close
+    events = {}
+    if action_rate > 0 and zlib.crc32(f"{symbol}:{full[-1]}".encode()) % 10000 < action_rate * 10000:
+        amount = round(float(close[-2]) * 0.03, 2)
+        close = close.copy()
+        close[:-1] *= 1 - amount / close[-2]
+        ex_ts = int(pd.Timestamp(full[-1]).tz_localize(tz).tz_convert("UTC").timestamp())
+        if pos.size and pos[-1] == len(full) - 1:
+            events = {"dividends": {str(ex_ts): {"amount": amount, "date": ex_ts}}}
+    c, adj = raw[pos], close[pos]
+    o = np.concatenate([[c[0]], c[:-1]]) if len(c) else c
+    h = np.maximum(o, c) * 1.01
+    l = np.minimum(o, c) * 0.99
+    v = (rng.lognormal(12, 1.2, size=len(full))[pos]).astype(int)
+    local = pd.DatetimeIndex(full[pos]).tz_localize(tz).tz_convert("UTC").tz_localize(None)
+    ts = local.values.astype("datetime64[s]").astype(np.int64).tolist()
+    return {"chart": {"result": [{
+        "meta": {"symbol": symbol, "currency": "USD", "exchangeTimezoneName": tz, "dataGranularity": "1d"},
+        "timestamp": ts,
+        "indicators": {"quote": [{"open": o.round(2).tolist(), "high": h.round(2).tolist(), "low": l.round(2).tolist(),
+                                  "close": c.round(2).tolist(), "volume": v.tolist()}],
+                       "adjclose": [{"adjclose": adj.round(2).tolist()}]},
+        "events": events,
+    }], "error": None}}
+
+def synthetic_quote(symbol, seed=7, step_sec=1.0, now=None):
+    """
+    盤中報價 (格式同 Yahoo v7 quote 的單筆 result)：以合成日 K 的前一日收盤為起點，
+    依當日經過的秒數走隨機漫步，回傳最新價與當日最高/最低。
+    """
+    now = now or time.time()
+    payload = synthetic_chart(symbol, {"range": ["5d"]}, seed)
+    closes = payload["chart"]["result"][0]["indicators"]["quote"][0]["close"]
+    if len(closes) < 2:
+        return None
+    prev = closes[-2]
+    tz = _tz_for(symbol)
+    local = pd.Timestamp(now, unit="s", tz="UTC").tz_convert(tz)
+    elapsed = (local - local.normalize()).total_seconds()
+    steps = int(elapsed / max(step_sec, 1e-3)) % QUOTE_MAX_STEPS + 1
+    rng = _rng_for(f"{symbol}:{local.date()}:quote", seed)
+    path = prev * np.exp(np.cumsum(rng.normal(0, 0.002, size=QUOTE_MAX_STEPS)[:steps]))
+    return {"symbol": symbol, "regularMarketPrice": round(float(path[-1]), 2),
+            "regularMarketDayHigh": round(float(path.max()), 2), "regularMarketDayLow": round(float(path.min()), 2),
+            "regularMarketPreviousClose": prev, "regularMarketTime": int(now), "exchangeTimezoneName": tz}
+
+def _codes(n, start, width=4):
+    return [str(start + i).zfill(width) for i in range(n)]
+
+def _daily_rows(codes, suffix, day, seed):
+    """
+    合成全市場日行情：取同代號合成 K 線 (synthetic_chart) 在 day 當天的 OHLCV 與漲跌，
+    與逐檔下載的歷史是同一條路徑。day 為 None 時取最新一根。回傳 (日期, [(代號, o, h, l, c, v, 漲跌), ...])
+    """
+    rows = []
+    for code in codes:
+        res = synthetic_chart(f"{code}{suffix}", {"range": ["1mo"]}, seed)["chart"]["result"][0]
+        dates = [str(d.date()) for d in pd.to_datetime(res["timestamp"], unit="s", utc=True).tz_convert(_tz_for(suffix))]
+        day = day or dates[-1]
+        if day not in dates or dates.index(day) == 0: continue
+        i, q = dates.index(day), res["indicators"]["quote"][0]
+        rows.append((code, q["open"][i], q["high"][i], q["low"][i], q["close"][i], q["volume"][i],
+                     round(q["close"][i] - q["close"][i - 1], 2)))
+    return day, rows
+
+def synthetic_list(host, path, query, n, seed=7):
+    """常見清單端點的合成回應，回傳 (content_type, bytes)；不認得的端點回傳 None"""
+    if host.endswith("isin.twse.com.tw"):
+        market = parse_qs(query).get("market", ["1"])[0]
+        base = 1101 if market == "1" else 3000
+        rows = "".join(f"<tr><td>{i}</td><td>TW000{c}</td><td>{c}</td><td>合成{c}</td><td>上市</td><td>股票</td><td></td><td>2000/01/01</td><td>ESVUFR</td><td></td></tr>"
+                       for i, c in enumerate(_codes(n // 2, base)))
+        html = ("<html><body><table><tr><td>頁面編號</td><td>國際證券編碼</td><td>有價證券代號</td><td>有價證券名稱</td>"
+                "<td>市場別</td><td>有價證券別</td><td>產業別</td><td>公開發行/上市(櫃)/發行日</td><td>CFICode</td><td>備註</td></tr>"
+                f"{rows}</table></body></html>")
+        return "text/html; charset=utf-8", html.encode("utf-8")
+    if host.endswith("twse.com.tw") and "STOCK_DAY_ALL" in path:
+        day = parse_qs(query).get("date", [None])[0]
+        day, rows = _daily_rows(_codes(n // 2, 1101), ".TW", day and f"{day[:4]}-{day[4:6]}-{day[6:]}", seed)
+        payload = {"stat": "OK", "date": day.replace("-", ""), "title": f"{day} 每日收盤行情(全部)",
+                   "fields": ["證券代號", "證券名稱", "成交股數", "成交金額", "開盤價", "最高價", "最低價", "收盤價", "漲跌價差", "成交筆數"],
+                   "data": [[c, f"合成{c}", f"{v:,}", f"{int(v * cl):,}", f"{o:.2f}", f"{h:.2f}", f"{l:.2f}", f"{cl:.2f}",
+                             f"{chg:.4f}", "1,000"] for c, o, h, l, cl, v, chg in rows]}
+        return "application/json", json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    if host.endswith("tpex.org.tw") and "daily_close_quotes" in path:
+        day, rows = _daily_rows(_codes(n // 2, 3000), ".TWO", None, seed)
+        roc = f"{int(day[:4]) - 1911}{day[5:7]}{day[8:]}"
+        payload = [{"Date": roc, "SecuritiesCompanyCode": c, "CompanyName": f"合成{c}", "Close": f"{cl:.2f}",
+                    "Change": f"{chg:+.2f}", "Open": f"{o:.2f}", "High": f"{h:.2f}", "Low": f"{l:.2f}",
+                    "TradingShares": str(v), "TransactionAmount": str(int(v * cl)), "TransactionNumber": "1000"}
+                   for c, o, h, l, cl, v, chg in rows]
+        return "application/json", json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    if host.endswith("nasdaqtrader.com"):
+        syms = [f"S{i:04d}" for i in range(n // 2)] if "nasdaqlisted" in path else [f"O{i:04d}" for i in range(n // 2)]
+        if "nasdaqlisted" in path:
+            lines = ["Symbol|Security Name|Market Category|Test Issue|Financial Status|Round Lot Size|ETF|NextShares"]
+            lines += [f"{s}|{s} Synthetic Inc. - Common Stock|Q|N|N|100|N|N" for s in syms]
+        else:
+            lines = ["ACT Symbol|Security Name|Exchange|CQS Symbol|ETF|Round Lot Size|Test Issue|NASDAQ Symbol"]
+            lines += [f"{s}|{s} Synthetic Corp Common Stock|N|{s}|N|100|N|{s}" for s in syms]
+        lines.append("File Creation Time: 0101202600:00|||||||")
+        return "text/plain", "\n".join(lines).encode("utf-8")
+    if host.endswith("hkex.com.hk"):
+        df = pd.DataFrame({"Stock Code": _codes(n, 1, 5), "English Stock Short Name": [f"SYN {i}" for i in range(n)]})
+        buf = io.BytesIO()
+        try:
+            with pd.ExcelWriter(buf) as writer:
+                pd.DataFrame([["List of Securities"], [""]]).to_excel(writer, index=False, header=False)
+                df.to_excel(writer, index=False, startrow=2)
+        except Exception:
+            return None
+        return "application/vnd.ms-excel", buf.getvalue()
+    return None
+
+def synthetic_frame(name, n, seed=7):
+    """akshare / pykrx 函式輸出的合成版 (欄位名與原函式一致)；行情欄位取自同代號的合成 K 線"""
+    if name == "akshare/stock_zh_a_spot_em":
+        # 上海 (.SS) 與深圳 (.SZ) 各半，即時行情即最新一根 K 線 (成交量單位為手)
+        rows = _daily_rows([f"{600000 + i}" for i in range(n // 2)], ".SS", None, seed)[1] + \
+               _daily_rows([f"{i + 1:06d}" for i in range(n - n // 2)], ".SZ", None, seed)[1]
+        return pd.DataFrame({"代码": [r[0] for r in rows], "名称": [f"合成{r[0]}" for r in rows],
+                             "最新价": [r[4] for r in rows], "今开": [r[1] for r in rows], "最高": [r[2] for r in rows],
+                             "最低": [r[3] for r in rows], "成交量": [r[5] / 100 for r in rows],
+                             "昨收": [round(r[4] - r[6], 2) for r in rows]})
+    if name.startswith("pykrx/market_ohlcv_"):
+        # pykrx/market_ohlcv_<KOSPI|KOSDAQ>_<YYYYMMDD>：代號與 market_ticker_list 相同
+        mk, ymd = name[len("pykrx/market_ohlcv_"):].rsplit("_", 1)
+        day, rows = _daily_rows([f"{i * 10:06d}" for i in range(n // 2)], ".KS" if mk == "KOSPI" else ".KQ",
+                                f"{ymd[:4]}-{ymd[4:6]}-{ymd[6:]}", seed)
+        return pd.DataFrame({"티커": [r[0] for r in rows], "시가": [r[1] for r in rows], "고가": [r[2] for r in rows],
+                             "저가": [r[3] for r in rows], "종가": [r[4] for r in rows], "거래량": [r[5] for r in rows],
+                             "거래대금": [int(r[4] * r[5]) for r in rows],
+                             "등락률": [round(r[6] / (r[4] - r[6]) * 100, 2) for r in rows]})
+    if name == "akshare/stock_info_a_code_name":
+        return pd.DataFrame({"code": [f"{600000 + i}" for i in range(n)], "name": [f"合成{i}" for i in range(n)]})
+    if name == "akshare/stock_tw_spot_em":
+        return pd.DataFrame({"代码": _codes(n, 1101), "名称": [f"合成{i}" for i in range(n)]})
+    if name.startswith("pykrx/market_ticker_list_"):
+        return pd.DataFrame({"code": [f"{i * 10:06d}" for i in range(n // 2)], "name": [f"합성{i}" for i in range(n // 2)]})
+    return None
+
+
+# ========== HTTP 處理 ==========
+
+def _recording_path(root, host, path, query):
+    name = quote(f"{path}?{query}" if query else path, safe="")
+    return Path(root) / host / name
+
+def make_handler(state):
+    cfg = state.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, body=b"", ctype="application/json"):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            state.count(f"status_{code}")
+
+        def _send_cacheable(self, body, ctype):
+            """清單類回應附 ETag (內容 crc32)；請求帶相同 If-None-Match 時回 304 (條件式請求測試用)"""
+            etag = f'"{zlib.crc32(body):08x}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                state.count("status_304")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+            state.count("status_200")
+
+        def _upstream(self, url):
+            import requests
+            r = requests.get(url, timeout=30, headers={"User-Agent": "Mozilla/5.0"})
+            return r.status_code, r.content, r.headers.get("Content-Type", "application/octet-stream")
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            segs = [s for s in parts.path.split("/") if s]
+
+            if segs[:1] == ["_stats"]:
+                return self._send(200, json.dumps(state.counters).encode())
+
+            # 模擬網路延遲
+            delay = max(0.0, random.gauss(cfg.latency_ms, cfg.latency_jitter_ms)) / 1000
+            if delay: time.sleep(delay)
+
+            client = self.headers.get("X-Forwarded-For", "local")
+            if not state.allow(client) or random.random() < cfg.throttle_rate:
+                state.count(f"throttled_{client}")
+                return self._send(429, b'{"error":"Too Many Requests"}')
+            if random.random() < cfg.error_rate:
+                return self._send(500, b'{"error":"Internal Server Error"}')
+
+            # --- 個股 K 線 (Yahoo v8 chart) ---
+            if len(segs) >= 4 and segs[-4:-1] == ["v8", "finance", "chart"]:
+                symbol = segs[-1]
+                state.count("chart")
+                rec = _recording_path(cfg.recordings, "chart", symbol, "")
+                if cfg.record:
+                    code, body, ctype = self._upstream(f"https://query2.finance.yahoo.com/v8/finance/chart/{symbol}?{parts.query}")
+                    rec.parent.mkdir(parents=True, exist_ok=True)
+                    rec.write_bytes(body)
+                    return self._send(code, body, ctype)
+                if rec.exists():
+                    return self._send(200, rec.read_bytes())
+                if zlib.crc32(symbol.encode()) % 10000 < cfg.empty_rate * 10000:
+                    return self._send(404, b'{"chart":{"result":null,"error":{"code":"Not Found"}}}')
+                payload = synthetic_chart(symbol, parse_qs(parts.query), cfg.seed, cfg.action_rate)
+                return self._send(200, json.dumps(payload).encode())
+
+            # --- 盤中報價 (Yahoo v7 quote，一次多檔) ---
+            if segs[-3:] == ["v7", "finance", "quote"]:
+                symbols = [s for s in parse_qs(parts.query).get("symbols", [""])[0].split(",") if s]
+                state.count("quote")
+                rows = [q for q in (synthetic_quote(s, cfg.seed, cfg.quote_step_sec) for s in symbols
+                                    if zlib.crc32(s.encode()) % 10000 >= cfg.empty_rate * 10000) if q]
+                return self._send(200, json.dumps({"quoteResponse": {"result": rows, "error": None}}).encode())
+
+            # --- akshare / pykrx 套件資料 ---
+            if segs[:1] == ["frames"]:
+                name = "/".join(segs[1:]).replace(".csv", "")
+                state.count("frame")
+                rec = Path(cfg.recordings) / "frames" / f"{name}.csv"
+                if rec.exists():
+                    return self._send_cacheable(rec.read_bytes(), "text/csv")
+                df = synthetic_frame(name, cfg.universe, cfg.seed)
+                if df is None:
+                    return self._send(404, b"unknown frame")
+                return self._send_cacheable(df.to_csv(index=False).encode("utf-8"), "text/csv")
+
+            # --- 清單端點：/<host>/<path>?<query> ---
+            if segs:
+                host, path = segs[0], "/" + "/".join(segs[1:])
+                state.count("list")
+                rec = _recording_path(cfg.recordings, host, path, parts.query)
+                if cfg.record:
+                    query = f"?{parts.query}" if parts.query else ""
+                    code, body, ctype = self._upstream(f"https://{host}{path}{query}")
+                    rec.parent.mkdir(parents=True, exist_ok=True)
+                    rec.write_bytes(body)
+                    return self._send(code, body, ctype)
+                if rec.exists():
+                    return self._send_cacheable(rec.read_bytes(), "application/octet-stream")
+                res = synthetic_list(host, path, parts.query, cfg.universe, cfg.seed)
+                if res is not None:
+                    return self._send_cacheable(res[1], res[0])
+            return self._send(404, b"not found")
+
+    return Handler
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """於背景執行緒啟動替身伺服器，回傳 (server, state, base_url)；port=0 代表自動挑選"""
+    state = StandInState(config or StandInConfig())
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="standin-server", daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}"
+
+
+def start_proxy(forwarded_for, host="127.0.0.1", port=0):
+    """
+    轉發代理替身 (僅 HTTP)：把 requests 經 proxy 送來的絕對網址原樣轉發，並加上 X-Forwarded-For，
+    讓替身伺服器把它視為另一個用戶端身分。回傳 (server, proxy_url)。
+    """
+    import requests
+
+    class ProxyHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            try:
+                r = requests.get(self.path, headers={"X-Forwarded-For": forwarded_for}, timeout=30)
+                code, body, ctype = r.status_code, r.content, r.headers.get("Content-Type", "application/json")
+            except requests.RequestException:
+                code, body, ctype = 502, b"bad gateway", "text/plain"
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), ProxyHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"standin-proxy-{forwarded_for}", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Yahoo/exchange stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=30.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回 500 的機率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="隨機回 429 的機率")
+    parser.add_argument("--empty-rate", type=float, default=0.01, help="回 404 (下市/無資料) 的代號比例")
+    parser.add_argument("--rps", type=float, default=0.0, help="每個用戶端身分的每秒請求上限，超過回 429 (0 = 不限)")
+    parser.add_argument("--proxies", type=int, default=0, help="另外啟動幾個轉發代理替身 (各自是不同的用戶端身分)")
+    parser.add_argument("--universe", type=int, default=2000, help="合成清單的標的數")
+    parser.add_argument("--action-rate", type=float, default=0.0, help="當日除權息 (歷史還原價改寫) 的代號比例")
+    parser.add_argument("--quote-step-sec", type=float, default=1.0, help="合成盤中報價每隔幾秒變動一次")
+    parser.add_argument("--recordings", default=str(RECORDINGS_DIR))
+    parser.add_argument("--record", action="store_true", help="轉發至真實上游並錄製回應")
+    args = parser.parse_args()
+
+    config = StandInConfig(args.latency_ms, args.latency_jitter_ms, args.error_rate, args.throttle_rate,
+                           args.empty_rate, args.rps, args.universe, args.recordings, args.record,
+                           action_rate=args.action_rate, quote_step_sec=args.quote_step_sec)
+    server, _, url = start_server(config, args.host, args.port)
+    print(f"🧪 替身伺服器啟動於 {url} (Ctrl+C 結束)")
+    print(f"   export STOCK_MONITOR_STANDIN={url}")
+    proxies = [start_proxy(f"10.0.0.{i + 1}", args.host)[1] for i in range(args.proxies)]
+    if proxies:
+        profiles = [{"name": f"proxy-{i + 1}", "proxy": p, "rps": args.rps} for i, p in enumerate(proxies)]
+        print(f"   export STOCK_MONITOR_EGRESS='{json.dumps(profiles)}'")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+訂閱報表分送：分析只跑一次 (report_df、分布圖由 analyzer 產出)，再依訂閱設定替每位收件人組出自己的子集：
+
+    {
+      "sectors": {"tw-share": {"半導體": ["2330", "2303", "2454"]}},
+      "subscribers": [
+        {"name": "半導體組", "email": "a@example.com", "markets": ["tw-share"],
+         "tickers": ["2317"], "sectors": ["半導體"],
+         "thresholds": {"Week_High": 15, "Month_Low": -20}, "periods": ["Week", "Month"]}
+      ]
+    }
+
+- tickers / sectors：觀察清單 (代號可省略 .TW 等後綴)；sectors 的成分股定義在最上層 sectors
+- thresholds：指標門檻，正值為「>= 門檻」、負值為「<= 門檻」；有觀察清單時只篩清單內，否則篩全市場
+- periods：附上哪些區間的分布圖 (預設全部)；有觀察清單者另外繪製一張清單報酬圖
+- markets：只收哪些市場 (預設全部)
+
+子集以代號索引 (dict) 與各指標排序後的數值 (np.searchsorted) 查出，成本只隨訂閱人數增加，
+不重跑下載與分析。設定檔預設為 ./subscriptions.json，可用 STOCK_MONITOR_SUBSCRIPTIONS 指定。
+
+    python subscriptions.py                  # 檢查設定檔並列出各訂閱者
+"""
+import os
+import re
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from pathlib import Path
+
+import analyzer
+import profiler
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_ENV = "STOCK_MONITOR_SUBSCRIPTIONS"
+DEFAULT_CONFIG = os.path.join(BASE_DIR, "subscriptions.json")
+# 門檻命中清單與觀察清單圖最多列出的檔數
+ALERT_LIMIT = 30
+CHART_LIMIT = 40
+
+def log(msg: str):
+    print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
+
+def config_path():
+    return os.getenv(CONFIG_ENV, "").strip() or DEFAULT_CONFIG
+
+def load_config(path=None):
+    """讀取訂閱設定；檔案不存在時回傳 None (維持單一收件人的舊行為)"""
+    path = path or config_path()
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    for i, sub in enumerate(config.get("subscribers", [])):
+        if not sub.get("email"):
+            raise ValueError(f"訂閱者 #{i + 1} ({sub.get('name', '-')}) 缺少 email")
+        sub.setdefault("name", sub["email"])
+    return config
+
+def subscribers_for(config, market_id):
+    return [s for s in (config or {}).get("subscribers", []) if not s.get("markets") or market_id in s["markets"]]
+
+# ========== 共用索引 ==========
+
+class ReportIndex:
+    """
+    單一市場 report_df 的查詢索引，所有訂閱者共用：
+    代號 -> 列號 (完整代號與去除後綴的代號各一份)，各指標排序後的數值與列號 (第一次用到時建立)
+    """
+    def __init__(self, report_df):
+        self.df = report_df.reset_index(drop=True)
+        tickers = self.df["Ticker"].astype(str).tolist()
+        self.by_ticker = {t: i for i, t in enumerate(tickers)}
+        self.by_code = {}
+        for i, t in enumerate(tickers):
+            self.by_code.setdefault(t.split(".", 1)[0], i)
+        self._sorted = {}
+
+    def lookup(self, tickers):
+        """代號清單 -> 列號 (依輸入順序、去除重複與找不到者)"""
+        rows, seen = [], set()
+        for t in tickers:
+            t = str(t).strip()
+            i = self.by_ticker.get(t, self.by_code.get(t.split(".", 1)[0]))
+            if i is not None and i not in seen:
+                seen.add(i)
+                rows.append(i)
+        return rows
+
+    def sorted_metric(self, metric):
+        if metric not in self._sorted:
+            values = self.df[metric].values.astype(float)
+            valid = np.nonzero(~np.isnan(values))[0]
+            order = valid[np.argsort(values[valid], kind="stable")]
+            self._sorted[metric] = (values[order], order)
+        return self._sorted[metric]
+
+    def threshold(self, metric, limit, rows=None):
+        """門檻命中的列號：limit >= 0 取 >= limit，否則取 <= limit；rows 指定時只在其中篩選"""
+        if metric not in self.df.columns:
+            return []
+        if rows is not None:
+            values = self.df[metric].values[rows]
+            return [r for r, v in zip(rows, values) if (v >= limit if limit >= 0 else v <= limit)]
+        values, order = self.sorted_metric(metric)
+        if limit >= 0:
+            return order[np.searchsorted(values, limit, side="left"):][::-1].tolist()
+        return order[:np.searchsorted(values, limit, side="right")].tolist()
+
+def watch_rows(index, sub, sectors):
+    tickers = list(sub.get("tickers", []))
+    for name in sub.get("sectors", []):
+        tickers.extend(sectors.get(name, []))
+    return index.lookup(tickers)
+
+def alert_rows(index, sub, watch):
+    """{指標: [列號...]}；有觀察清單時只篩清單內"""
+    scope = watch if (sub.get("tickers") or sub.get("sectors")) else None
+    return {metric: index.threshold(metric, float(limit), scope)[:ALERT_LIMIT]
+            for metric, limit in (sub.get("thresholds") or {}).items()}
+
+# ========== 個人化內容 ==========
+
+def _metric_columns(df, periods):
+    """觀察清單表格/圖要列出的欄位：訂閱區間的 Close (記憶體預算不足時只有 High)"""
+    cols = []
+    for p in periods:
+        for t in ("Close", "High"):
+            if f"{p}_{t}" in df.columns:
+                cols.append(f"{p}_{t}")
+                break
+    return cols
+
+def _table_html(df, cols):
+    head = "".join(f"<th style='padding: 4px 8px;'>{analyzer.period_label(c.split('_')[0])}{c.split('_')[1]}</th>" for c in cols)
+    body = ""
+    for _, r in df.iterrows():
+        cells = "".join(f"<td style='padding: 4px 8px; text-align: right; color: {'#28a745' if r[c] >= 0 else '#dc3545'};'>"
+                        f"{r[c]:+.1f}%</td>" if pd.notna(r[c]) else "<td>-</td>" for c in cols)
+        body += f"<tr><td style='padding: 4px 8px;'>{r['Ticker']}</td><td>{r['Full_Name']}</td>{cells}</tr>"
+    return (f"<table style='border-collapse: collapse; font-size: 13px;'><tr><th>代號</th><th>名稱</th>{head}</tr>"
+            f"{body}</table>")
+
+def subscriber_html(index, sub, watch, alerts, periods):
+    """訂閱者專屬區塊 (插在報表摘要之後)：觀察清單報酬表與門檻命中清單"""
+    html = ""
+    cols = _metric_columns(index.df, periods)
+    if watch:
+        html += f"""
+            <div style="margin-bottom: 30px;">
+                <h4 style="color: #e67e22;">👀 {sub['name']} 觀察清單 ({len(watch)} 檔)</h4>
+                {_table_html(index.df.iloc[watch], cols)}
+            </div>"""
+    for metric, rows in alerts.items():
+        limit = float(sub["thresholds"][metric])
+        html += f"""
+            <div style="margin-bottom: 20px;">
+                <h4 style="color: #c0392b;">🚨 {metric} {'>=' if limit >= 0 else '<='} {limit:g}% ({len(rows)} 檔)</h4>
+                {_table_html(index.df.iloc[rows], [metric]) if rows else '<p>今日無標的達到門檻。</p>'}
+            </div>"""
+    return html
+
+def _slug(sub):
+    """圖檔名與 cid：以 email 組成 (名稱多為中文，轉成 ASCII 後容易撞名)"""
+    return re.sub(r"[^0-9A-Za-z_-]+", "_", sub["email"]).strip("_").lower()
+
+def render_watch_chart(index, sub, watch, periods, out_dir):
+    """觀察清單報酬橫條圖 (第一個訂閱區間)；只替有觀察清單的訂閱者繪製"""
+    cols = _metric_columns(index.df, periods)
+    if not watch or not cols:
+        return None
+    col = cols[0]
+    df = index.df.iloc[watch][["Ticker", "Full_Name", col]].dropna().sort_values(col).tail(CHART_LIMIT)
+    if df.empty:
+        return None
+    fig, ax = plt.subplots(figsize=(10, max(3, 0.35 * len(df) + 1)))
+    ax.barh([f"{t} {n}" for t, n in zip(df["Ticker"], df["Full_Name"])], df[col],
+            color=["#28a745" if v >= 0 else "#dc3545" for v in df[col]])
+    ax.axvline(0, color="black", linewidth=0.8)
+    label = f"{analyzer.period_label(col.split('_')[0])}K {col.split('_')[1]}"
+    ax.set_title(f"{sub['name']} 觀察清單 {label} 報酬 (%)", fontsize=14, fontweight="bold")
+    ax.grid(axis="x", linestyle="--", alpha=0.3)
+    fig.tight_layout()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    img_path = out_dir / f"watch_{_slug(sub)}.png"
+    fig.savefig(img_path, dpi=100)
+    plt.close(fig)
+    return {"id": f"watch_{_slug(sub)}", "path": str(img_path), "label": f"👀 {sub['name']} 觀察清單 {label}"}
+
+def _chart_period(image_id):
+    """analyzer 分布圖的 id 為 <區間>_<型態> (如 week_high)；其他圖 (趨勢) 不屬於任何區間"""
+    head = image_id.rsplit("_", 1)[0]
+    return head if image_id.rsplit("_", 1)[-1] in ("high", "close", "low") else None
+
+# ========== 分送 ==========
+
+def fan_out(agent, market_id, market_name, img_data, report_df, text_reports, stats=None, trend_text="",
+            config=None, image_root="./output/images", extra_html=""):
+    """
+    依訂閱設定分送個人化報表，回傳成功寄出的封數。report_df、分布圖與內嵌附件全部共用，
+    每位訂閱者只做索引查詢、(有觀察清單時) 一張清單圖與 HTML 組裝；extra_html 為全市場共用區塊 (新高新低警示)。
+    """
+    config = config if config is not None else load_config()
+    subs = subscribers_for(config, market_id)
+    if not subs or report_df is None or report_df.empty:
+        return 0
+    sectors = (config.get("sectors") or {}).get(market_id, {})
+    default_periods = list(text_reports) or [p.lower() for p in analyzer.REPORT_PERIODS]
+
+    with profiler.stage("fanout"):
+        index = ReportIndex(report_df)
+        # 內嵌附件只讀檔、編碼一次，各訂閱者依需要挑選
+        shared = {a["content_id"]: a for a in agent.build_attachments(img_data)}
+        batch, charts = [], 0
+        for sub in subs:
+            periods = list(sub.get("periods") or default_periods)
+            wanted = {p.lower() for p in periods}
+            watch = watch_rows(index, sub, sectors)
+            alerts = alert_rows(index, sub, watch)
+            images = [img for img in img_data if _chart_period(img["id"]) is None or _chart_period(img["id"]) in wanted]
+            chart = render_watch_chart(index, sub, watch, periods, Path(image_root) / market_id / "subscribers")
+            attachments = [shared[img["id"]] for img in images if img["id"] in shared]
+            if chart:
+                charts += 1
+                images = [chart] + images
+                attachments = agent.build_attachments([chart]) + attachments
+            reports = {p: r for p, r in text_reports.items() if p.lower() in wanted}
+            html, _, report_time = agent.build_report_html(
+                market_name, images, report_df, reports, stats, trend_text,
+                extra_html=subscriber_html(index, sub, watch, alerts, periods) + extra_html)
+            batch.append({"to": sub["email"], "html": html, "attachments": attachments,
+                          "subject": f"🚀 {market_name} 監控報告 ({sub['name']}) - {report_time.split(' ')[0]}"})
+        log(f"📬 {market_name} 訂閱報表：{len(batch)} 位訂閱者 | 共用分布圖 {len(shared)} 張 | 另繪觀察清單圖 {charts} 張")
+    with profiler.stage("send"):
+        return agent.send_batch(batch)
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the subscription config and list subscribers")
+    parser.add_argument("--config", default=None, help=f"設定檔路徑 (預設 {CONFIG_ENV} 或 ./subscriptions.json)")
+    args = parser.parse_args()
+
+    path = args.config or config_path()
+    config = load_config(path)
+    if config is None:
+        print(f"⚠️ 找不到訂閱設定檔 {path}")
+        return
+    sectors = config.get("sectors") or {}
+    for sub in config.get("subscribers", []):
+        missing = [s for s in sub.get("sectors", []) if not any(s in v for v in sectors.values())]
+        print(f"📬 {sub['name']} <{sub['email']}> | 市場 {sub.get('markets') or '全部'} | "
+              f"代號 {len(sub.get('tickers', []))} | 類股 {sub.get('sectors', [])} | 門檻 {sub.get('thresholds', {})} | "
+              f"區間 {sub.get('periods') or '預設'}" + (f" | ⚠️ 未定義的類股 {missing}" if missing else ""))
+    print(f"✅ {path}：共 {len(config.get('subscribers', []))} 位訂閱者")
+
+if __name__ == "__main__":
+    main()
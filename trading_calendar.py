@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+各市場交易日曆：交易所時區、收盤時間與休市日。
+下載器以「最後一根 K 線是否已涵蓋最近一個已收盤交易日」判斷資料新鮮度，
+取代過去「檔案修改日期是否為今天」的判斷 (跨午夜、假日、盤中寫入都會誤判)。
+"""
+import os
+import json
+from datetime import datetime, date, time as dtime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import catalog
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 選用：補充或修正休市日，格式 {"tw-share": ["2027-01-01", ...], ...}
+EXTRA_HOLIDAYS_PATH = os.path.join(BASE_DIR, "holidays.json")
+# 最近一次完成管線的交易日 (data/<market>/lists/last_session.txt)
+DATA_ROOT = os.path.join(BASE_DIR, "data")
+
+# 收盤後等待 Yahoo 等資料源完成日 K 結算的緩衝時間
+SETTLE_MINUTES = 30
+
+# ========== 市場設定 ==========
+MARKETS = {
+    "tw-share": {"tz": "Asia/Taipei",      "open": dtime(9, 0),  "close": dtime(13, 30)},
+    "us-share": {"tz": "America/New_York", "open": dtime(9, 30), "close": dtime(16, 0)},
+    "hk-share": {"tz": "Asia/Hong_Kong",   "open": dtime(9, 30), "close": dtime(16, 0)},
+    "cn-share": {"tz": "Asia/Shanghai",    "open": dtime(9, 30), "close": dtime(15, 0)},
+    "jp-share": {"tz": "Asia/Tokyo",       "open": dtime(9, 0),  "close": dtime(15, 30)},
+    "kr-share": {"tz": "Asia/Seoul",       "open": dtime(9, 0),  "close": dtime(15, 30)},
+}
+
+# 週一至週五的休市日 (依各交易所公告)；未列年份只能排除週末，查詢時會發出警告 (見 check_coverage)
+HOLIDAYS = {
+    "tw-share": [
+        "2025-01-01", "2025-01-23", "2025-01-24", "2025-01-27", "2025-01-28", "2025-01-29",
+        "2025-01-30", "2025-01-31", "2025-02-28", "2025-04-03", "2025-04-04", "2025-05-01",
+        "2025-05-30", "2025-09-29", "2025-10-06", "2025-10-10", "2025-10-24", "2025-12-25",
+        "2026-01-01", "2026-02-12", "2026-02-13", "2026-02-16", "2026-02-17", "2026-02-18",
+        "2026-02-19", "2026-02-20", "2026-02-27", "2026-04-03", "2026-04-06", "2026-05-01",
+        "2026-06-19", "2026-09-25", "2026-09-28", "2026-10-09", "2026-10-26", "2026-12-25",
+    ],
+    "us-share": [
+        "2025-01-01", "2025-01-09", "2025-01-20", "2025-02-17", "2025-04-18", "2025-05-26",
+        "2025-06-19", "2025-07-04", "2025-09-01", "2025-11-27", "2025-12-25",
+        "2026-01-01", "2026-01-19", "2026-02-16", "2026-04-03", "2026-05-25", "2026-06-19",
+        "2026-07-03", "2026-09-07", "2026-11-26", "2026-12-25",
+    ],
+    "hk-share": [
+        "2025-01-01", "2025-01-29", "2025-01-30", "2025-01-31", "2025-04-04", "2025-04-18",
+        "2025-04-21", "2025-05-01", "2025-05-05", "2025-07-01", "2025-10-01", "2025-10-07",
+        "2025-10-29", "2025-12-25", "2025-12-26",
+        "2026-01-01", "2026-02-17", "2026-02-18", "2026-02-19", "2026-04-03", "2026-04-06",
+        "2026-04-07", "2026-05-01", "2026-05-25", "2026-06-19", "2026-07-01", "2026-10-01",
+        "2026-10-19", "2026-12-25",
+    ],
+    "cn-share": [
+        "2025-01-01", "2025-01-28", "2025-01-29", "2025-01-30", "2025-01-31", "2025-02-03",
+        "2025-02-04", "2025-04-04", "2025-05-01", "2025-05-02", "2025-05-05", "2025-06-02",
+        "2025-10-01", "2025-10-02", "2025-10-03", "2025-10-06", "2025-10-07", "2025-10-08",
+        "2026-01-01", "2026-01-02", "2026-02-16", "2026-02-17", "2026-02-18", "2026-02-19",
+        "2026-02-20", "2026-02-23", "2026-04-06", "2026-05-01", "2026-05-04", "2026-05-05",
+        "2026-06-19", "2026-09-25", "2026-10-01", "2026-10-02", "2026-10-05", "2026-10-06",
+        "2026-10-07",
+    ],
+    "jp-share": [
+        "2025-01-01", "2025-01-02", "2025-01-03", "2025-01-13", "2025-02-11", "2025-02-24",
+        "2025-03-20", "2025-04-29", "2025-05-05", "2025-05-06", "2025-07-21", "2025-08-11",
+        "2025-09-15", "2025-09-23", "2025-10-13", "2025-11-03", "2025-11-24", "2025-12-31",
+        "2026-01-01", "2026-01-02", "2026-01-12", "2026-02-11", "2026-02-23", "2026-03-20",
+        "2026-04-29", "2026-05-04", "2026-05-05", "2026-05-06", "2026-07-20", "2026-08-11",
+        "2026-09-21", "2026-09-22", "2026-09-23", "2026-10-12", "2026-11-03", "2026-11-23",
+        "2026-12-31",
+    ],
+    "kr-share": [
+        "2025-01-01", "2025-01-27", "2025-01-28", "2025-01-29", "2025-01-30", "2025-03-03",
+        "2025-05-01", "2025-05-05", "2025-05-06", "2025-06-03", "2025-06-06", "2025-08-15",
+        "2025-10-03", "2025-10-06", "2025-10-07", "2025-10-08", "2025-10-09", "2025-12-25",
+        "2025-12-31",
+        "2026-01-01", "2026-02-16", "2026-02-17", "2026-02-18", "2026-03-02", "2026-05-01",
+        "2026-05-05", "2026-05-25", "2026-06-03", "2026-08-17", "2026-09-24", "2026-09-25",
+        "2026-10-05", "2026-10-09", "2026-12-25", "2026-12-31",
+    ],
+}
+
+# 提早收盤日 (美股感恩節翌日、聖誕夜等)
+EARLY_CLOSES = {
+    "us-share": {"2025-07-03": dtime(13, 0), "2025-11-28": dtime(13, 0), "2025-12-24": dtime(13, 0),
+                 "2026-11-27": dtime(13, 0), "2026-12-24": dtime(13, 0)},
+}
+
+# ========== 日曆查詢 ==========
+
+@lru_cache(maxsize=None)
+def holidays(market_id):
+    days = {date.fromisoformat(d) for d in HOLIDAYS.get(market_id, [])}
+    if os.path.exists(EXTRA_HOLIDAYS_PATH):
+        try:
+            with open(EXTRA_HOLIDAYS_PATH, encoding="utf-8") as f:
+                days |= {date.fromisoformat(d) for d in json.load(f).get(market_id, [])}
+        except (ValueError, OSError):
+            pass
+    return frozenset(days)
+
+@lru_cache(maxsize=None)
+def covered_years(market_id):
+    """有休市日資料的年份 (HOLIDAYS 與 holidays.json)"""
+    return frozenset(d.year for d in holidays(market_id))
+
+# 已警告過缺少休市日資料的 (市場, 年份)，每組只警告一次
+_UNCOVERED_WARNED = set()
+
+def check_coverage(market_id, year):
+    """
+    該年是否有休市日資料。沒有時大聲警告：休市日會被當成交易日，導致新鮮度判斷全數失效 (整批重抓)、
+    整批行情附加判定為缺口、報告標示成休市日期。
+    """
+    if year in covered_years(market_id):
+        return True
+    if (market_id, year) not in _UNCOVERED_WARNED:
+        _UNCOVERED_WARNED.add((market_id, year))
+        print(f"🚨 [交易日曆] {market_id} 缺少 {year} 年的休市日資料，目前只排除週末 (休市日會被當成交易日)！"
+              f"請更新 trading_calendar.HOLIDAYS 或 {EXTRA_HOLIDAYS_PATH}")
+    return False
+
+def market_tz(market_id):
+    return ZoneInfo(MARKETS[market_id]["tz"])
+
+def is_trading_day(market_id, day):
+    check_coverage(market_id, day.year)
+    return day.weekday() < 5 and day not in holidays(market_id)
+
+def previous_trading_day(market_id, day):
+    day -= timedelta(days=1)
+    while not is_trading_day(market_id, day):
+        day -= timedelta(days=1)
+    return day
+
+def session_close(market_id, day):
+    """該交易日收盤的時間點 (含時區)"""
+    close = EARLY_CLOSES.get(market_id, {}).get(day.isoformat(), MARKETS[market_id]["close"])
+    return datetime.combine(day, close, tzinfo=market_tz(market_id))
+
+def local_today(market_id, now=None):
+    """交易所當地的今天日期"""
+    return (now or datetime.now(timezone.utc)).astimezone(market_tz(market_id)).date()
+
+def is_session_open(market_id, now=None):
+    """目前是否在交易時段內 (開盤至收盤，不含午休判斷)"""
+    now = now or datetime.now(timezone.utc)
+    today = local_today(market_id, now)
+    if not is_trading_day(market_id, today):
+        return False
+    opened = datetime.combine(today, MARKETS[market_id]["open"], tzinfo=market_tz(market_id))
+    return opened <= now < session_close(market_id, today)
+
+def latest_completed_session(market_id, now=None):
+    """最近一個已收盤 (並經過結算緩衝) 的交易日，以交易所當地日期表示"""
+    now = now or datetime.now(timezone.utc)
+    local = now.astimezone(market_tz(market_id))
+    today = local.date()
+    if is_trading_day(market_id, today) and local >= session_close(market_id, today) + timedelta(minutes=SETTLE_MINUTES):
+        return today
+    return previous_trading_day(market_id, today)
+
+# ========== 資料新鮮度 ==========
+
+def is_current(market_id, last_bar, written_at, session=None):
+    """
+    last_bar: 最後一根 K 線的日期；written_at: 該資料寫入時間 (含時區)。
+    最後一根 K 線若正好是最近交易日，還必須是收盤後寫入，否則可能只是盤中的半根 K 線。
+    """
+    if last_bar is None:
+        return False
+    session = session or latest_completed_session(market_id)
+    if last_bar > session:
+        return True
+    return last_bar == session and written_at is not None and written_at >= session_close(market_id, session)
+
+def last_bar_date(path):
+    """只讀 CSV 檔尾，取得最後一列的日期 (第一欄)"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 512))
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        head = line.split(b",", 1)[0].strip().decode("utf-8", "ignore")
+        try:
+            return date.fromisoformat(head[:10])
+        except ValueError:
+            continue
+    return None
+
+def is_fresh(market_id, path, session=None):
+    """
+    CSV 快取是否已涵蓋最近一個已收盤交易日。
+    優先查資料目錄 (末根 K 線日期與寫入時間)；未登錄的檔案才讀檔尾並以修改時間作為寫入時間。
+    """
+    cat = catalog.existing(os.path.dirname(os.path.dirname(os.path.abspath(path))))
+    entry = cat.lookup(path) if cat is not None else None
+    if entry and entry.get("last_date") and entry.get("written_at"):
+        return is_current(market_id, date.fromisoformat(entry["last_date"]),
+                          datetime.fromisoformat(entry["written_at"]), session)
+    if not os.path.exists(path):
+        return False
+    written_at = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+    return is_current(market_id, last_bar_date(path), written_at, session)
+
+# ========== 管線層級的短路判斷 ==========
+
+def _marker_path(market_id, root=None):
+    return os.path.join(root or DATA_ROOT, market_id, "lists", "last_session.txt")
+
+def last_processed_session(market_id, root=None):
+    try:
+        with open(_marker_path(market_id, root), encoding="utf-8") as f:
+            return date.fromisoformat(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def mark_session_processed(market_id, session, root=None):
+    path = _marker_path(market_id, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(session.isoformat())
+
+def has_new_session(market_id, root=None, now=None):
+    """自上次完成管線以來是否出現新的已收盤交易日 (假日、重複排程時為 False)"""
+    done = last_processed_session(market_id, root)
+    return done is None or latest_completed_session(market_id, now) > done
+
+def split_fresh(market_id, items, path_fn, session=None):
+    """把待辦清單分成 (已是最新, 需要下載)；path_fn 回傳該標的的 CSV 路徑 (無法解析時回傳 None)"""
+    session = session or latest_completed_session(market_id)
+    fresh, stale = [], []
+    for it in items:
+        path = path_fn(it)
+        (fresh if path and is_fresh(market_id, path, session) else stale).append(it)
+    return fresh, stale